@@ -4,11 +4,26 @@ API路由定义
 """
 
 from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
+import json
+import os
 import logging
 
+import metrics
+from camera_import import import_cameras, parse_import
+from camera_manager import POLICY_FIELDS
+from exporter import ARCHIVE_FORMATS, build_layout, parse_range
+from http_cache import make_etag, not_modified, set_etag
+from profiler import MAX_DURATION, ProfilerBusyError, format_collapsed, sample_stacks
+from recording_coverage import camera_coverage, parse_bucket
+from snapshot import SNAPSHOT_FORMATS
+from status_stream import build_system_status
+from thumbnails import THUMBNAILS_SUBDIR, ThumbnailGenerator
+
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
@@ -25,6 +40,36 @@ def get_recording_manager(request: Request):
     return request.app.state.recording_manager
 
 
+def get_retention_manager(request: Request):
+    """从app.state获取retention_manager（未启用自动删除时为None）"""
+    return request.app.state.retention_manager
+
+
+def get_config_reloader(request: Request):
+    """从app.state获取config_reloader"""
+    return request.app.state.config_reloader
+
+
+def get_stream_prober(request: Request):
+    """从app.state获取stream_prober"""
+    return request.app.state.stream_prober
+
+
+def get_snapshot_service(request: Request):
+    """从app.state获取snapshot_service"""
+    return request.app.state.snapshot_service
+
+
+def get_exporter(request: Request):
+    """从app.state获取exporter"""
+    return request.app.state.exporter
+
+
+def get_status_broadcaster(request: Request):
+    """从app.state获取status_broadcaster"""
+    return request.app.state.status_broadcaster
+
+
 # ===== 数据模型 =====
 
 class CameraCreate(BaseModel):
@@ -33,6 +78,12 @@ class CameraCreate(BaseModel):
     name: str
     rtsp_url: str
     enabled: bool = True
+    quota_gb: Optional[float] = None  # 录像存储配额（GB）
+    retention_days: Optional[int] = None  # 录像保留天数（默认使用全局配置）
+    segment_duration: Optional[int] = None  # 分段时长（秒）
+    streams: Optional[Dict[str, str]] = None  # 额外码流 {名称: RTSP地址}
+    stream: Optional[str] = None  # 录制使用的码流名称（main表示rtsp_url）
+    ffmpeg_profile: Optional[str] = None  # FFmpeg参数模板名称
 
 
 class CameraUpdate(BaseModel):
@@ -40,6 +91,19 @@ class CameraUpdate(BaseModel):
     name: Optional[str] = None
     rtsp_url: Optional[str] = None
     enabled: Optional[bool] = None
+    # 策略字段：0或空值表示恢复使用全局配置
+    quota_gb: Optional[float] = None
+    retention_days: Optional[int] = None
+    segment_duration: Optional[int] = None
+    streams: Optional[Dict[str, str]] = None
+    stream: Optional[str] = None
+    ffmpeg_profile: Optional[str] = None
+
+
+class CameraBatchRequest(BaseModel):
+    """批量修改摄像机请求"""
+    # 每项为 {"op": "add"|"update"|"remove", "id": 摄像机ID, 其他字段同CameraCreate/CameraUpdate}
+    changes: List[dict]
 
 
 class RecordingStartRequest(BaseModel):
@@ -57,19 +121,92 @@ class RecordingQueryRequest(BaseModel):
     camera_id: str
     start_time: str  # ISO格式时间字符串
     end_time: str    # ISO格式时间字符串
+    include_timing: bool = False  # 是否返回各阶段耗时
+
+
+class BatchQueryItem(BaseModel):
+    """批量查询中的一个摄像机/时间段"""
+    camera_id: str
+    start_time: str  # ISO格式时间字符串
+    end_time: str    # ISO格式时间字符串
+
+
+class BatchQueryRequest(BaseModel):
+    """批量录像查询请求"""
+    items: List[BatchQueryItem]
+    archive: bool = False  # 是否把所有结果打包为一个ZIP文件
+    include_timing: bool = False  # 是否返回各阶段耗时
+
+
+class TimelapseRequest(BaseModel):
+    """延时视频导出请求"""
+    camera_id: str
+    start_time: str  # ISO格式时间字符串
+    end_time: str    # ISO格式时间字符串
+    fps: Optional[float] = None  # 输出帧率（每个关键帧占 1/fps 秒）
+
+
+# ===== 录像段列表（分页） =====
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+SEGMENT_FIELDS = ("path", "filename", "start_time", "end_time", "duration", "size")
+
+
+def parse_segment_fields(fields: Optional[str]) -> Optional[tuple]:
+    """解析字段选择参数（None表示全部字段）"""
+    if not fields:
+        return None
+    selected = tuple(field.strip() for field in fields.split(",") if field.strip())
+    unknown = [field for field in selected if field not in SEGMENT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(SEGMENT_FIELDS)}")
+    return selected
+
+
+def project_segment(segment, selected: Optional[tuple]) -> dict:
+    """录像段转换为字典（只保留选择的字段）"""
+    info = segment.to_dict()
+    if selected is None:
+        return info
+    return {field: info[field] for field in selected}
+
+
+def iter_segments(segment_index, camera_id: str, start_time: Optional[datetime],
+                  end_time: Optional[datetime], after: Optional[datetime], limit: Optional[int]):
+    """按页从索引读取录像段（每次只持有一页）"""
+    remaining = limit
+    while remaining is None or remaining > 0:
+        page_size = MAX_PAGE_SIZE if remaining is None else min(remaining, MAX_PAGE_SIZE)
+        page = segment_index.page(camera_id, start_time, end_time, after, page_size)
+        yield from page
+        if len(page) < page_size:
+            break
+        after = page[-1].start_time
+        if remaining is not None:
+            remaining -= len(page)
 
 
 # ===== 摄像机管理接口 =====
 
 @router.get("/cameras")
-async def list_cameras(request: Request):
-    """列出所有摄像机"""
+async def list_cameras(request: Request, response: Response):
+    """列出所有摄像机（支持If-None-Match，未变化时返回304）"""
     camera_manager = get_camera_manager(request)
 
-    cameras = camera_manager.list_cameras()
+    # 配置版本号和录像状态决定响应内容，匹配时不生成列表
+    snapshot = camera_manager.snapshot()
+    etag = make_etag("cameras", snapshot.version,
+                     tuple(cam.is_recording for cam in snapshot.cameras.values()))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    set_etag(response, etag)
     return {
         "success": True,
-        "cameras": [cam.to_dict() for cam in cameras]
+        "version": snapshot.version,
+        "cameras": [cam.to_dict() for cam in snapshot.cameras.values()]
     }
 
 
@@ -83,7 +220,8 @@ async def add_camera(camera: CameraCreate, request: Request):
             camera_id=camera.id,
             name=camera.name,
             rtsp_url=camera.rtsp_url,
-            enabled=camera.enabled
+            enabled=camera.enabled,
+            **{field: getattr(camera, field) for field in POLICY_FIELDS}
         )
         return {
             "success": True,
@@ -97,6 +235,55 @@ async def add_camera(camera: CameraCreate, request: Request):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/cameras/batch")
+async def batch_cameras(data: CameraBatchRequest, request: Request):
+    """批量添加/更新/删除摄像机（全部校验通过后一次性应用并保存）"""
+    camera_manager = get_camera_manager(request)
+
+    try:
+        results = await run_in_threadpool(camera_manager.apply_changes, data.changes)
+        return {
+            "success": True,
+            "message": f"Applied {len(results)} camera changes",
+            "cameras": [camera.to_dict() if camera else None for camera in results]
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error applying camera changes: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/cameras/import")
+async def import_cameras_endpoint(
+    request: Request,
+    probe: bool = Query(True, description="探测码流，只导入可连接的摄像机"),
+    dry_run: bool = Query(False, description="只校验和探测，不导入")
+):
+    """
+    批量导入摄像机（JSON列表或CSV，Content-Type: text/csv）
+
+    并发探测所有码流，返回每个摄像机的结果，有效的摄像机一次性加入配置
+    """
+    camera_manager = get_camera_manager(request)
+
+    try:
+        cameras = parse_import(await request.body(), request.headers.get('content-type'))
+        result = await run_in_threadpool(
+            import_cameras, camera_manager, get_stream_prober(request), cameras,
+            probe=probe, dry_run=dry_run
+        )
+        return {
+            "success": True,
+            "data": result
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error importing cameras: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/cameras/{camera_id}")
 async def get_camera(camera_id: str, request: Request):
     """获取摄像机信息"""
@@ -122,7 +309,8 @@ async def update_camera(camera_id: str, camera: CameraUpdate, request: Request):
             camera_id=camera_id,
             name=camera.name,
             rtsp_url=camera.rtsp_url,
-            enabled=camera.enabled
+            enabled=camera.enabled,
+            **{field: getattr(camera, field) for field in POLICY_FIELDS}
         )
         return {
             "success": True,
@@ -144,6 +332,7 @@ async def delete_camera(camera_id: str, request: Request):
     try:
         success = camera_manager.remove_camera(camera_id)
         if success:
+            metrics.remove_camera(camera_id)
             return {
                 "success": True,
                 "message": f"Camera {camera_id} deleted successfully"
@@ -165,7 +354,8 @@ async def start_recording(data: RecordingStartRequest, request: Request):
     recording_manager = get_recording_manager(request)
 
     try:
-        recording_manager.start_recording(data.camera_id)
+        # 启停录像会等待FFmpeg进程，在线程池中执行，不阻塞其他摄像机的请求
+        await run_in_threadpool(recording_manager.start_recording, data.camera_id)
         return {
             "success": True,
             "message": f"Recording started for camera {data.camera_id}"
@@ -183,7 +373,7 @@ async def stop_recording(data: RecordingStopRequest, request: Request):
     recording_manager = get_recording_manager(request)
 
     try:
-        result = recording_manager.stop_recording(data.camera_id)
+        result = await run_in_threadpool(recording_manager.stop_recording, data.camera_id)
         return {
             "success": True,
             "message": f"Recording stopped for camera {data.camera_id}",
@@ -200,10 +390,20 @@ async def stop_recording(data: RecordingStopRequest, request: Request):
 async def get_recordings(
     camera_id: str,
     request: Request,
+    response: Response,
     start_time: Optional[str] = Query(None, description="开始时间(ISO格式)"),
-    end_time: Optional[str] = Query(None, description="结束时间(ISO格式)")
+    end_time: Optional[str] = Query(None, description="结束时间(ISO格式)"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="每页数量（启用分页）"),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页的next_cursor）"),
+    fields: Optional[str] = Query(None, description="返回的字段（逗号分隔）"),
+    format: str = Query("json", pattern="^(json|ndjson)$", description="json或ndjson（逐行流式输出）")
 ):
-    """获取指定相机的录像文件列表"""
+    """
+    获取指定相机的录像文件列表（支持If-None-Match，未变化时返回304）
+
+    指定limit、cursor、fields或format=ndjson时从录像段索引按开始时间分页读取，
+    内存占用与每页数量成正比；ndjson格式逐行输出，客户端可以立即处理第一批结果
+    """
     camera_manager = get_camera_manager(request)
     recording_manager = get_recording_manager(request)
 
@@ -216,9 +416,44 @@ async def get_recordings(
         # 解析时间参数
         start_dt = datetime.fromisoformat(start_time) if start_time else None
         end_dt = datetime.fromisoformat(end_time) if end_time else None
+        after = datetime.fromisoformat(cursor) if cursor else None
+        selected = parse_segment_fields(fields)
+
+        if format == "ndjson":
+            segments = iter_segments(recording_manager.segment_index, camera_id, start_dt, end_dt, after, limit)
+            return StreamingResponse(
+                (json.dumps(project_segment(segment, selected), ensure_ascii=False) + "\n" for segment in segments),
+                media_type="application/x-ndjson"
+            )
 
         # 获取录像器
         recorder = recording_manager.recorders.get(camera_id)
+
+        # 目录中的文件新增、重命名或删除都会改变目录的修改时间，
+        # 未变化时不需要扫描目录
+        try:
+            dir_mtime = os.stat(os.path.join(recording_manager.output_dir, camera_id)).st_mtime_ns
+        except FileNotFoundError:
+            dir_mtime = None
+        etag = make_etag("recordings", camera_id, recorder is not None, dir_mtime,
+                         start_time, end_time, limit, cursor, fields)
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
+        set_etag(response, etag)
+
+        if limit is not None or cursor is not None or selected is not None:
+            page_size = limit or DEFAULT_PAGE_SIZE
+            page = recording_manager.segment_index.page(camera_id, start_dt, end_dt, after, page_size)
+            return {
+                "success": True,
+                "camera_id": camera_id,
+                "files": [project_segment(segment, selected) for segment in page],
+                "count": len(page),
+                # 返回数量等于每页数量时可能还有下一页
+                "next_cursor": page[-1].start_time.isoformat() if len(page) == page_size else None
+            }
+
         if not recorder:
             # 如果录像器不存在，返回空列表
             return {
@@ -229,8 +464,8 @@ async def get_recordings(
                 "total_size": 0
             }
 
-        # 获取录像文件
-        files = recorder.get_recorded_files(start_time=start_dt, end_time=end_dt)
+        # 获取录像文件（扫描目录，在线程池中执行）
+        files = await run_in_threadpool(recorder.get_recorded_files, start_time=start_dt, end_time=end_dt)
         total_size = sum(f.get("size", 0) for f in files)
 
         return {
@@ -248,6 +483,71 @@ async def get_recordings(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/coverage")
+async def get_coverage(
+    request: Request,
+    start_time: str = Query(..., description="开始时间(ISO格式)"),
+    end_time: str = Query(..., description="结束时间(ISO格式)"),
+    camera_ids: Optional[str] = Query(None, description="摄像机ID（逗号分隔，默认全部）"),
+    bucket: Optional[str] = Query(None, description="覆盖率分桶：minute、hour、day或秒数"),
+    tolerance: float = Query(2, ge=0, description="视为连续的最大间隔（秒）"),
+    include_current: bool = Query(True, description="包含正在录制的分段")
+):
+    """
+    录像覆盖情况：合并后的已录制区间、缺口和按时间分桶的覆盖率
+
+    只使用录像段索引中的时间信息，不读取录像文件
+    """
+    camera_manager = get_camera_manager(request)
+    recording_manager = get_recording_manager(request)
+
+    try:
+        start_dt = datetime.fromisoformat(start_time)
+        end_dt = datetime.fromisoformat(end_time)
+        if end_dt <= start_dt:
+            raise ValueError("end_time must be after start_time")
+        bucket_seconds = parse_bucket(bucket)
+
+        if camera_ids:
+            ids = [camera_id.strip() for camera_id in camera_ids.split(",") if camera_id.strip()]
+        else:
+            ids = list(camera_manager.snapshot().cameras)
+        for camera_id in ids:
+            if not camera_manager.get_camera(camera_id):
+                raise HTTPException(status_code=404, detail=f"Camera {camera_id} not found")
+
+        def compute():
+            now = datetime.now()
+            results = []
+            for camera_id in ids:
+                current = None
+                if include_current:
+                    segment = recording_manager.get_current_segment(camera_id)
+                    if segment:
+                        current = (segment[1], now)
+                results.append(camera_coverage(
+                    recording_manager.segment_index, camera_id, start_dt, end_dt,
+                    bucket_seconds=bucket_seconds, tolerance=tolerance, current=current
+                ))
+            return results
+
+        return {
+            "success": True,
+            "start_time": start_dt.isoformat(),
+            "end_time": end_dt.isoformat(),
+            "bucket_seconds": bucket_seconds,
+            "cameras": await run_in_threadpool(compute)
+        }
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error computing coverage: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.post("/recording/query")
 async def query_recordings(data: RecordingQueryRequest, request: Request):
     """查询指定时间段的录像"""
@@ -258,10 +558,12 @@ async def query_recordings(data: RecordingQueryRequest, request: Request):
         start_time = datetime.fromisoformat(data.start_time)
         end_time = datetime.fromisoformat(data.end_time)
 
-        result = recording_manager.query_recordings(
+        result = await run_in_threadpool(
+            recording_manager.query_recordings,
             camera_id=data.camera_id,
             start_time=start_time,
-            end_time=end_time
+            end_time=end_time,
+            include_timing=data.include_timing
         )
 
         return {
@@ -276,6 +578,122 @@ async def query_recordings(data: RecordingQueryRequest, request: Request):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/recording/export")
+async def export_recordings(
+    request: Request,
+    camera_id: str = Query(..., description="摄像机ID"),
+    start_time: str = Query(..., description="开始时间(ISO格式)"),
+    end_time: str = Query(..., description="结束时间(ISO格式)"),
+    format: str = Query("zip", pattern="^(zip|tar)$", description="归档格式：zip（仅存储）或tar")
+):
+    """
+    导出与指定时间段重叠的完整录像段（ZIP或TAR，包含记录各段起止时间的manifest.json）
+
+    归档直接由源文件流式输出，不截取、不在服务器上生成文件；总大小预先确定，
+    支持Range/If-Range断点续传（源文件未变化时续传请求得到相同的归档，与进程重启无关）
+    """
+    exporter = get_exporter(request)
+
+    try:
+        start_dt = datetime.fromisoformat(start_time)
+        end_dt = datetime.fromisoformat(end_time)
+        entries = await run_in_threadpool(exporter.prepare, camera_id, start_dt, end_dt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error preparing export for {camera_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    layout = build_layout(entries, format)
+    # ETag由请求的时间段和源录像段（名称、大小、修改时间）决定
+    etag = make_etag("export", format, camera_id, start_dt.isoformat(), end_dt.isoformat(),
+                     [(entry.name, entry.size, entry.mtime) for entry in entries])
+    filename = f"{camera_id}_{start_dt.strftime('%Y%m%d_%H%M%S')}_{end_dt.strftime('%Y%m%d_%H%M%S')}.{format}"
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    }
+
+    # If-Range不匹配（文件已变化）时忽略Range，返回完整归档
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), layout.size)
+        except ValueError:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{layout.size}"})
+
+    if byte_range is None:
+        headers["Content-Length"] = str(layout.size)
+        return StreamingResponse(layout.iter_range(), media_type=ARCHIVE_FORMATS[format], headers=headers)
+
+    start, end = byte_range
+    headers["Content-Length"] = str(end - start)
+    headers["Content-Range"] = f"bytes {start}-{end - 1}/{layout.size}"
+    return StreamingResponse(layout.iter_range(start, end), status_code=206,
+                             media_type=ARCHIVE_FORMATS[format], headers=headers)
+
+
+@router.post("/recording/batch_query")
+async def batch_query_recordings(data: BatchQueryRequest, request: Request):
+    """批量查询多个摄像机/时间段的录像（统一规划、并发截取，可打包为一个ZIP文件）"""
+    recording_manager = get_recording_manager(request)
+
+    try:
+        items = [
+            (item.camera_id, datetime.fromisoformat(item.start_time), datetime.fromisoformat(item.end_time))
+            for item in data.items
+        ]
+        result = await run_in_threadpool(recording_manager.query_batch, items,
+                                         archive=data.archive, include_timing=data.include_timing)
+
+        return {
+            "success": True,
+            "result": result
+        }
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in batch query: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/recording/timelapse")
+async def export_timelapse(data: TimelapseRequest, request: Request):
+    """导出指定时间段的关键帧延时视频"""
+    camera_manager = get_camera_manager(request)
+    recording_manager = get_recording_manager(request)
+
+    if not camera_manager.get_camera(data.camera_id):
+        raise HTTPException(status_code=404, detail=f"Camera {data.camera_id} not found")
+
+    try:
+        start_time = datetime.fromisoformat(data.start_time)
+        end_time = datetime.fromisoformat(data.end_time)
+        if end_time <= start_time:
+            raise ValueError("end_time must be after start_time")
+        if data.fps is not None and not 1 <= data.fps <= 120:
+            raise ValueError("fps must be between 1 and 120")
+
+        result = await run_in_threadpool(
+            recording_manager.export_timelapse,
+            data.camera_id, start_time, end_time, data.fps
+        )
+
+        return {
+            "success": True,
+            "result": result
+        }
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error exporting timelapse: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/recording/status/{camera_id}")
 async def get_recording_status(camera_id: str, request: Request):
     """获取摄像机录像状态"""
@@ -296,24 +714,184 @@ async def get_recording_status(camera_id: str, request: Request):
     }
 
 
-# ===== 系统状态接口 =====
+# ===== 快照接口 =====
 
-@router.get("/status")
-async def get_system_status(request: Request):
-    """获取系统状态"""
+@router.get("/snapshot/{camera_id}")
+async def get_snapshot(
+    camera_id: str,
+    request: Request,
+    t: str = Query(..., description="时间点(ISO格式)"),
+    width: Optional[int] = Query(None, ge=16, le=3840, description="输出宽度"),
+    height: Optional[int] = Query(None, ge=16, le=2160, description="输出高度"),
+    format: str = Query("jpeg", description="输出格式(jpeg/webp)")
+):
+    """获取指定时间点最近关键帧的快照图像"""
+    camera_manager = get_camera_manager(request)
+    snapshot_service = get_snapshot_service(request)
+
+    camera = camera_manager.get_camera(camera_id)
+    if not camera:
+        raise HTTPException(status_code=404, detail=f"Camera {camera_id} not found")
+
+    try:
+        at = datetime.fromisoformat(t)
+
+        # FFmpeg解码在线程池中执行，避免阻塞事件循环
+        data = await run_in_threadpool(
+            snapshot_service.get_snapshot, camera_id, at, width, height, format
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error creating snapshot for {camera_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if data is None:
+        raise HTTPException(status_code=404, detail=f"No recording found for camera {camera_id} at {t}")
+
+    return Response(
+        content=data,
+        media_type=SNAPSHOT_FORMATS[format][1],
+        headers={"Cache-Control": "private, max-age=3600"}
+    )
+
+
+# ===== 缩略图接口 =====
+
+@router.get("/thumbnails/{camera_id}/track.vtt")
+async def get_thumbnail_track(
+    camera_id: str,
+    request: Request,
+    start_time: str = Query(..., description="开始时间(ISO格式)"),
+    end_time: str = Query(..., description="结束时间(ISO格式)")
+):
+    """获取时间段内拼接后的WebVTT缩略图轨道（每个录像段一张雪碧图）"""
+    camera_manager = get_camera_manager(request)
+    recording_manager = get_recording_manager(request)
+
+    camera = camera_manager.get_camera(camera_id)
+    if not camera:
+        raise HTTPException(status_code=404, detail=f"Camera {camera_id} not found")
+
+    try:
+        start_dt = datetime.fromisoformat(start_time)
+        end_dt = datetime.fromisoformat(end_time)
+        if end_dt <= start_dt:
+            raise ValueError("end_time must be after start_time")
+
+        # 录像段从索引读取；读取各录像段的VTT在线程池中进行，不阻塞事件循环
+        segments = [segment.to_dict() for segment in
+                    recording_manager.segment_index.page(camera_id, start_dt, end_dt)]
+        track = await run_in_threadpool(
+            ThumbnailGenerator.build_track, segments, start_dt, end_dt,
+            url_prefix=f"{request.scope.get('root_path', '')}/api/thumbnails/{camera_id}/sprites/"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error building thumbnail track for {camera_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return Response(content=track, media_type="text/vtt")
+
+
+@router.get("/thumbnails/{camera_id}/sprites/{filename}")
+async def get_thumbnail_sprite(camera_id: str, filename: str, request: Request):
+    """获取录像段的雪碧图"""
     camera_manager = get_camera_manager(request)
     recording_manager = get_recording_manager(request)
 
-    cameras = camera_manager.list_cameras()
-    recording_count = sum(1 for cam in cameras if recording_manager.is_recording(cam.id))
+    camera = camera_manager.get_camera(camera_id)
+    if not camera:
+        raise HTTPException(status_code=404, detail=f"Camera {camera_id} not found")
+
+    if os.path.basename(filename) != filename or not filename.endswith(".jpg"):
+        raise HTTPException(status_code=400, detail=f"Invalid sprite name: {filename}")
+
+    sprite_path = os.path.join(recording_manager.output_dir, camera_id, THUMBNAILS_SUBDIR, filename)
+    if not os.path.isfile(sprite_path):
+        raise HTTPException(status_code=404, detail=f"Sprite {filename} not found")
+
+    return FileResponse(sprite_path, media_type="image/jpeg",
+                        headers={"Cache-Control": "private, max-age=86400"})
 
+
+# ===== 系统状态接口 =====
+
+@router.get("/status")
+async def get_system_status(request: Request, response: Response):
+    """获取系统状态（支持If-None-Match，未变化时返回304）"""
+    status = build_system_status(get_camera_manager(request), get_recording_manager(request))
+    etag = make_etag("status", status)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    set_etag(response, etag)
     return {
         "success": True,
-        "status": {
-            "total_cameras": len(cameras),
-            "enabled_cameras": len(camera_manager.get_enabled_cameras()),
-            "recording_cameras": recording_count
-        }
+        "status": status
+    }
+
+
+@router.get("/events")
+async def status_events(request: Request):
+    """
+    状态推送（Server-Sent Events）
+
+    连接后立即收到一次status事件，之后只在摄像机或录像状态变化时推送status事件，
+    并周期性推送metrics事件（录像器计数增量和FFmpeg任务状态）
+    """
+    broadcaster = get_status_broadcaster(request)
+    queue = broadcaster.subscribe()
+
+    async def stream():
+        try:
+            while True:
+                message = await queue.get()
+                if message is None:
+                    break
+                yield message
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/admin/profile", response_class=PlainTextResponse)
+async def profile_threads(
+    seconds: float = Query(5, gt=0, le=MAX_DURATION, description="采样时间（秒）"),
+    interval: float = Query(0.01, ge=0.001, le=1, description="采样间隔（秒）"),
+    thread: Optional[str] = Query(None, description="只采集名称包含此字符串的线程")
+):
+    """
+    对所有线程（包括事件循环）进行限时采样，返回折叠栈文本
+
+    输出可直接交给flamegraph.pl或speedscope生成火焰图；同一时间只允许一次采样
+    """
+    try:
+        stacks = await run_in_threadpool(sample_stacks, seconds, interval, thread)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return PlainTextResponse(format_collapsed(stacks))
+
+
+@router.get("/retention")
+async def get_retention_status(request: Request):
+    """获取录像保留（自动删除）状态和进度"""
+    retention_manager = get_retention_manager(request)
+
+    return {
+        "success": True,
+        "enabled": retention_manager is not None,
+        "retention": retention_manager.get_status() if retention_manager else None
     }
 
 
@@ -329,20 +907,18 @@ async def health_check():
 # ===== 配置管理接口 =====
 
 @router.get("/settings")
-async def get_settings():
-    """获取系统设置"""
-    import yaml
+async def get_settings(request: Request, response: Response):
+    """获取系统设置（配置文件未变化时使用内存快照，支持If-None-Match）"""
     try:
-        with open('config.yaml', 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f)
+        etag, settings = get_config_reloader(request).settings_snapshot()
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
 
+        set_etag(response, etag)
         return {
             "success": True,
-            "settings": {
-                "recording": config.get('recording', {}),
-                "ffmpeg": config.get('ffmpeg', {}),
-                "server": config.get('server', {})
-            }
+            "settings": settings
         }
     except Exception as e:
         logger.error(f"Error loading settings: {e}")
@@ -350,31 +926,38 @@ async def get_settings():
 
 
 @router.post("/settings")
-async def update_settings(settings: dict):
-    """更新系统设置"""
-    import yaml
+async def update_settings(settings: dict, request: Request):
+    """更新系统设置（保存后立即热加载）"""
     try:
-        # 读取现有配置
-        with open('config.yaml', 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f)
-
-        # 更新配置
-        if 'recording' in settings:
-            config['recording'].update(settings['recording'])
+        # 热加载：只重启生效参数变化的录像器
+        result = await run_in_threadpool(get_config_reloader(request).update_settings, settings)
+        message = "Settings updated and applied successfully."
+        if result["restart_required"]:
+            message += f" Restart the server to apply: {', '.join(result['restart_required'])}"
 
-        if 'ffmpeg' in settings:
-            config['ffmpeg'].update(settings['ffmpeg'])
-
-        # 保存配置
-        with open('config.yaml', 'w', encoding='utf-8') as f:
-            yaml.dump(config, f, default_flow_style=False, allow_unicode=True)
+        return {
+            "success": True,
+            "message": message,
+            "data": result
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error updating settings: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        logger.info("Settings updated successfully")
 
+@router.post("/settings/reload")
+async def reload_settings(request: Request):
+    """从config.yaml重新加载配置（等同于发送SIGHUP），只重启生效参数变化的录像器"""
+    try:
+        result = await run_in_threadpool(get_config_reloader(request).reload)
         return {
             "success": True,
-            "message": "Settings updated successfully. Please restart the server for changes to take effect."
+            "data": result
         }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Error updating settings: {e}")
+        logger.error(f"Error reloading settings: {e}")
         raise HTTPException(status_code=500, detail=str(e))
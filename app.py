@@ -2,45 +2,123 @@
 IP Camera Recorder 主应用
 """
 
+import atexit
 import os
+import queue
+import signal
 import sys
 import yaml
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
-import threading
-import time
-from datetime import datetime, timedelta
+from typing import Optional
 
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 import uvicorn
 
 from camera_manager import CameraManager
+from recorder import FFMPEG_LOGGER
 from recording_manager import RecordingManager
+from snapshot import SnapshotService
+from stream_probe import StreamProber
+from ffmpeg_scheduler import get_scheduler
+from retention import RetentionManager, retention_options
+from config_reloader import ConfigReloader
+from status_stream import StatusBroadcaster
+from exporter import RecordingExporter
+from query_trace import SLOW_QUERY_LOGGER
+from request_timing import RequestTimingMiddleware, collect_in_flight
+import metrics
 from api.routes import router as api_router
 
 # ===== 全局变量 =====
 camera_manager = None
 recording_manager = None
+snapshot_service = None
 config = None
+_log_listener: Optional["LogQueueListener"] = None  # 后台写日志线程
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    队列已满时丢弃日志记录（计入指标），记录日志的线程（包括事件循环）从不等待；
+    队列容量的一部分只留给WARNING及以上的记录，低级别日志过多时不会挤掉警告和错误
+    """
+
+    # 为WARNING及以上记录保留的队列容量比例
+    WARNING_RESERVE_RATIO = 0.1
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        reserve = max(1, int(log_queue.maxsize * self.WARNING_RESERVE_RATIO)) if log_queue.maxsize > 0 else 0
+        # 低于WARNING的记录在队列长度达到此值后即丢弃（0表示不限制）
+        self.low_level_limit = max(1, log_queue.maxsize - reserve) if log_queue.maxsize > 0 else 0
+
+    def enqueue(self, record: logging.LogRecord):
+        if (self.low_level_limit and record.levelno < logging.WARNING
+                and self.queue.qsize() >= self.low_level_limit):
+            metrics.LOG_RECORDS_DROPPED.inc()
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_RECORDS_DROPPED.inc()
+
+
+class LogQueueListener(QueueListener):
+    """后台写日志线程（停止时等待队列有空位再放入结束标记，不丢失剩余记录）"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+def _stop_log_listener():
+    """停止后台写日志线程（先写完队列中剩余的记录）"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+
+def _rotating_file_handler(path: str, log_config: dict, formatter: logging.Formatter) -> RotatingFileHandler:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    handler = RotatingFileHandler(
+        path,
+        maxBytes=log_config['max_bytes'],
+        backupCount=log_config['backup_count'],
+        encoding='utf-8'
+    )
+    handler.setFormatter(formatter)
+    return handler
 
 
 def setup_logging(log_config: dict):
-    """设置日志系统"""
-    log_dir = Path(log_config['file']).parent
-    log_dir.mkdir(parents=True, exist_ok=True)
+    """
+    设置日志系统
+
+    各模块只把日志记录放入内存队列，由后台线程写入控制台和文件，
+    录像线程和事件循环不会因为日志I/O（与录像写入争用磁盘）而阻塞；
+    慢查询日志和FFmpeg输出可以写入单独的文件（可放在与录像不同的磁盘上）
+    """
+    global _log_listener
 
-    # 创建根日志记录器
+    # 重复调用时先停止之前的后台线程
     logger = logging.getLogger()
+    _stop_log_listener()
+    for handler in list(logger.handlers):
+        if isinstance(handler, QueueHandler):
+            logger.removeHandler(handler)
+
+    # 根日志记录器的级别决定输出哪些日志（热加载只需修改这一处）
     logger.setLevel(getattr(logging, log_config['level']))
 
     # 控制台处理器
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(getattr(logging, log_config['level']))
     console_formatter = logging.Formatter(
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
@@ -48,22 +126,39 @@ def setup_logging(log_config: dict):
     console_handler.setFormatter(console_formatter)
 
     # 文件处理器（带轮转）
-    file_handler = RotatingFileHandler(
-        log_config['file'],
-        maxBytes=log_config['max_bytes'],
-        backupCount=log_config['backup_count'],
-        encoding='utf-8'
-    )
-    file_handler.setLevel(getattr(logging, log_config['level']))
     file_formatter = logging.Formatter(
         '%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
     )
-    file_handler.setFormatter(file_formatter)
-
-    # 添加处理器
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    file_handler = _rotating_file_handler(log_config['file'], log_config, file_formatter)
+    handlers = [console_handler, file_handler]
+
+    # 单独的日志文件：慢查询（每行一个JSON记录）和FFmpeg错误输出，配置后不再写入主日志
+    separate_files = {
+        SLOW_QUERY_LOGGER: (log_config.get('slow_query_file'), logging.Formatter('%(message)s')),
+        FFMPEG_LOGGER: (log_config.get('ffmpeg_file'), file_formatter),
+    }
+    separate_names = []
+    for name, (path, formatter) in separate_files.items():
+        if path:
+            handler = _rotating_file_handler(path, log_config, formatter)
+            handler.addFilter(logging.Filter(name))
+            handlers.append(handler)
+            separate_names.append(name)
+
+    if separate_names:
+        def main_log_filter(record: logging.LogRecord) -> bool:
+            return not any(record.name == name or record.name.startswith(name + '.') for name in separate_names)
+        console_handler.addFilter(main_log_filter)
+        file_handler.addFilter(main_log_filter)
+
+    # 队列处理器和后台写日志线程
+    log_queue = queue.Queue(log_config.get('queue_size', 10000))
+    logger.addHandler(DroppingQueueHandler(log_queue))
+    if _log_listener is None:
+        atexit.register(_stop_log_listener)
+    _log_listener = LogQueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
 
     return logger
 
@@ -77,103 +172,89 @@ def load_config(config_file: str = "config.yaml") -> dict:
         print(f"Config file {config_file} not found, using defaults")
         # 返回默认配置
         return {
-            'server': {'host': '0.0.0.0', 'port': 8000},
+            'server': {'host': '0.0.0.0', 'port': 8000, 'graceful_shutdown_timeout': 5},
             'recording': {
                 'output_dir': 'recordings',
                 'segment_duration': 600,
                 'retention_days': 7,
-                'enable_auto_delete': True
+                'enable_auto_delete': True,
+                'session_retention_hours': 24,
+                'session_cleanup_rate': 5,
+                'min_free_gb': 0,
+                'min_free_percent': 0,
+                'retention_check_interval': 5,
+                'delete_max_files_per_second': 20,
+                'delete_max_mb_per_second': 200,
+                'delete_batch_size': 50,
+                'delete_latency_threshold_ms': 200,
+                'startup_stagger': 0.5,
+                'startup_jitter': 0.5,
+                'startup_concurrency': 4,
+                'shutdown_timeout': 15
             },
             'ffmpeg': {
                 'path': 'ffmpeg',
                 'reconnect': 1,
                 'reconnect_at_eof': 1,
                 'reconnect_streamed': 1,
-                'reconnect_delay_max': 5
+                'reconnect_delay_max': 5,
+                'profiles': {}
+            },
+            'batch_query': {
+                'max_workers': 4,
+                'max_items': 50
+            },
+            'events': {
+                'interval': 1,
+                'metrics_interval': 10,
+                'heartbeat': 15
             },
             'logging': {
                 'level': 'INFO',
                 'file': 'logs/recorder.log',
                 'max_bytes': 10485760,
-                'backup_count': 5
+                'backup_count': 5,
+                'slow_query_file': 'logs/slow_query.log',
+                'ffmpeg_file': None,
+                'queue_size': 10000,
+                'ffmpeg_error_window': 300,
+                'ffmpeg_stderr_lines': 30
+            },
+            'query': {
+                'slow_threshold': 5
+            },
+            'scheduler': {
+                'max_concurrent': 4,
+                'background_max_concurrent': 2,
+                'background_nice': 10,
+                'probe_max_concurrent': 16
+            },
+            'snapshot': {
+                'cache_max_mb': 64,
+                'quality': 5
+            },
+            'probe': {
+                'timeout': 10,
+                'max_workers': 16
+            },
+            'timelapse': {
+                'fps': 25,
+                'max_workers': 4
+            },
+            'thumbnails': {
+                'enabled': True,
+                'interval': 10,
+                'width': 160,
+                'height': 90,
+                'columns': 10
             },
             'cameras': []
         }
 
 
-def cleanup_old_recordings(output_dir: str, retention_days: int):
-    """清理旧录像文件"""
-    logger = logging.getLogger(__name__)
-    cutoff_time = datetime.now() - timedelta(days=retention_days)
-
-    try:
-        recordings_path = Path(output_dir)
-        if not recordings_path.exists():
-            return
-
-        deleted_count = 0
-        deleted_size = 0
-
-        # 遍历所有摄像机目录
-        for camera_dir in recordings_path.iterdir():
-            if not camera_dir.is_dir():
-                continue
-
-            # 检查视频文件
-            for video_file in camera_dir.glob("*.mp4"):
-                try:
-                    file_mtime = datetime.fromtimestamp(video_file.stat().st_mtime)
-                    if file_mtime < cutoff_time:
-                        file_size = video_file.stat().st_size
-                        video_file.unlink()
-                        deleted_count += 1
-                        deleted_size += file_size
-                        logger.info(f"Deleted old recording: {video_file}")
-                except Exception as e:
-                    logger.error(f"Error deleting file {video_file}: {e}")
-
-        # 清理sessions目录
-        sessions_dir = recordings_path / "sessions"
-        if sessions_dir.exists():
-            for session_dir in sessions_dir.iterdir():
-                if not session_dir.is_dir():
-                    continue
-
-                try:
-                    dir_mtime = datetime.fromtimestamp(session_dir.stat().st_mtime)
-                    if dir_mtime < cutoff_time:
-                        # 删除目录下所有文件
-                        for file in session_dir.glob("*"):
-                            file.unlink()
-                        session_dir.rmdir()
-                        logger.info(f"Deleted old session directory: {session_dir}")
-                except Exception as e:
-                    logger.error(f"Error deleting session directory {session_dir}: {e}")
-
-        if deleted_count > 0:
-            logger.info(f"Cleanup completed: deleted {deleted_count} files, freed {deleted_size / 1024 / 1024:.2f} MB")
-
-    except Exception as e:
-        logger.error(f"Error in cleanup_old_recordings: {e}")
-
-
-def auto_cleanup_thread(output_dir: str, retention_days: int, check_interval: int = 3600):
-    """自动清理线程"""
-    logger = logging.getLogger(__name__)
-    logger.info(f"Auto cleanup thread started: retention_days={retention_days}, check_interval={check_interval}s")
-
-    while True:
-        try:
-            cleanup_old_recordings(output_dir, retention_days)
-        except Exception as e:
-            logger.error(f"Error in auto cleanup thread: {e}")
-
-        time.sleep(check_interval)
-
-
 def create_app() -> FastAPI:
     """创建FastAPI应用"""
-    global camera_manager, recording_manager, config
+    global camera_manager, recording_manager, snapshot_service, config
 
     # 加载配置
     config = load_config()
@@ -187,9 +268,32 @@ def create_app() -> FastAPI:
     Path("static").mkdir(parents=True, exist_ok=True)
     Path("templates").mkdir(parents=True, exist_ok=True)
 
+    # 配置FFmpeg任务调度器（录像以外的FFmpeg调用）
+    scheduler_config = config.get('scheduler', {})
+    get_scheduler().configure(
+        max_concurrent=scheduler_config.get('max_concurrent', 4),
+        background_max_concurrent=scheduler_config.get('background_max_concurrent'),
+        background_nice=scheduler_config.get('background_nice', 10),
+        probe_max_concurrent=scheduler_config.get('probe_max_concurrent', 16)
+    )
+
     # 初始化管理器
     camera_manager = CameraManager(config_file="config.yaml")
     recording_manager = RecordingManager(camera_manager, config)
+    snapshot_config = config.get('snapshot', {})
+    snapshot_service = SnapshotService(
+        recording_manager,
+        ffmpeg_path=config['ffmpeg']['path'],
+        cache_max_bytes=snapshot_config.get('cache_max_mb', 64) * 1024 * 1024,
+        quality=snapshot_config.get('quality', 5)
+    )
+
+    probe_config = config.get('probe', {})
+    stream_prober = StreamProber(
+        ffmpeg_path=config['ffmpeg']['path'],
+        timeout=probe_config.get('timeout', 10),
+        max_workers=probe_config.get('max_workers', 16)
+    )
 
     # Lifespan事件管理器
     @asynccontextmanager
@@ -197,38 +301,76 @@ def create_app() -> FastAPI:
         # 将管理器存储到app.state，使路由可以访问
         app.state.camera_manager = camera_manager
         app.state.recording_manager = recording_manager
+        app.state.snapshot_service = snapshot_service
+        app.state.stream_prober = stream_prober
+        app.state.exporter = RecordingExporter(recording_manager)
 
         # 启动时执行
         logger.info("Application started")
 
-        # 启动自动清理线程
-        cleanup_thread = None
+        # 建立录像段索引（启动时扫描一次，之后由录像器增量维护）
+        recording_manager.segment_index.load(
+            config['recording']['output_dir'],
+            config['recording']['segment_duration']
+        )
+
+        # 启动保留管理器：基于索引增量删除过期录像，并按磁盘剩余空间/配额清理
+        retention_manager = None
         if config['recording']['enable_auto_delete']:
-            cleanup_thread = threading.Thread(
-                target=auto_cleanup_thread,
-                args=(
-                    config['recording']['output_dir'],
-                    config['recording']['retention_days']
-                ),
-                daemon=True
+            retention_manager = RetentionManager(
+                camera_manager,
+                recording_manager.segment_index,
+                config['recording']['output_dir'],
+                **retention_options(config['recording'])
+            )
+            retention_manager.start()
+        app.state.retention_manager = retention_manager
+
+        # 配置热加载（API和SIGHUP），只重启生效参数变化的录像器
+        app.state.config_reloader = ConfigReloader(app.state, config, config_file="config.yaml")
+        loop = asyncio.get_running_loop()
+        sighup_installed = False
+        if hasattr(signal, 'SIGHUP'):
+            try:
+                loop.add_signal_handler(signal.SIGHUP, app.state.config_reloader.handle_signal)
+                sighup_installed = True
+            except (NotImplementedError, RuntimeError) as e:
+                logger.warning(f"SIGHUP config reload not available: {e}")
+
+        # 监控指标：输出时从各管理器读取状态
+        metrics_collector = metrics.app_collector(app.state)
+        metrics.REGISTRY.register_collector(metrics_collector)
+        metrics.REGISTRY.register_collector(collect_in_flight)
+
+        # 状态推送（SSE），所有页面共用一个后台检查任务
+        events_config = config.get('events', {})
+        status_broadcaster = StatusBroadcaster(
+            camera_manager,
+            recording_manager,
+            interval=events_config.get('interval', 1),
+            metrics_interval=events_config.get('metrics_interval', 10),
+            heartbeat=events_config.get('heartbeat', 15)
+        )
+        status_broadcaster.start()
+        app.state.status_broadcaster = status_broadcaster
+
+        # 启动session目录后台清理器
+        recording_manager.session_janitor.start()
+
+        # 启动缩略图生成线程
+        if recording_manager.thumbnail_generator:
+            recording_manager.thumbnail_generator.start()
+
+        # 自动开始录像（后台分批启动，避免所有摄像机同时连接）
+        enabled_ids = [camera.id for camera in camera_manager.list_cameras() if camera.enabled]
+        if enabled_ids:
+            logger.info(f"Auto-starting recording for {len(enabled_ids)} camera(s)")
+            recording_manager.start_all(
+                enabled_ids,
+                stagger=config['recording'].get('startup_stagger', 0.5),
+                jitter=config['recording'].get('startup_jitter', 0.5),
+                concurrency=config['recording'].get('startup_concurrency', 4)
             )
-            cleanup_thread.start()
-            logger.info("Auto cleanup thread started")
-
-        # 自动开始录像（如果有已配置的相机）
-        cameras = camera_manager.list_cameras()
-        started_count = 0
-        for camera in cameras:
-            if camera.enabled:
-                try:
-                    recording_manager.start_recording(camera.id)
-                    started_count += 1
-                    logger.info(f"Auto-started recording for camera: {camera.id} ({camera.name})")
-                except Exception as e:
-                    logger.error(f"Failed to auto-start recording for camera {camera.id}: {e}")
-
-        if started_count > 0:
-            logger.info(f"Auto-started recording for {started_count} camera(s)")
         else:
             logger.info("No cameras configured or enabled for auto-start")
 
@@ -236,7 +378,19 @@ def create_app() -> FastAPI:
 
         # 关闭时执行
         logger.info("Shutting down application...")
-        recording_manager.stop_all()
+        if sighup_installed:
+            loop.remove_signal_handler(signal.SIGHUP)
+        await status_broadcaster.stop()
+        metrics.REGISTRY.unregister_collector(metrics_collector)
+        metrics.REGISTRY.unregister_collector(collect_in_flight)
+        recording_manager.stop_all(timeout=config['recording'].get('shutdown_timeout', 15))
+        camera_manager.flush()
+        recording_manager.session_janitor.stop()
+        # 保留管理器可能在热加载时被启用或禁用
+        if app.state.retention_manager:
+            app.state.retention_manager.stop()
+        if recording_manager.thumbnail_generator:
+            recording_manager.thumbnail_generator.stop()
         logger.info("Application stopped")
 
     # 创建FastAPI应用
@@ -247,6 +401,9 @@ def create_app() -> FastAPI:
         lifespan=lifespan
     )
 
+    # 请求耗时和正在处理的请求数（/metrics）
+    app.add_middleware(RequestTimingMiddleware)
+
     # 注册API路由
     app.include_router(api_router, prefix="/api")
 
@@ -268,6 +425,12 @@ def create_app() -> FastAPI:
         """设置页面"""
         return templates.TemplateResponse("settings.html", {"request": request})
 
+    # 监控指标（Prometheus文本格式）
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def metrics_endpoint():
+        """监控指标"""
+        return PlainTextResponse(metrics.render_latest(), media_type="text/plain; version=0.0.4")
+
     return app
 
 
@@ -282,6 +445,8 @@ def main():
         app,
         host=config['server']['host'],
         port=config['server']['port'],
+        # 状态推送（SSE）连接不会自行结束，超时后取消，之后才执行关闭流程
+        timeout_graceful_shutdown=config['server'].get('graceful_shutdown_timeout', 5),
         log_config=None  # 使用我们自己的日志配置
     )
 
@@ -0,0 +1,164 @@
+"""
+摄像机批量导入模块
+解析JSON/CSV格式的摄像机列表，校验并并发探测码流，将有效的摄像机一次性加入配置
+"""
+
+import csv
+import io
+import json
+from typing import List, Optional
+import logging
+
+from stream_probe import StreamProber, mask_url
+
+logger = logging.getLogger(__name__)
+
+# CSV列的类型转换（空字符串表示未设置）
+_CSV_CONVERTERS = {
+    'quota_gb': float,
+    'retention_days': float,
+    'segment_duration': int,
+}
+_TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+def _parse_csv_row(row: dict) -> dict:
+    """转换CSV行的字段类型"""
+    camera = {}
+    for key, value in row.items():
+        if key is None:
+            raise ValueError("CSV row has more columns than the header")
+        key = key.strip()
+        value = (value or '').strip()
+        if value == '':
+            continue
+        if key == 'enabled':
+            camera[key] = value.lower() in _TRUE_VALUES
+        elif key in _CSV_CONVERTERS:
+            try:
+                camera[key] = _CSV_CONVERTERS[key](value)
+            except ValueError:
+                raise ValueError(f"Invalid {key} value: {value}")
+        else:
+            camera[key] = value
+    return camera
+
+
+def parse_import(body: bytes, content_type: Optional[str] = None) -> List[dict]:
+    """
+    解析导入内容
+
+    Args:
+        body: 请求内容
+        content_type: 内容类型（text/csv为CSV，其余按JSON解析）
+
+    Returns:
+        摄像机配置列表
+
+    Raises:
+        ValueError: 格式无效
+    """
+    text = body.decode('utf-8-sig')
+
+    if content_type and 'csv' in content_type:
+        reader = csv.DictReader(io.StringIO(text))
+        if not reader.fieldnames:
+            raise ValueError("CSV header is missing")
+        cameras = []
+        for line_no, row in enumerate(reader, start=2):
+            try:
+                cameras.append(_parse_csv_row(row))
+            except ValueError as e:
+                raise ValueError(f"CSV line {line_no}: {e}")
+        return cameras
+
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON: {e}")
+    if isinstance(data, dict):
+        data = data.get('cameras')
+    if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+        raise ValueError("Expected a list of cameras or {\"cameras\": [...]}")
+    return data
+
+
+def _stream_url(camera: dict) -> Optional[str]:
+    """导入项实际录制的码流地址"""
+    stream = camera.get('stream')
+    if stream and stream != 'main':
+        return (camera.get('streams') or {}).get(stream)
+    return camera.get('rtsp_url')
+
+
+def import_cameras(camera_manager, prober: StreamProber, cameras: List[dict],
+                   probe: bool = True, dry_run: bool = False) -> dict:
+    """
+    批量导入摄像机
+
+    Args:
+        camera_manager: 摄像机管理器
+        prober: 码流探测器
+        cameras: 摄像机配置列表（字段同POST /api/cameras）
+        probe: 是否探测码流（只导入可连接的摄像机）
+        dry_run: 只校验和探测，不导入
+
+    Returns:
+        导入结果（每个摄像机的校验、探测和导入状态）
+    """
+    changes = [{**camera, 'op': 'add', 'id': camera.get('id')} for camera in cameras]
+    # 录制的码流地址为空（如streams中对应的地址为空字符串）时无法录像，按该项无效处理
+    errors = [error or (None if _stream_url(change) else "no stream URL")
+              for change, error in zip(changes, camera_manager.validate_changes(changes))]
+
+    probes = {}
+    if probe:
+        probes = prober.probe_many([_stream_url(change) for change, error in zip(changes, errors)
+                                    if error is None])
+
+    results = []
+    accepted = []
+    accepted_results = []
+    for change, error in zip(changes, errors):
+        probe_result = probes.get(_stream_url(change)) if error is None and probe else None
+        ok = error is None and (not probe or bool(probe_result and probe_result['reachable']))
+        if ok:
+            accepted.append(change)
+        elif error is None:
+            reason = probe_result['error'] if probe_result else "not probed"
+            logger.warning(f"Camera {change['id']} stream unreachable "
+                           f"({mask_url(_stream_url(change))}): {reason}")
+        result = {
+            "id": change['id'],
+            "valid": error is None,
+            "error": error,
+            "probe": probe_result,
+            "imported": bool(ok and not dry_run)
+        }
+        results.append(result)
+        if ok:
+            accepted_results.append(result)
+
+    if accepted and not dry_run:
+        # 探测期间摄像机列表可能已变化（并发添加等）：持锁重新校验，冲突的项单独标记失败，
+        # 其余一次性加入（只保存一次配置；batch在释放锁之后才保存）
+        with camera_manager.batch(), camera_manager.lock:
+            conflicts = camera_manager.validate_changes(accepted)
+            for change, result, error in zip(accepted, accepted_results, conflicts):
+                if error:
+                    logger.warning(f"Camera {change['id']} changed during import: {error}")
+                    result.update({"valid": False, "error": error, "imported": False})
+            accepted = [change for change, error in zip(accepted, conflicts) if error is None]
+            if accepted:
+                camera_manager.apply_changes(accepted)
+
+    imported = len(accepted) if not dry_run else 0
+    logger.info(f"Camera import: {len(cameras)} submitted, {len(accepted)} accepted, "
+                f"{imported} imported{' (dry run)' if dry_run else ''}")
+    return {
+        "total": len(cameras),
+        "accepted": len(accepted),
+        "imported": imported,
+        "dry_run": dry_run,
+        "results": results
+    }
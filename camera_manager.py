@@ -3,27 +3,67 @@
 负责摄像机的添加、删除、配置管理
 """
 
+import copy
+import os
+import tempfile
 import threading
+import time
 import yaml
-from typing import Dict, List, Optional
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import Callable, Dict, List, Mapping, NamedTuple, Optional, Tuple
 from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 可按摄像机覆盖的录像/保留策略字段（None表示使用全局配置）
+#   quota_gb:         录像存储配额（GB）
+#   retention_days:   录像保留天数
+#   segment_duration: 分段时长（秒）
+#   streams:          额外的命名码流 {名称: RTSP地址}（如 sub: 子码流地址）
+#   stream:           录制使用的码流名称（main表示rtsp_url）
+#   ffmpeg_profile:   FFmpeg参数模板名称（config.yaml中ffmpeg.profiles）
+POLICY_FIELDS = ('quota_gb', 'retention_days', 'segment_duration', 'streams', 'stream', 'ffmpeg_profile')
+
 
 class Camera:
     """摄像机类"""
 
-    def __init__(self, camera_id: str, name: str, rtsp_url: str, enabled: bool = True):
+    def __init__(self, camera_id: str, name: str, rtsp_url: str, enabled: bool = True, **policy):
         self.id = camera_id
         self.name = name
         self.rtsp_url = rtsp_url
         self.enabled = enabled
-        self.is_recording = False
-        self.current_recorder = None
+        for field in POLICY_FIELDS:
+            setattr(self, field, policy.get(field))
+        # 运行状态（由录像管理器维护），修改配置时复制出的新对象与旧对象共享
+        self._runtime = {"is_recording": False, "current_recorder": None}
         self.created_at = datetime.now()
 
+    @property
+    def is_recording(self) -> bool:
+        return self._runtime["is_recording"]
+
+    @is_recording.setter
+    def is_recording(self, value: bool):
+        self._runtime["is_recording"] = value
+
+    @property
+    def current_recorder(self):
+        return self._runtime["current_recorder"]
+
+    @current_recorder.setter
+    def current_recorder(self, value):
+        self._runtime["current_recorder"] = value
+
+    def copy_with(self, **changes) -> "Camera":
+        """复制摄像机并修改配置字段（运行状态共享，原对象不变）"""
+        camera = copy.copy(self)
+        for field, value in changes.items():
+            setattr(camera, field, value)
+        return camera
+
     def to_dict(self) -> dict:
         """转换为字典格式"""
         return {
@@ -31,20 +71,172 @@ class Camera:
             "name": self.name,
             "rtsp_url": self.rtsp_url,
             "enabled": self.enabled,
+            **self.policy(),
             "is_recording": self.is_recording,
             "created_at": self.created_at.isoformat()
         }
 
+    def policy(self) -> dict:
+        """摄像机级别的策略覆盖项"""
+        return {field: getattr(self, field) for field in POLICY_FIELDS}
+
+    def get_stream_url(self) -> str:
+        """获取录制使用的码流地址"""
+        if self.stream and self.stream != 'main':
+            return (self.streams or {})[self.stream]
+        return self.rtsp_url
+
+
+def validate_policy(policy: dict):
+    """
+    校验摄像机策略字段
+
+    Raises:
+        ValueError: 字段未知或取值无效
+    """
+    for field, value in policy.items():
+        if field not in POLICY_FIELDS:
+            raise ValueError(f"Unknown camera setting: {field}")
+        if value is None:
+            continue
+        if field in ('quota_gb', 'retention_days') and (
+                isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise ValueError(f"{field} must be a number")
+        if field == 'segment_duration' and (isinstance(value, bool) or not isinstance(value, int)):
+            raise ValueError("segment_duration must be an integer")
+        if field == 'streams' and not (isinstance(value, dict) and all(
+                isinstance(name, str) and isinstance(url, str) for name, url in value.items())):
+            raise ValueError("streams must be a mapping of stream names to URLs")
+        if field in ('stream', 'ffmpeg_profile') and not isinstance(value, str):
+            raise ValueError(f"{field} must be a string")
+        if field in ('quota_gb', 'retention_days') and value < 0:
+            raise ValueError(f"{field} must not be negative")
+        if field == 'segment_duration' and value and value < 10:
+            raise ValueError("segment_duration must be at least 10 seconds")
+
+    stream = policy.get('stream')
+    if stream and stream != 'main' and stream not in (policy.get('streams') or {}):
+        raise ValueError(f"Stream {stream} is not defined in streams")
+
+
+def write_yaml_atomic(path: str, data: dict, validate: Optional[Callable[[str], object]] = None):
+    """
+    原子写入YAML文件：先写入同目录下的唯一临时文件再重命名，写入中途崩溃不会损坏原文件
+
+    Args:
+        path: 目标文件路径
+        data: 写入的内容
+        validate: 重命名前校验临时文件的函数（参数为临时文件路径），抛出异常时不替换原文件
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp_file = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            yaml.dump(data, f, default_flow_style=False, allow_unicode=True)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            # mkstemp创建的文件权限为0600，保持原文件的权限
+            os.chmod(tmp_file, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        if validate:
+            validate(tmp_file)
+        os.replace(tmp_file, path)
+    except BaseException:
+        try:
+            os.remove(tmp_file)
+        except FileNotFoundError:
+            pass
+        raise
 
-class CameraManager:
-    """摄像机管理器"""
 
-    def __init__(self, config_file: str = "config.yaml"):
+class CameraSnapshot(NamedTuple):
+    """摄像机列表快照（不可变，修改时整体替换）"""
+    version: int
+    cameras: Mapping[str, Camera]
+    enabled: Tuple[Camera, ...]
+
+
+class CameraManager:
+    """
+    摄像机管理器
+
+    摄像机列表以不可变快照发布：修改操作在self.lock下构造新的快照并整体替换，
+    get_camera/list_cameras等读取操作不加锁；快照的version可用于判断列表是否变化。
+    批量修改（batch）期间的修改累积在暂存表中，退出时只发布一次快照
+    """
+
+    def __init__(self, config_file: str = "config.yaml", save_delay: float = 1.0,
+                 max_save_delay: float = 5.0):
+        """
+        初始化摄像机管理器
+
+        Args:
+            config_file: 配置文件路径
+            save_delay: 修改后延迟保存的时间（秒），期间的多次修改合并为一次写入；0表示立即保存
+            max_save_delay: 连续修改时从第一次修改起最长的延迟保存时间（秒）
+        """
         self.config_file = config_file
-        self.cameras: Dict[str, Camera] = {}
-        self.lock = threading.RLock()
+        self._snapshot = CameraSnapshot(0, MappingProxyType({}), ())
+        self.lock = threading.RLock()  # 串行化修改操作，读取不需要
+        self.save_delay = save_delay
+        self.max_save_delay = max_save_delay
+
+        # 延迟保存状态
+        self._save_lock = threading.Lock()  # 串行化配置文件写入
+        self._dirty_since: Optional[float] = None
+        self._save_timer: Optional[threading.Timer] = None
+        self._batch_depth = 0
+        self._staged: Optional[Dict[str, Camera]] = None  # 批量修改期间尚未发布的摄像机表
+
         self.load_cameras()
 
+    @property
+    def cameras(self) -> Mapping[str, Camera]:
+        """当前的摄像机表（只读）"""
+        return self._snapshot.cameras
+
+    @property
+    def version(self) -> int:
+        """摄像机列表版本号（每次修改加1）"""
+        return self._snapshot.version
+
+    def snapshot(self) -> CameraSnapshot:
+        """获取当前快照（不加锁）"""
+        return self._snapshot
+
+    def _publish(self, cameras: Dict[str, Camera]):
+        """发布新的摄像机表（调用时需持有self.lock）"""
+        self._snapshot = CameraSnapshot(
+            version=self._snapshot.version + 1,
+            cameras=MappingProxyType(cameras),
+            enabled=tuple(cam for cam in cameras.values() if cam.enabled)
+        )
+
+    def _current(self) -> Mapping[str, Camera]:
+        """修改操作看到的摄像机表（批量修改期间包含尚未发布的修改；调用时需持有self.lock）"""
+        return self._staged if self._staged is not None else self.cameras
+
+    def _edit(self) -> Dict[str, Camera]:
+        """
+        获取可修改的摄像机表（调用时需持有self.lock），修改后调用_commit
+
+        批量修改期间返回同一个暂存表（不复制），否则返回当前快照的副本
+        """
+        if not self._batch_depth:
+            return dict(self.cameras)
+        if self._staged is None:
+            self._staged = dict(self.cameras)
+        return self._staged
+
+    def _commit(self, cameras: Dict[str, Camera]):
+        """提交修改后的摄像机表：批量修改期间暂存到退出时发布，否则立即发布（调用时需持有self.lock）"""
+        if self._batch_depth:
+            self._staged = cameras
+        else:
+            self._publish(cameras)
+
     def load_cameras(self):
         """从配置文件加载摄像机"""
         try:
@@ -53,14 +245,11 @@ class CameraManager:
 
             cameras_config = config.get('cameras', [])
             with self.lock:
+                cameras = dict(self.cameras)
                 for cam_cfg in cameras_config:
-                    camera = Camera(
-                        camera_id=cam_cfg['id'],
-                        name=cam_cfg['name'],
-                        rtsp_url=cam_cfg['rtsp_url'],
-                        enabled=cam_cfg.get('enabled', True)
-                    )
-                    self.cameras[camera.id] = camera
+                    camera = self._camera_from_config(cam_cfg)
+                    cameras[camera.id] = camera
+                self._publish(cameras)
 
             logger.info(f"Loaded {len(self.cameras)} cameras from config")
 
@@ -69,6 +258,72 @@ class CameraManager:
         except Exception as e:
             logger.error(f"Error loading cameras: {e}")
 
+    @staticmethod
+    def _camera_from_config(cam_cfg: dict) -> Camera:
+        """根据配置项创建摄像机"""
+        return Camera(
+            camera_id=cam_cfg['id'],
+            name=cam_cfg['name'],
+            rtsp_url=cam_cfg['rtsp_url'],
+            enabled=cam_cfg.get('enabled', True),
+            **{field: cam_cfg.get(field) for field in POLICY_FIELDS}
+        )
+
+    def reload_cameras(self, cameras_config: List[dict]) -> dict:
+        """
+        按新的摄像机配置更新摄像机列表（已存在的摄像机原地更新，保留录像状态）
+
+        Args:
+            cameras_config: 配置文件中的cameras列表
+
+        Returns:
+            {"added": [...], "removed": [...], "changed": [...], "enabled": [...]}，
+            enabled为新增或由禁用变为启用的摄像机ID
+        """
+        new_cameras = {}
+        for cam_cfg in cameras_config or []:
+            camera = self._camera_from_config(cam_cfg)
+            validate_policy(camera.policy())
+            new_cameras[camera.id] = camera
+
+        diff = {"added": [], "removed": [], "changed": [], "enabled": []}
+        with self.lock:
+            current = self._current()
+            diff["removed"] = [camera_id for camera_id in current if camera_id not in new_cameras]
+
+            cameras = {}
+            for camera_id, new_camera in new_cameras.items():
+                camera = current.get(camera_id)
+                if camera is None:
+                    cameras[camera_id] = new_camera
+                    diff["added"].append(camera_id)
+                    if new_camera.enabled:
+                        diff["enabled"].append(camera_id)
+                    continue
+
+                before = (camera.name, camera.rtsp_url, camera.enabled, camera.policy())
+                after = (new_camera.name, new_camera.rtsp_url, new_camera.enabled, new_camera.policy())
+                if before == after:
+                    cameras[camera_id] = camera
+                    continue
+
+                # 复制已有摄像机（保留运行状态和创建时间）
+                cameras[camera_id] = camera.copy_with(
+                    name=new_camera.name,
+                    rtsp_url=new_camera.rtsp_url,
+                    enabled=new_camera.enabled,
+                    **new_camera.policy()
+                )
+                diff["changed"].append(camera_id)
+                if new_camera.enabled and not camera.enabled:
+                    diff["enabled"].append(camera_id)
+
+            self._commit(cameras)
+
+        logger.info(f"Reloaded cameras: {len(diff['added'])} added, {len(diff['removed'])} removed, "
+                    f"{len(diff['changed'])} changed")
+        return diff
+
     def save_cameras(self):
         """保存摄像机配置到文件"""
         try:
@@ -76,19 +331,21 @@ class CameraManager:
                 config = yaml.safe_load(f)
 
             cameras_list = []
-            with self.lock:
-                for camera in self.cameras.values():
-                    cameras_list.append({
-                        'id': camera.id,
-                        'name': camera.name,
-                        'rtsp_url': camera.rtsp_url,
-                        'enabled': camera.enabled
-                    })
+            for camera in self.cameras.values():
+                cam_cfg = {
+                    'id': camera.id,
+                    'name': camera.name,
+                    'rtsp_url': camera.rtsp_url,
+                    'enabled': camera.enabled
+                }
+                for field, value in camera.policy().items():
+                    if value is not None:
+                        cam_cfg[field] = value
+                cameras_list.append(cam_cfg)
 
             config['cameras'] = cameras_list
 
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                yaml.dump(config, f, default_flow_style=False, allow_unicode=True)
+            write_yaml_atomic(self.config_file, config)
 
             logger.info(f"Saved {len(cameras_list)} cameras to config")
 
@@ -96,65 +353,283 @@ class CameraManager:
             logger.error(f"Error saving cameras: {e}")
             raise
 
-    def add_camera(self, camera_id: str, name: str, rtsp_url: str, enabled: bool = True) -> Camera:
-        """添加摄像机"""
+    def _schedule_save(self):
+        """
+        登记配置变更并延迟保存（合并短时间内的多次修改）
+
+        批量修改期间（batch）只登记，退出时统一保存
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self._dirty_since is None:
+                self._dirty_since = now
+            if self._batch_depth:
+                return
+
+            if self.save_delay <= 0:
+                delay = 0
+            else:
+                delay = min(self.save_delay, max(0.0, self._dirty_since + self.max_save_delay - now))
+
+            if self._save_timer:
+                self._save_timer.cancel()
+                self._save_timer = None
+
+            if delay <= 0:
+                schedule_now = True
+            else:
+                schedule_now = False
+                self._save_timer = threading.Timer(delay, self._save_from_timer)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+        if schedule_now:
+            self.flush()
+
+    def _save_from_timer(self):
+        """延迟保存定时器回调"""
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Deferred camera config save failed: {e}")
+
+    def flush(self):
+        """立即保存尚未写入的摄像机配置（关闭服务和重新加载配置前调用）"""
+        with self._save_lock:
+            self._flush_pending()
+
+    def _flush_pending(self):
+        """保存尚未写入的摄像机配置（调用时需持有self._save_lock）"""
+        with self.lock:
+            if self._dirty_since is None:
+                return
+            self._dirty_since = None
+            if self._save_timer:
+                self._save_timer.cancel()
+                self._save_timer = None
+
+        try:
+            self.save_cameras()
+        except Exception:
+            # 保存失败时保留待保存状态，下一次修改或flush时重试
+            with self.lock:
+                if self._dirty_since is None:
+                    self._dirty_since = time.monotonic()
+            raise
+
+    @contextmanager
+    def config_file_lock(self):
+        """
+        独占配置文件：先写入尚未保存的摄像机修改，期间不会有摄像机配置写入
+        （用于在摄像机配置之外读-改-写config.yaml）
+        """
+        with self._save_lock:
+            self._flush_pending()
+            yield
+
+    @contextmanager
+    def frozen(self):
+        """
+        在config_file_lock的基础上同时阻止摄像机修改（用于重新加载配置文件，
+        保证从写入配置到按配置文件更新摄像机列表之间没有修改丢失）
+        """
+        with self._save_lock, self.lock:
+            self._flush_pending()
+            yield
+
+    @contextmanager
+    def batch(self):
+        """
+        批量修改：期间的所有修改只在退出时保存一次
+
+        用法:
+            with camera_manager.batch():
+                camera_manager.add_camera(...)
+                camera_manager.update_camera(...)
+        """
+        with self.lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0 and self._staged is not None:
+                    self._publish(self._staged)
+                    self._staged = None
+                    # 批量修改期间定时器保存的是发布前的摄像机表，需要重新保存
+                    if self._dirty_since is None:
+                        self._dirty_since = time.monotonic()
+                pending = self._batch_depth == 0 and self._dirty_since is not None
+            if pending:
+                self.flush()
+
+    def apply_changes(self, changes: List[dict]) -> List[Optional[Camera]]:
+        """
+        批量修改摄像机（全部校验通过后才应用，只保存一次）
+
+        Args:
+            changes: 修改列表，每项为 {"op": "add"|"update"|"remove", "id": 摄像机ID, 其他字段...}
+                     add需要name和rtsp_url；update的字段含义同update_camera
+
+        Returns:
+            每项修改对应的摄像机（remove为None）
+
+        Raises:
+            ValueError: 任意一项修改无效（此时不应用任何修改）
+        """
+        # 保存在batch退出时进行（此时已释放self.lock，避免与延迟保存线程互相等待）
+        with self.batch(), self.lock:
+            for index, error in enumerate(self.validate_changes(changes)):
+                if error:
+                    change = changes[index]
+                    raise ValueError(f"Change #{index} ({change.get('op')} {change.get('id')}): {error}")
+
+            results = []
+            for change in changes:
+                fields = {k: v for k, v in change.items() if k not in ('op', 'id')}
+                if change['op'] == 'add':
+                    results.append(self.add_camera(change['id'], **fields))
+                elif change['op'] == 'update':
+                    results.append(self.update_camera(change['id'], **fields))
+                else:
+                    self.remove_camera(change['id'])
+                    results.append(None)
+
+        logger.info(f"Applied {len(changes)} camera changes")
+        return results
+
+    def validate_changes(self, changes: List[dict]) -> List[Optional[str]]:
+        """
+        校验批量修改（按顺序模拟，无效的修改不影响后续项的校验）
+
+        Returns:
+            每项修改的错误信息（有效时为None）
+        """
+        errors = []
+        with self.lock:
+            ids = set(self._current())
+            for change in changes:
+                try:
+                    self._check_change(change, ids)
+                    errors.append(None)
+                except ValueError as e:
+                    errors.append(str(e))
+        return errors
+
+    def _check_change(self, change: dict, ids: set):
+        """校验单项批量修改，并在ids上记录其效果（调用时需持有锁）"""
+        op = change.get('op')
+        camera_id = change.get('id')
+        if not camera_id:
+            raise ValueError("Camera ID is required")
+
+        policy = {field: change.get(field) for field in POLICY_FIELDS if field in change}
+        unknown = set(change) - {'op', 'id', 'name', 'rtsp_url', 'enabled'} - set(POLICY_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown camera settings: {', '.join(sorted(unknown))}")
+
+        if op == 'add':
+            if camera_id in ids:
+                raise ValueError(f"Camera with ID {camera_id} already exists")
+            if not change.get('name') or not change.get('rtsp_url'):
+                raise ValueError("name and rtsp_url are required")
+            validate_policy({field: value or None for field, value in policy.items()})
+            ids.add(camera_id)
+        elif op == 'update':
+            if camera_id not in ids:
+                raise ValueError(f"Camera {camera_id} not found")
+            camera = self._current().get(camera_id)
+            current = camera.policy() if camera else {}
+            validate_policy({**current, **{f: v or None for f, v in policy.items() if v is not None}})
+        elif op == 'remove':
+            if camera_id not in ids:
+                raise ValueError(f"Camera {camera_id} not found")
+            camera = self._current().get(camera_id)
+            if camera and camera.is_recording:
+                raise ValueError(f"Camera {camera_id} is currently recording. Stop recording first.")
+            ids.discard(camera_id)
+        else:
+            raise ValueError(f"Unknown operation: {op}")
+
+    def add_camera(self, camera_id: str, name: str, rtsp_url: str, enabled: bool = True,
+                   **policy) -> Camera:
+        """添加摄像机（policy为POLICY_FIELDS中的策略覆盖项）"""
+        policy = {field: value or None for field, value in policy.items()}
+        validate_policy(policy)
+
         with self.lock:
-            if camera_id in self.cameras:
+            if camera_id in self._current():
                 raise ValueError(f"Camera with ID {camera_id} already exists")
 
-            camera = Camera(camera_id, name, rtsp_url, enabled)
-            self.cameras[camera_id] = camera
+            camera = Camera(camera_id, name, rtsp_url, enabled, **policy)
+            cameras = self._edit()
+            cameras[camera_id] = camera
+            self._commit(cameras)
 
-        self.save_cameras()
+        self._schedule_save()
         logger.info(f"Added camera: {camera_id} - {name}")
         return camera
 
     def remove_camera(self, camera_id: str) -> bool:
         """删除摄像机"""
         with self.lock:
-            if camera_id not in self.cameras:
+            if camera_id not in self._current():
                 return False
 
-            camera = self.cameras[camera_id]
+            camera = self._current()[camera_id]
             if camera.is_recording:
                 raise ValueError(f"Camera {camera_id} is currently recording. Stop recording first.")
 
-            del self.cameras[camera_id]
+            cameras = self._edit()
+            del cameras[camera_id]
+            self._commit(cameras)
 
-        self.save_cameras()
+        self._schedule_save()
         logger.info(f"Removed camera: {camera_id}")
         return True
 
     def get_camera(self, camera_id: str) -> Optional[Camera]:
-        """获取摄像机"""
-        with self.lock:
-            return self.cameras.get(camera_id)
+        """获取摄像机（不加锁）"""
+        return self._snapshot.cameras.get(camera_id)
 
     def update_camera(self, camera_id: str, name: Optional[str] = None,
-                     rtsp_url: Optional[str] = None, enabled: Optional[bool] = None) -> Camera:
-        """更新摄像机信息"""
+                     rtsp_url: Optional[str] = None, enabled: Optional[bool] = None,
+                     **policy) -> Camera:
+        """
+        更新摄像机信息
+
+        policy为POLICY_FIELDS中的策略覆盖项：None表示不修改，0或空值表示恢复使用全局配置
+        """
         with self.lock:
-            camera = self.cameras.get(camera_id)
+            camera = self._current().get(camera_id)
             if not camera:
                 raise ValueError(f"Camera {camera_id} not found")
 
+            changes = {field: value or None for field, value in policy.items() if value is not None}
+            validate_policy({**camera.policy(), **changes})
+
             if name is not None:
-                camera.name = name
+                changes['name'] = name
             if rtsp_url is not None:
-                camera.rtsp_url = rtsp_url
+                changes['rtsp_url'] = rtsp_url
             if enabled is not None:
-                camera.enabled = enabled
+                changes['enabled'] = enabled
 
-        self.save_cameras()
+            # 写时复制：读取方持有的旧对象保持不变
+            camera = camera.copy_with(**changes)
+            cameras = self._edit()
+            cameras[camera_id] = camera
+            self._commit(cameras)
+
+        self._schedule_save()
         logger.info(f"Updated camera: {camera_id}")
         return camera
 
     def list_cameras(self) -> List[Camera]:
-        """列出所有摄像机"""
-        with self.lock:
-            return list(self.cameras.values())
+        """列出所有摄像机（不加锁）"""
+        return list(self._snapshot.cameras.values())
 
     def get_enabled_cameras(self) -> List[Camera]:
-        """获取所有启用的摄像机"""
-        with self.lock:
-            return [cam for cam in self.cameras.values() if cam.enabled]
+        """获取所有启用的摄像机（不加锁）"""
+        return list(self._snapshot.enabled)
@@ -0,0 +1,285 @@
+"""
+配置热加载模块
+重新读取config.yaml，与运行状态比较后只应用发生变化的部分：
+日志级别、保留策略、调度器等参数直接生效，只重启生效参数发生变化的录像器
+"""
+
+import logging
+import os
+import threading
+from typing import Optional, Tuple
+
+import yaml
+
+from camera_manager import CameraManager, validate_policy, write_yaml_atomic
+from ffmpeg_scheduler import get_scheduler
+from http_cache import make_etag
+from retention import RetentionManager, retention_options
+
+logger = logging.getLogger(__name__)
+
+# 运行中无法更改、需要重启服务才能生效的配置项
+RESTART_REQUIRED_KEYS = (
+    ('server', 'host'),
+    ('server', 'port'),
+    ('server', 'graceful_shutdown_timeout'),
+    ('recording', 'output_dir'),
+    ('logging', 'file'),
+    ('logging', 'max_bytes'),
+    ('logging', 'backup_count'),
+    ('logging', 'slow_query_file'),
+    ('logging', 'ffmpeg_file'),
+    ('logging', 'queue_size'),
+)
+
+REQUIRED_SECTIONS = ('recording', 'ffmpeg', 'logging')
+
+# 应用配置时直接读取的配置项（缺少时在修改运行中的配置之前拒绝）
+REQUIRED_KEYS = (
+    ('recording', 'segment_duration'),
+    ('recording', 'retention_days'),
+    ('ffmpeg', 'path'),
+    ('ffmpeg', 'reconnect'),
+    ('ffmpeg', 'reconnect_at_eof'),
+    ('ffmpeg', 'reconnect_streamed'),
+    ('ffmpeg', 'reconnect_delay_max'),
+    ('logging', 'level'),
+)
+
+# GET /api/settings返回的配置部分
+SETTINGS_SECTIONS = ('recording', 'ffmpeg', 'server')
+
+
+def apply_logging_level(level: str):
+    """修改根日志记录器及其处理器的日志级别"""
+    level_value = getattr(logging, level)
+    root = logging.getLogger()
+    root.setLevel(level_value)
+    for handler in root.handlers:
+        handler.setLevel(level_value)
+
+
+class ConfigReloader:
+    """配置热加载器"""
+
+    def __init__(self, state, config: dict, config_file: str = "config.yaml"):
+        """
+        初始化热加载器
+
+        Args:
+            state: app.state（读取各管理器，并在启用/禁用自动删除时更新retention_manager）
+            config: 运行中使用的配置字典（原地更新，各模块持有的引用随之更新）
+            config_file: 配置文件路径
+        """
+        self.state = state
+        self.config = config
+        self.config_file = config_file
+        self.lock = threading.Lock()  # 同一时间只执行一次加载
+        self.last_result: Optional[dict] = None
+        # 设置快照: (文件标识, ETag, 设置)
+        self._settings: Optional[tuple] = None
+
+    def read_config(self, config_file: Optional[str] = None) -> dict:
+        """
+        读取并校验配置文件（不应用）
+
+        Args:
+            config_file: 配置文件路径，默认为运行中使用的配置文件（保存设置前用于校验临时文件）
+
+        Raises:
+            ValueError: 配置文件无效
+        """
+        config_file = config_file or self.config_file
+        with open(config_file, 'r', encoding='utf-8') as f:
+            new_config = yaml.safe_load(f)
+
+        if not isinstance(new_config, dict):
+            raise ValueError(f"Invalid config file {config_file}")
+        for section in REQUIRED_SECTIONS:
+            if not isinstance(new_config.get(section), dict):
+                raise ValueError(f"Config section '{section}' is missing")
+        for section, key in REQUIRED_KEYS:
+            if key not in new_config[section]:
+                raise ValueError(f"Config key '{section}.{key}' is missing")
+        if not hasattr(logging, str(new_config['logging'].get('level'))):
+            raise ValueError(f"Invalid logging level: {new_config['logging'].get('level')}")
+
+        for cam_cfg in new_config.get('cameras') or []:
+            try:
+                camera = CameraManager._camera_from_config(cam_cfg)
+            except KeyError as e:
+                raise ValueError(f"Camera config is missing {e}")
+            validate_policy(camera.policy())
+        return new_config
+
+    def settings_snapshot(self) -> Tuple[str, dict]:
+        """
+        获取配置文件中的设置部分及其ETag
+
+        配置文件未变化（inode、修改时间和大小相同）时直接返回内存中的快照，不重新读取；
+        返回的设置不能修改
+
+        Returns:
+            (ETag, 设置)
+        """
+        stat = os.stat(self.config_file)
+        file_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        snapshot = self._settings
+        if snapshot is None or snapshot[0] != file_key:
+            with open(self.config_file, 'r', encoding='utf-8') as f:
+                config = yaml.safe_load(f) or {}
+            settings = {section: config.get(section, {}) for section in SETTINGS_SECTIONS}
+            snapshot = (file_key, make_etag("settings", file_key), settings)
+            self._settings = snapshot
+        return snapshot[1], snapshot[2]
+
+    def reload(self) -> dict:
+        """
+        重新加载配置文件并应用变化
+
+        Returns:
+            应用结果（已应用的配置部分、录像器变化、需要重启服务的配置项）
+
+        Raises:
+            ValueError: 配置文件无效（此时不应用任何变化）
+        """
+        camera_manager = self.state.camera_manager
+        with self.lock:
+            # 先写入尚未保存的摄像机修改，避免被配置文件中的旧内容覆盖；
+            # 直到按配置文件更新摄像机列表为止阻止摄像机修改，期间的修改不会丢失
+            with camera_manager.frozen():
+                # 校验全部通过后才修改运行中的配置
+                new_config = self.read_config()
+                old_config = self.config
+
+                # 不能在运行中更改的配置项保持原值（新配置中缺少时同样使用原值）
+                restart_required = []
+                for section, key in RESTART_REQUIRED_KEYS:
+                    old_value = old_config.get(section, {}).get(key)
+                    if new_config.get(section, {}).get(key, old_value) != old_value:
+                        restart_required.append(f"{section}.{key}")
+                    if key in old_config.get(section, {}):
+                        new_config.setdefault(section, {})[key] = old_value
+
+                changed = sorted(key for key in set(old_config) | set(new_config)
+                                 if key != 'cameras' and old_config.get(key) != new_config.get(key))
+
+                old_config.clear()
+                old_config.update(new_config)
+                config = old_config
+
+                apply_logging_level(config['logging']['level'])
+
+                scheduler_config = config.get('scheduler', {})
+                get_scheduler().configure(
+                    max_concurrent=scheduler_config.get('max_concurrent', 4),
+                    background_max_concurrent=scheduler_config.get('background_max_concurrent'),
+                    background_nice=scheduler_config.get('background_nice', 10),
+                    probe_max_concurrent=scheduler_config.get('probe_max_concurrent', 16)
+                )
+
+                snapshot_service = self.state.snapshot_service
+                snapshot_config = config.get('snapshot', {})
+                snapshot_service.ffmpeg_path = config['ffmpeg']['path']
+                snapshot_service.quality = snapshot_config.get('quality', 5)
+                snapshot_service.cache.max_bytes = snapshot_config.get('cache_max_mb', 64) * 1024 * 1024
+
+                stream_prober = self.state.stream_prober
+                probe_config = config.get('probe', {})
+                stream_prober.ffmpeg_path = config['ffmpeg']['path']
+                stream_prober.timeout = probe_config.get('timeout', 10)
+                stream_prober.max_workers = max(1, probe_config.get('max_workers', 16))
+
+                status_broadcaster = self.state.status_broadcaster
+                events_config = config.get('events', {})
+                status_broadcaster.interval = events_config.get('interval', 1)
+                status_broadcaster.metrics_interval = events_config.get('metrics_interval', 10)
+                status_broadcaster.heartbeat = events_config.get('heartbeat', 15)
+
+                recording_manager = self.state.recording_manager
+                recording_manager.apply_config(config)
+                self._apply_retention(config)
+
+                # 摄像机变化：只重启生效参数变化的录像器
+                camera_diff = camera_manager.reload_cameras(config.get('cameras', []))
+
+            recorders = recording_manager.sync_recorders(camera_diff['enabled'])
+
+            result = {
+                "changed_sections": changed,
+                "cameras": camera_diff,
+                "recorders": recorders,
+                "restart_required": restart_required
+            }
+            self.last_result = result
+
+        logger.info(f"Config reloaded: sections={changed}, restarted={recorders['restarted']}, "
+                    f"started={recorders['started']}, stopped={recorders['stopped']}")
+        if restart_required:
+            logger.warning(f"Config changes require a server restart to take effect: {restart_required}")
+        return result
+
+    def update_settings(self, settings: dict) -> dict:
+        """
+        修改配置文件中的设置并热加载
+
+        读-改-写配置文件期间独占配置文件（不会与摄像机配置的延迟保存交错），
+        修改后的配置先写入临时文件并校验，通过后才原子替换config.yaml
+
+        Args:
+            settings: {"recording": {...}, "ffmpeg": {...}}，只更新给出的配置项
+
+        Returns:
+            热加载结果（同reload）
+
+        Raises:
+            ValueError: 修改后的配置无效（此时不修改配置文件）
+        """
+        with self.state.camera_manager.config_file_lock():
+            with open(self.config_file, 'r', encoding='utf-8') as f:
+                config = yaml.safe_load(f)
+
+            for section in ('recording', 'ffmpeg'):
+                if section in settings:
+                    config[section].update(settings[section])
+
+            write_yaml_atomic(self.config_file, config, validate=self.read_config)
+
+        logger.info("Settings updated successfully")
+        return self.reload()
+
+    def _apply_retention(self, config: dict):
+        """应用保留策略配置（启用/禁用自动删除时启动或停止保留管理器）"""
+        retention_manager = self.state.retention_manager
+        options = retention_options(config['recording'])
+
+        if not config['recording'].get('enable_auto_delete'):
+            if retention_manager:
+                retention_manager.stop()
+                self.state.retention_manager = None
+                logger.info("Retention manager stopped (auto delete disabled)")
+            return
+
+        if retention_manager:
+            retention_manager.configure(**options)
+            return
+
+        retention_manager = RetentionManager(
+            self.state.camera_manager,
+            self.state.recording_manager.segment_index,
+            config['recording']['output_dir'],
+            **options
+        )
+        retention_manager.start()
+        self.state.retention_manager = retention_manager
+
+    def handle_signal(self):
+        """SIGHUP处理：在后台线程中重新加载，错误只记录日志"""
+        def run():
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f"Config reload failed: {e}")
+
+        logger.info("Received SIGHUP, reloading config")
+        threading.Thread(target=run, name="config-reload", daemon=True).start()
@@ -0,0 +1,372 @@
+"""
+录像导出模块
+把录像段索引中与时间段重叠的完整录像段和清单（manifest.json）以ZIP（仅存储）或TAR格式直接流式输出，
+不截取、不在磁盘上生成任何文件；归档的布局只由源文件的名称、大小和修改时间决定，
+可以预先计算总大小并按HTTP Range续传（进程重启后同样得到相同的归档）
+"""
+
+import json
+import os
+import struct
+import tarfile
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMATS = {
+    "zip": "application/zip",
+    "tar": "application/x-tar",
+}
+
+CHUNK_SIZE = 1024 * 1024
+MANIFEST_NAME = "manifest.json"
+
+# 超过以下限制时使用ZIP64字段
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_COUNT_LIMIT = 0xFFFF
+# 32/16位字段中表示“见ZIP64字段”的值
+_ZIP64_MARKER = 0xFFFFFFFF
+_COUNT_MARKER = 0xFFFF
+
+
+class ArchiveEntry(NamedTuple):
+    """归档中的一个文件（path或data二选一）"""
+    name: str
+    size: int
+    mtime: float
+    path: Optional[str] = None
+    data: Optional[bytes] = None
+
+
+# ===== CRC缓存（续传时跳过的文件不需要重复读取） =====
+
+_crc_cache: "OrderedDict[tuple, int]" = OrderedDict()
+_crc_lock = threading.Lock()
+_CRC_CACHE_SIZE = 4096
+
+
+def _crc_key(entry: ArchiveEntry) -> tuple:
+    return (entry.path, entry.size, entry.mtime)
+
+
+def _cached_crc(entry: ArchiveEntry) -> Optional[int]:
+    with _crc_lock:
+        crc = _crc_cache.get(_crc_key(entry))
+        if crc is not None:
+            _crc_cache.move_to_end(_crc_key(entry))
+        return crc
+
+
+def _store_crc(entry: ArchiveEntry, crc: int):
+    with _crc_lock:
+        _crc_cache[_crc_key(entry)] = crc
+        _crc_cache.move_to_end(_crc_key(entry))
+        while len(_crc_cache) > _CRC_CACHE_SIZE:
+            _crc_cache.popitem(last=False)
+
+
+def entry_crc(entry: ArchiveEntry) -> int:
+    """计算文件的CRC32（有缓存时直接返回）"""
+    if entry.data is not None:
+        return zlib.crc32(entry.data)
+    crc = _cached_crc(entry)
+    if crc is None:
+        crc = 0
+        with open(entry.path, 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+        _store_crc(entry, crc)
+    return crc
+
+
+# ===== 归档布局 =====
+
+class _Part(NamedTuple):
+    """归档中连续的一段内容"""
+    length: int
+    kind: str          # bytes / file / lazy
+    payload: object    # bytes / 条目序号 / 生成bytes的函数
+
+
+class ArchiveLayout:
+    """确定性的归档布局（总大小预先确定，可按任意字节范围输出）"""
+
+    def __init__(self, entries: List[ArchiveEntry], parts: List[_Part]):
+        self.entries = entries
+        self.parts = parts
+        self.size = sum(part.length for part in parts)
+        self._crcs: dict = {}
+
+    def crc(self, index: int) -> int:
+        crc = self._crcs.get(index)
+        if crc is None:
+            crc = entry_crc(self.entries[index])
+            self._crcs[index] = crc
+        return crc
+
+    def _read_file(self, index: int, start: int, end: int) -> Iterator[bytes]:
+        """读取文件的[start, end)部分；从头读到尾时顺便计算CRC"""
+        entry = self.entries[index]
+        if entry.data is not None:
+            yield entry.data[start:end]
+            return
+
+        whole = start == 0 and end == entry.size and index not in self._crcs
+        crc = 0
+        remaining = end - start
+        with open(entry.path, 'rb') as f:
+            f.seek(start)
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise IOError(f"File changed during export: {entry.path}")
+                if whole:
+                    crc = zlib.crc32(chunk, crc)
+                remaining -= len(chunk)
+                yield chunk
+        if whole:
+            self._crcs[index] = crc
+            _store_crc(entry, crc)
+
+    def iter_range(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        输出归档的[start, end)字节（end默认为归档末尾）
+        """
+        end = self.size if end is None else end
+        offset = 0
+        for part in self.parts:
+            part_start, part_end = offset, offset + part.length
+            offset = part_end
+            if part_end <= start:
+                continue
+            if part_start >= end:
+                break
+
+            lo = max(start, part_start) - part_start
+            hi = min(end, part_end) - part_start
+            if part.kind == "file":
+                yield from self._read_file(part.payload, lo, hi)
+            else:
+                data = part.payload if part.kind == "bytes" else part.payload()
+                yield data[lo:hi]
+
+
+def _dos_datetime(mtime: float) -> Tuple[int, int]:
+    """转换为ZIP使用的DOS日期和时间"""
+    t = datetime.fromtimestamp(mtime)
+    if t.year < 1980:
+        t = datetime(1980, 1, 1)
+    dos_time = (t.hour << 11) | (t.minute << 5) | (t.second // 2)
+    dos_date = ((t.year - 1980) << 9) | (t.month << 5) | t.day
+    return dos_time, dos_date
+
+
+def zip_layout(entries: List[ArchiveEntry]) -> ArchiveLayout:
+    """
+    ZIP布局（仅存储不压缩）
+
+    本地文件头中不写CRC（标志位3），CRC写在文件数据之后的数据描述符和中央目录中，
+    因此可以边读文件边输出，不需要预先读取文件
+    """
+    parts: List[_Part] = []
+    central: List[Tuple[int, int, bytes]] = []  # (条目序号, 本地文件头偏移, 文件名)
+    layout = ArchiveLayout(entries, parts)
+    offset = 0
+
+    for index, entry in enumerate(entries):
+        name = entry.name.encode('utf-8')
+        zip64 = entry.size >= ZIP64_LIMIT
+        dos_time, dos_date = _dos_datetime(entry.mtime)
+
+        extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0) if zip64 else b''
+        header = struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, 45 if zip64 else 20, 0x0808, 0,
+            dos_time, dos_date, 0, 0, 0, len(name), len(extra)
+        ) + name + extra
+        parts.append(_Part(len(header), "bytes", header))
+        parts.append(_Part(entry.size, "file", index))
+
+        def descriptor(index=index, size=entry.size, zip64=zip64) -> bytes:
+            if zip64:
+                return struct.pack('<IIQQ', 0x08074b50, layout.crc(index), size, size)
+            return struct.pack('<IIII', 0x08074b50, layout.crc(index), size, size)
+        parts.append(_Part(24 if zip64 else 16, "lazy", descriptor))
+
+        central.append((index, offset, name))
+        offset += len(header) + entry.size + (24 if zip64 else 16)
+
+    # 中央目录（长度可以预先计算，内容在输出时根据CRC生成）
+    central_offset = offset
+    central_headers = []
+    for index, local_offset, name in central:
+        entry = entries[index]
+        zip64_fields = []
+        if entry.size >= ZIP64_LIMIT:
+            zip64_fields += [entry.size, entry.size]
+        if local_offset >= ZIP64_LIMIT:
+            zip64_fields.append(local_offset)
+        extra = struct.pack(f'<HH{len(zip64_fields)}Q', 0x0001, 8 * len(zip64_fields),
+                            *zip64_fields) if zip64_fields else b''
+        central_headers.append((index, local_offset, name, extra))
+
+    central_size = sum(46 + len(name) + len(extra) for _, _, name, extra in central_headers)
+
+    def central_directory() -> bytes:
+        records = []
+        for index, local_offset, name, extra in central_headers:
+            entry = entries[index]
+            dos_time, dos_date = _dos_datetime(entry.mtime)
+            size32 = _ZIP64_MARKER if entry.size >= ZIP64_LIMIT else entry.size
+            version = 45 if extra else 20
+            records.append(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, version, version, 0x0808, 0,
+                dos_time, dos_date, layout.crc(index), size32, size32,
+                len(name), len(extra), 0, 0, 0, 0o100644 << 16,
+                _ZIP64_MARKER if local_offset >= ZIP64_LIMIT else local_offset
+            ) + name + extra)
+        return b''.join(records)
+    parts.append(_Part(central_size, "lazy", central_directory))
+
+    # 目录结束记录（数量或偏移超过限制时加上ZIP64记录）
+    count = len(entries)
+    end = b''
+    if count >= ZIP_COUNT_LIMIT or central_offset >= ZIP64_LIMIT or central_size >= ZIP64_LIMIT:
+        zip64_end_offset = central_offset + central_size
+        end += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0,
+                           count, count, central_size, central_offset)
+        end += struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1)
+    end += struct.pack('<IHHHHIIH', 0x06054b50, 0, 0,
+                       *[_COUNT_MARKER if count >= ZIP_COUNT_LIMIT else count] * 2,
+                       _ZIP64_MARKER if central_size >= ZIP64_LIMIT else central_size,
+                       _ZIP64_MARKER if central_offset >= ZIP64_LIMIT else central_offset, 0)
+    parts.append(_Part(len(end), "bytes", end))
+
+    layout.size = sum(part.length for part in parts)
+    return layout
+
+
+def tar_layout(entries: List[ArchiveEntry]) -> ArchiveLayout:
+    """TAR布局（PAX格式，文件数据按512字节对齐）"""
+    parts: List[_Part] = []
+    for index, entry in enumerate(entries):
+        info = tarfile.TarInfo(entry.name)
+        info.size = entry.size
+        info.mtime = int(entry.mtime)
+        info.mode = 0o644
+        header = info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8')
+        parts.append(_Part(len(header), "bytes", header))
+        parts.append(_Part(entry.size, "file", index))
+        padding = -entry.size % tarfile.BLOCKSIZE
+        if padding:
+            parts.append(_Part(padding, "bytes", b'\0' * padding))
+    end = b'\0' * (tarfile.BLOCKSIZE * 2)
+    parts.append(_Part(len(end), "bytes", end))
+    return ArchiveLayout(entries, parts)
+
+
+def build_layout(entries: List[ArchiveEntry], archive_format: str) -> ArchiveLayout:
+    if archive_format == "zip":
+        return zip_layout(entries)
+    if archive_format == "tar":
+        return tar_layout(entries)
+    raise ValueError(f"Unsupported archive format: {archive_format}")
+
+
+# ===== 导出 =====
+
+class RecordingExporter:
+    """录像导出器（直接使用录像段索引中的源文件，不截取）"""
+
+    def __init__(self, recording_manager):
+        self.recording_manager = recording_manager
+
+    def prepare(self, camera_id: str, start_time: datetime, end_time: datetime) -> List[ArchiveEntry]:
+        """
+        生成与时间段重叠的已完成录像段的归档条目（清单在最前面）
+
+        录像段整段导出（不截取首尾），清单中记录每个录像段的起止时间；
+        条目只由源文件决定，文件未变化时任何时候准备的条目都相同，续传请求得到相同的归档
+
+        Raises:
+            ValueError: 摄像机不存在或时间段无效
+        """
+        if not self.recording_manager.camera_manager.get_camera(camera_id):
+            raise ValueError(f"Camera {camera_id} not found")
+        if end_time <= start_time:
+            raise ValueError("end_time must be after start_time")
+
+        files = []
+        segments = []
+        for segment in self.recording_manager.segment_index.page(camera_id, start_time, end_time):
+            try:
+                stat = os.stat(segment.path)
+            except FileNotFoundError:
+                # 已被保留策略删除
+                continue
+            entry = ArchiveEntry(
+                name=f"{camera_id}/{os.path.basename(segment.path)}",
+                size=stat.st_size,
+                mtime=stat.st_mtime,
+                path=segment.path
+            )
+            files.append(entry)
+            segments.append({
+                "name": entry.name,
+                "start_time": segment.start_time.isoformat(),
+                "end_time": segment.end_time.isoformat(),
+                "size": entry.size
+            })
+
+        manifest = json.dumps({
+            "camera_id": camera_id,
+            "start_time": start_time.isoformat(),
+            "end_time": end_time.isoformat(),
+            "files": segments,
+            "total_size": sum(entry.size for entry in files)
+        }, ensure_ascii=False, indent=2).encode('utf-8')
+        manifest_mtime = max((entry.mtime for entry in files), default=end_time.timestamp())
+        entries = [ArchiveEntry(MANIFEST_NAME, len(manifest), manifest_mtime, data=manifest)] + files
+
+        logger.info(f"Prepared export for camera {camera_id}: {len(files)} segment(s), "
+                    f"{sum(entry.size for entry in files) / 1024 / 1024:.2f} MB")
+        return entries
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单个字节范围（bytes=a-b / a- / -n）
+
+    Returns:
+        [start, end)，未指定、格式错误或多个范围时返回None
+
+    Raises:
+        ValueError: 范围无法满足
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    first, _, last = range_header[6:].strip().partition("-")
+    try:
+        # 格式错误的Range按规范忽略（返回完整内容）
+        if first == "":
+            suffix = int(last)
+        else:
+            start = int(first)
+            end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+
+    if first == "":
+        if suffix <= 0:
+            raise ValueError("Unsatisfiable range")
+        return max(0, size - suffix), size
+    if start >= size or end <= start:
+        raise ValueError("Unsatisfiable range")
+    return start, min(end, size)
@@ -0,0 +1,218 @@
+"""
+FFmpeg任务调度模块
+统一调度录像以外的FFmpeg调用（查询截取、时长探测、快照、缩略图、延时视频、码流探测等），
+按优先级排队并限制全局并发，避免突发查询抢占CPU/磁盘导致录像丢包
+"""
+
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 优先级类别（按优先级从高到低排列）
+PRIORITY_INTERACTIVE = "interactive"  # 用户正在等待结果的请求（查询、快照）
+PRIORITY_BACKGROUND = "background"    # 后台任务（缩略图、延时视频等）
+# 码流探测（只打开网络流读取流信息，不解码、不读写录像磁盘）：
+# 使用单独的并发上限，不占用全局名额，也不受其他类别排队的影响
+PRIORITY_PROBE = "probe"
+PRIORITY_CLASSES = (PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, PRIORITY_PROBE)
+
+
+class _ClassStats:
+    """单个优先级类别的统计信息"""
+
+    def __init__(self):
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def to_dict(self, queued: int) -> dict:
+        return {
+            "queued": queued,
+            "running": self.running,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "wait_seconds_total": round(self.wait_seconds_total, 3),
+            "wait_seconds_max": round(self.wait_seconds_max, 3),
+            "wait_seconds_avg": round(self.wait_seconds_total / self.submitted, 3) if self.submitted else 0.0
+        }
+
+
+class FFmpegScheduler:
+    """FFmpeg任务调度器"""
+
+    def __init__(self, max_concurrent: int = 4, background_max_concurrent: Optional[int] = None,
+                 background_nice: int = 10, probe_max_concurrent: int = 16):
+        """
+        初始化调度器
+
+        Args:
+            max_concurrent: 全局最大并发FFmpeg任务数
+            background_max_concurrent: 后台任务最大并发数（默认为max_concurrent-1，为交互请求保留名额）
+            background_nice: 后台任务的CPU nice值（同时使用空闲I/O优先级）
+            probe_max_concurrent: 码流探测最大并发数（不计入max_concurrent）
+
+        交互任务始终至少有一个名额：没有交互任务在执行时，即使后台任务占满全部名额
+        （如max_concurrent为1），交互任务也可以立即开始（此时总数暂时超过max_concurrent）
+        """
+        self._cond = threading.Condition()
+        self._queues: Dict[str, deque] = {cls: deque() for cls in PRIORITY_CLASSES}
+        self._stats: Dict[str, _ClassStats] = {cls: _ClassStats() for cls in PRIORITY_CLASSES}
+        self._running = 0
+        self._ionice_path = shutil.which("ionice") if os.name == "posix" else None
+        self._nice_path = shutil.which("nice") if os.name == "posix" else None
+        self.configure(max_concurrent, background_max_concurrent, background_nice, probe_max_concurrent)
+
+    def configure(self, max_concurrent: int = 4, background_max_concurrent: Optional[int] = None,
+                  background_nice: int = 10, probe_max_concurrent: int = 16):
+        """更新并发限制（可在运行时调用）"""
+        with self._cond:
+            self.max_concurrent = max(1, max_concurrent)
+            if background_max_concurrent is None:
+                background_max_concurrent = self.max_concurrent - 1
+            self.background_max_concurrent = max(1, min(background_max_concurrent, self.max_concurrent))
+            self.background_nice = background_nice
+            self.probe_max_concurrent = max(1, probe_max_concurrent)
+            self._cond.notify_all()
+
+        logger.info(f"FFmpeg scheduler configured: max_concurrent={self.max_concurrent}, "
+                    f"background_max_concurrent={self.background_max_concurrent}, "
+                    f"probe_max_concurrent={self.probe_max_concurrent}")
+
+    def _can_start(self, priority: str, ticket: object) -> bool:
+        """判断排队中的任务是否可以开始执行（调用时需持有锁）"""
+        if priority == PRIORITY_PROBE:
+            return self._stats[priority].running < self.probe_max_concurrent and \
+                self._queues[priority][0] is ticket
+
+        if self._running >= self.max_concurrent:
+            # 为交互任务保留的名额：没有交互任务在执行时仍可开始一个
+            if priority != PRIORITY_INTERACTIVE or self._stats[PRIORITY_INTERACTIVE].running > 0:
+                return False
+
+        # 严格优先级：高优先级队列有任务排队时，低优先级任务等待
+        for cls in PRIORITY_CLASSES:
+            if cls == priority:
+                break
+            if self._queues[cls]:
+                return False
+
+        if priority != PRIORITY_INTERACTIVE and \
+                self._stats[priority].running >= self.background_max_concurrent:
+            return False
+
+        # 同一类别内先进先出
+        return self._queues[priority][0] is ticket
+
+    @contextmanager
+    def slot(self, priority: str = PRIORITY_INTERACTIVE):
+        """
+        获取一个执行名额（阻塞直到可以执行）
+
+        用法:
+            with scheduler.slot(PRIORITY_BACKGROUND):
+                subprocess.run(...)
+        """
+        if priority not in self._queues:
+            raise ValueError(f"Unknown FFmpeg job priority: {priority}")
+
+        ticket = object()
+        enqueued_at = time.monotonic()
+        stats = self._stats[priority]
+
+        with self._cond:
+            self._queues[priority].append(ticket)
+            stats.submitted += 1
+            try:
+                while not self._can_start(priority, ticket):
+                    self._cond.wait()
+            finally:
+                self._queues[priority].remove(ticket)
+                # 出队后其他等待者的条件可能已满足
+                self._cond.notify_all()
+
+            waited = time.monotonic() - enqueued_at
+            stats.wait_seconds_total += waited
+            stats.wait_seconds_max = max(stats.wait_seconds_max, waited)
+            stats.running += 1
+            if priority != PRIORITY_PROBE:
+                self._running += 1
+
+        if waited > 1:
+            logger.debug(f"FFmpeg {priority} job waited {waited:.2f}s in queue")
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                stats.running -= 1
+                stats.completed += 1
+                if priority != PRIORITY_PROBE:
+                    self._running -= 1
+                self._cond.notify_all()
+
+    def prepare(self, cmd: List[str], priority: str) -> tuple:
+        """
+        为低优先级任务附加CPU/I/O优先级设置
+
+        Returns:
+            (命令, subprocess额外参数)
+        """
+        if priority == PRIORITY_INTERACTIVE:
+            return cmd, {}
+
+        if os.name == "nt":
+            return cmd, {"creationflags": subprocess.BELOW_NORMAL_PRIORITY_CLASS}
+
+        # 用nice/ionice命令设置优先级（多线程进程中使用preexec_fn可能导致子进程死锁）
+        if self.background_nice and self._nice_path:
+            cmd = [self._nice_path, "-n", str(self.background_nice)] + list(cmd)
+        if self._ionice_path:
+            # 空闲I/O类：只在磁盘空闲时获得I/O时间，避免影响录像写入
+            cmd = [self._ionice_path, "-c", "3"] + list(cmd)
+        return cmd, {}
+
+    def run(self, cmd: List[str], priority: str = PRIORITY_INTERACTIVE, **kwargs) -> subprocess.CompletedProcess:
+        """
+        排队执行FFmpeg命令（参数同subprocess.run）
+
+        Args:
+            cmd: 命令
+            priority: 优先级类别
+        """
+        with self.slot(priority):
+            cmd, extra = self.prepare(cmd, priority)
+            kwargs.update(extra)
+            return subprocess.run(cmd, **kwargs)
+
+    def stats(self) -> dict:
+        """获取调度统计信息"""
+        with self._cond:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "background_max_concurrent": self.background_max_concurrent,
+                "probe_max_concurrent": self.probe_max_concurrent,
+                "running": self._running,
+                "classes": {
+                    cls: self._stats[cls].to_dict(len(self._queues[cls]))
+                    for cls in PRIORITY_CLASSES
+                }
+            }
+
+
+# 全局调度器（由app根据配置调用configure）
+_scheduler = FFmpegScheduler()
+
+
+def get_scheduler() -> FFmpegScheduler:
+    """获取全局FFmpeg调度器"""
+    return _scheduler
@@ -0,0 +1,43 @@
+"""
+HTTP条件请求模块
+根据版本信息生成强ETag，处理If-None-Match，内容未变化时返回304（不生成响应内容）
+"""
+
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response
+
+
+def make_etag(*parts) -> str:
+    """由版本信息生成强ETag（各部分的repr决定取值）"""
+    digest = hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match是否匹配（按RFC 7232使用弱比较）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """客户端缓存仍然有效时返回304响应，否则返回None"""
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+
+def set_etag(response: Response, etag: str):
+    """设置ETag（no-cache：客户端每次都要带If-None-Match验证）"""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
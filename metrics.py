@@ -0,0 +1,409 @@
+"""
+监控指标模块
+提供计数器、仪表和直方图，以Prometheus文本格式输出（/metrics）
+
+计数器和直方图按线程分片累加：记录时只修改当前线程自己的分片，不加锁，
+输出时再汇总所有分片，录像线程和请求线程之间没有锁竞争
+"""
+
+import bisect
+import functools
+import shutil
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "ipcam_"
+
+# 默认耗时分桶（秒）
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# 指标样本: (标签字典, 值)
+Sample = Tuple[Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """指标基类"""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _labels(self, key: tuple) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """返回 [(样本名, 标签, 值), ...]"""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class _Sharded(_Metric):
+    """
+    按线程分片的指标（记录时不加锁）
+
+    线程池和录像器重启会不断创建新线程：线程结束后把它的分片合并到共享的汇总中并丢弃，
+    分片数量只与存活的线程数有关
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._local = threading.local()
+        self._shards: List[Tuple[weakref.ref, dict]] = []  # (所属线程, 分片)
+        self._retired: dict = {}  # 已结束线程的分片汇总
+        self._shards_lock = threading.Lock()  # 只在线程第一次记录和输出时使用
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._shards_lock:
+                self._prune_locked()
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+        return shard
+
+    def _merge(self, target: dict, key: tuple, value):
+        """把一个分片中的值合并到target"""
+        raise NotImplementedError
+
+    def _prune_locked(self):
+        """合并并丢弃已结束线程的分片（线程结束后不会再写入，合并时无需与其同步）"""
+        alive = []
+        for thread_ref, shard in self._shards:
+            thread = thread_ref()
+            if thread is not None and thread.is_alive():
+                alive.append((thread_ref, shard))
+            else:
+                for key, value in list(shard.items()):
+                    self._merge(self._retired, key, value)
+        self._shards = alive
+
+    def _all_items(self) -> Iterable[tuple]:
+        with self._shards_lock:
+            self._prune_locked()
+            shards = [shard for _, shard in self._shards]
+            retired = list(self._retired.items())
+        yield from retired
+        for shard in shards:
+            # list()在C层一次完成复制，不会与其他线程的写入交错
+            yield from list(shard.items())
+
+
+class Counter(_Sharded):
+    """单调递增计数器"""
+
+    type_name = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        """增加计数（labels按labelnames顺序传入）"""
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, target: dict, key: tuple, value):
+        target[key] = target.get(key, 0) + value
+
+    def totals(self) -> Dict[tuple, float]:
+        totals: Dict[tuple, float] = {}
+        for key, value in self._all_items():
+            totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def samples(self):
+        return [(self.name, self._labels(key), value) for key, value in sorted(self.totals().items())]
+
+
+class Histogram(_Sharded):
+    """直方图（用于耗时分布）"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        """记录一个观测值"""
+        shard = self._shard()
+        entry = shard.get(labels)
+        if entry is None:
+            # [各分桶计数（非累计，最后一项为+Inf）, 总和, 次数]
+            entry = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            shard[labels] = entry
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def _merge(self, target: dict, key: tuple, value):
+        counts, total, count = value
+        entry = target.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+        entry[0] = [a + b for a, b in zip(entry[0], counts)]
+        entry[1] += total
+        entry[2] += count
+
+    @contextmanager
+    def time(self, *labels):
+        """记录with块的耗时"""
+        begin = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - begin, *labels)
+
+    def samples(self):
+        merged: Dict[tuple, list] = {}
+        for key, value in self._all_items():
+            self._merge(merged, key, value)
+
+        samples = []
+        for key, (counts, total, count) in sorted(merged.items()):
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(float(bound))}, cumulative))
+            samples.append((f"{self.name}_sum", labels, round(total, 6)))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+class Gauge(_Metric):
+    """仪表（直接设置当前值）"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def remove(self, *labels):
+        self._values.pop(labels, None)
+
+    def samples(self):
+        return [(self.name, self._labels(key), value) for key, value in sorted(list(self._values.items()))]
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]] = []
+        self.lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self.lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]):
+        """
+        注册输出时调用的采集函数（用于从各模块的现有状态计算仪表值）
+
+        采集函数返回 [(指标名, 类型, 说明, [(标签, 值), ...]), ...]
+        """
+        with self.lock:
+            self._collectors.append(collector)
+
+    def unregister_collector(self, collector: Callable):
+        with self.lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
+
+    def render(self) -> str:
+        """以Prometheus文本格式输出所有指标"""
+        with self.lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+                continue
+            for name, type_name, documentation, samples in families:
+                name = PREFIX + name
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {type_name}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+# 全局注册表
+REGISTRY = MetricsRegistry()
+
+# 录像器指标（VideoRecorder._record_loop中记录）
+RECORDER_FFMPEG_STARTS = REGISTRY.counter(
+    "recorder_ffmpeg_starts_total", "FFmpeg recording processes started", ["camera"])
+RECORDER_FFMPEG_FAILURES = REGISTRY.counter(
+    "recorder_ffmpeg_failures_total", "FFmpeg recording processes that exited with an error", ["camera"])
+RECORDER_SEGMENTS = REGISTRY.counter(
+    "recorder_segments_completed_total", "Recording segments completed", ["camera"])
+RECORDER_BYTES = REGISTRY.counter(
+    "recorder_bytes_written_total", "Bytes of completed recording segments", ["camera"])
+RECORDER_GAPS = REGISTRY.counter(
+    "recorder_segment_gaps_total", "Gaps between consecutive segments longer than the gap threshold", ["camera"])
+RECORDER_GAP_SECONDS = REGISTRY.counter(
+    "recorder_segment_gap_seconds_total", "Total seconds of gaps between consecutive segments", ["camera"])
+RECORDER_CONSECUTIVE_ERRORS = REGISTRY.gauge(
+    "recorder_consecutive_errors", "Current consecutive FFmpeg error count", ["camera"])
+
+# 查询和视频处理耗时
+QUERY_DURATION = REGISTRY.histogram(
+    "query_duration_seconds", "Recording query/export latency", ["operation"])
+VIDEO_PROCESSOR_DURATION = REGISTRY.histogram(
+    "video_processor_duration_seconds", "VideoProcessor FFmpeg operation latency", ["operation", "result"])
+
+# HTTP请求（RequestTimingMiddleware中记录，route为路由模板，避免摄像机ID等参数产生大量标签）
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency until the response body is complete",
+    ["method", "route", "status"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+
+# 日志队列已满时丢弃的日志记录（app.setup_logging）
+LOG_RECORDS_DROPPED = REGISTRY.counter(
+    "log_records_dropped_total", "Log records dropped because the logging queue was full")
+
+
+def remove_camera(camera_id: str):
+    """删除摄像机后移除其仪表序列（计数器为累计值，保留）"""
+    RECORDER_CONSECUTIVE_ERRORS.remove(camera_id)
+
+
+def timed_result(histogram: Histogram, operation: str):
+    """
+    装饰器：记录函数耗时，返回值为真时result标签为ok，否则（或抛出异常）为error
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            begin = time.monotonic()
+            result = None
+            try:
+                result = func(*args, **kwargs)
+                return result
+            finally:
+                histogram.observe(time.monotonic() - begin, operation, "ok" if result else "error")
+        return wrapper
+    return decorator
+
+
+def app_collector(state):
+    """
+    创建从app.state读取运行状态的采集函数（录像器、录像索引、磁盘、保留策略、调度器）
+
+    只在输出时读取各模块已有的状态，不在录像和查询路径上增加开销
+    """
+    from ffmpeg_scheduler import get_scheduler
+
+    def collect():
+        camera_manager = state.camera_manager
+        recording_manager = state.recording_manager
+        snapshot = camera_manager.snapshot()
+        camera_ids = sorted(snapshot.cameras)
+
+        yield ("cameras", "gauge", "Configured cameras",
+               [({}, len(camera_ids))])
+        yield ("cameras_enabled", "gauge", "Enabled cameras",
+               [({}, len(snapshot.enabled))])
+        yield ("recorder_up", "gauge", "Whether the camera recorder is running",
+               [({"camera": cid}, 1 if recording_manager.is_recording(cid) else 0) for cid in camera_ids])
+
+        index = recording_manager.segment_index
+        index_ids = sorted(index.camera_ids())
+        yield ("recorded_segments", "gauge", "Indexed recording segments",
+               [({"camera": cid}, index.count(cid)) for cid in index_ids])
+        yield ("recorded_bytes", "gauge", "Disk usage of indexed recording segments",
+               [({"camera": cid}, index.usage(cid)) for cid in index_ids])
+
+        disk = shutil.disk_usage(recording_manager.output_dir)
+        yield ("disk_total_bytes", "gauge", "Total size of the recording filesystem", [({}, disk.total)])
+        yield ("disk_free_bytes", "gauge", "Free space on the recording filesystem", [({}, disk.free)])
+
+        retention_manager = state.retention_manager
+        if retention_manager:
+            throttle = retention_manager.throttle
+            yield ("retention_deleted_files_total", "counter", "Segments deleted by the retention manager",
+                   [({}, retention_manager.deleted_files)])
+            yield ("retention_deleted_bytes_total", "counter", "Bytes deleted by the retention manager",
+                   [({}, retention_manager.deleted_bytes)])
+            yield ("retention_failed_deletes_total", "counter", "Segment deletions that failed and were kept",
+                   [({}, retention_manager.failed_deletes)])
+            yield ("retention_backoff_total", "counter", "Retention deletion backoffs on slow writes",
+                   [({}, throttle.backoff_count)])
+            yield ("retention_throttled_seconds_total", "counter", "Seconds retention deletion was throttled",
+                   [({}, round(throttle.throttled_seconds, 3))])
+
+        classes = get_scheduler().stats()["classes"]
+        yield ("scheduler_running", "gauge", "Running FFmpeg tasks",
+               [({"class": cls}, stats["running"]) for cls, stats in classes.items()])
+        yield ("scheduler_queued", "gauge", "FFmpeg tasks waiting for a slot",
+               [({"class": cls}, stats["queued"]) for cls, stats in classes.items()])
+        yield ("scheduler_completed_total", "counter", "Completed FFmpeg tasks",
+               [({"class": cls}, stats["completed"]) for cls, stats in classes.items()])
+        yield ("scheduler_wait_seconds_total", "counter", "Total time FFmpeg tasks waited for a slot",
+               [({"class": cls}, stats["wait_seconds_total"]) for cls, stats in classes.items()])
+
+    return collect
+
+
+def render_latest() -> str:
+    """输出全局注册表的所有指标"""
+    return REGISTRY.render()
@@ -0,0 +1,89 @@
+"""
+采样分析模块
+在限定时间内周期性采集所有线程（录像线程、清理线程、事件循环等）的调用栈，
+输出折叠栈格式（每行"线程;帧;帧... 次数"），可直接用于flamegraph.pl/speedscope
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 单次采样的最长时间（秒）和最小采样间隔（秒）
+MAX_DURATION = 60
+MIN_INTERVAL = 0.001
+
+# 同一时间只允许一次采样，避免多个采样互相放大开销
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusyError(RuntimeError):
+    """已有采样正在进行"""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def sample_stacks(duration: float, interval: float = 0.01,
+                  thread_filter: Optional[str] = None) -> Dict[str, int]:
+    """
+    采集调用栈
+
+    Args:
+        duration: 采样时间（秒，不超过MAX_DURATION）
+        interval: 采样间隔（秒）
+        thread_filter: 只采集名称包含此字符串的线程
+
+    Returns:
+        {折叠栈: 出现次数}
+
+    Raises:
+        ValueError: 参数无效
+        ProfilerBusyError: 已有采样正在进行
+    """
+    if duration <= 0 or duration > MAX_DURATION:
+        raise ValueError(f"duration must be between 0 and {MAX_DURATION} seconds")
+    if interval < MIN_INTERVAL:
+        raise ValueError(f"interval must be at least {MIN_INTERVAL} seconds")
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already running")
+
+    try:
+        own_ident = threading.get_ident()
+        stacks: Counter = Counter()
+        samples = 0
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                name = names.get(ident, f"thread-{ident}")
+                if thread_filter and thread_filter not in name:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(name.replace(";", "_"))
+                stacks[";".join(reversed(labels))] += 1
+            samples += 1
+            time.sleep(interval)
+
+        logger.info(f"Profiled {samples} samples over {duration}s ({len(stacks)} distinct stacks)")
+        return dict(stacks)
+    finally:
+        _profile_lock.release()
+
+
+def format_collapsed(stacks: Dict[str, int]) -> str:
+    """折叠栈文本（按次数降序）"""
+    lines = [f"{stack} {count}" for stack, count in sorted(stacks.items(), key=lambda item: -item[1])]
+    return "\n".join(lines) + ("\n" if lines else "")
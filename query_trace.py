@@ -0,0 +1,107 @@
+"""
+查询耗时分析模块
+记录单次录像查询各阶段的耗时（强制切分等待、索引查询、片段规划、各片段截取、结果组装），
+超过阈值的查询以一行JSON写入慢查询日志（包含片段规划和每个片段的耗时）
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+import logging
+
+# 慢查询日志记录器（app.setup_logging可为其配置单独的日志文件）
+SLOW_QUERY_LOGGER = "slow_query"
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger(SLOW_QUERY_LOGGER)
+
+
+class QueryTrace:
+    """单次查询的耗时记录（批量查询时各片段在多个线程中记录，需加锁）"""
+
+    def __init__(self, kind: str, **params):
+        """
+        Args:
+            kind: 查询类型（query/batch_query）
+            params: 查询参数（写入慢查询日志）
+        """
+        self.kind = kind
+        self.params = params
+        self.stages: Dict[str, float] = {}
+        self.clips: List[dict] = []
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        """记录一个阶段的耗时（同名阶段累加）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - started)
+
+    def add_stage(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def record_clip(self, camera_id: str, clip: tuple, seconds: float, success: bool):
+        """
+        记录一个片段的截取耗时
+
+        Args:
+            camera_id: 摄像机ID
+            clip: RecordingSession.plan()返回的(源文件, 输出文件, 开始偏移, 时长)
+            seconds: 耗时（秒，包含等待FFmpeg调度的时间）
+            success: 是否成功
+        """
+        file_path, output_path, extract_start, extract_duration = clip
+        with self._lock:
+            self.clips.append({
+                "camera_id": camera_id,
+                "source": file_path,
+                "copy": output_path is None,
+                "offset": round(extract_start, 3),
+                "duration": round(extract_duration, 3),
+                "ms": round(seconds * 1000, 1),
+                "success": success
+            })
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def to_dict(self) -> dict:
+        """耗时明细（毫秒）"""
+        with self._lock:
+            return {
+                "total_ms": round(self.elapsed * 1000, 1),
+                "stages": {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()},
+                "clips": list(self.clips)
+            }
+
+    def finish(self, slow_threshold: Optional[float]) -> dict:
+        """
+        结束记录，耗时超过阈值时写入慢查询日志
+
+        Args:
+            slow_threshold: 慢查询阈值（秒），None或0表示不记录
+
+        Returns:
+            耗时明细
+        """
+        timing = self.to_dict()
+        if slow_threshold and timing["total_ms"] >= slow_threshold * 1000:
+            record = {"kind": self.kind, **self.params, **timing}
+            try:
+                slow_query_logger.warning(json.dumps(record, ensure_ascii=False, default=str))
+            except Exception as e:
+                logger.error(f"Failed to write slow query log: {e}")
+        return timing
+
+
+def trace_stage(trace: Optional[QueryTrace], name: str):
+    """trace为None时不计时"""
+    return trace.stage(name) if trace is not None else nullcontext()
@@ -3,24 +3,157 @@ FFmpeg录像模块
 负责使用FFmpeg进行RTSP流录制，支持分段录像
 """
 
+import re
 import subprocess
 import threading
 import os
 import time
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, List
+from typing import Callable, Optional, List, Tuple
 import logging
 
+import metrics
+
 logger = logging.getLogger(__name__)
 
+# FFmpeg错误输出使用单独的日志记录器（app.setup_logging可为其配置单独的日志文件）
+FFMPEG_LOGGER = "recorder.ffmpeg"
+ffmpeg_logger = logging.getLogger(FFMPEG_LOGGER)
+
+
+def parse_segment_filename(filename: str, segment_duration: int = 600) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    从录像文件名（不含扩展名）解析开始和结束时间
+
+    Args:
+        filename: 文件名（不含扩展名）
+        segment_duration: 分段时长（秒），用于估算旧格式文件的结束时间
+
+    Returns:
+        (开始时间, 结束时间)，无法识别的格式返回(None, None)
+
+    Raises:
+        ValueError: 时间部分格式错误
+    """
+    file_start_time = None
+    file_end_time = None
+
+    # 新格式: camera_id_YYYYMMDD_HHMMSS_to_YYYYMMDD_HHMMSS
+    if '_to_' in filename:
+        parts = filename.split('_to_')
+        if len(parts) == 2:
+            # 提取开始时间部分
+            start_parts = parts[0].split('_')
+            if len(start_parts) >= 3:
+                date_str = start_parts[-2]
+                time_str = start_parts[-1]
+                file_start_time = datetime.strptime(f"{date_str}_{time_str}", "%Y%m%d_%H%M%S")
+
+            # 提取结束时间部分
+            end_parts = parts[1].split('_')
+            if len(end_parts) >= 2:
+                date_str = end_parts[0]
+                time_str = end_parts[1]
+                file_end_time = datetime.strptime(f"{date_str}_{time_str}", "%Y%m%d_%H%M%S")
+
+    # 旧格式: camera_id_YYYYMMDD_HHMMSS（向后兼容）
+    else:
+        parts = filename.split('_')
+        if len(parts) >= 3:
+            date_str = parts[-2]
+            time_str = parts[-1]
+            file_start_time = datetime.strptime(f"{date_str}_{time_str}", "%Y%m%d_%H%M%S")
+            # 旧格式没有结束时间，估算为开始时间+分段时长
+            file_end_time = file_start_time + timedelta(seconds=segment_duration)
+
+    return file_start_time, file_end_time
+
+
+class FFmpegErrorLog:
+    """
+    FFmpeg错误日志聚合（每个摄像机一个）
+
+    摄像机反复断线时每次失败都会输出错误和stderr：相同的错误（按stderr末尾几行去掉数字后比较）
+    在时间窗口内只完整记录一次，之后只计数，窗口结束、错误变化或录像恢复时输出一行汇总
+    """
+
+    # 判断是否为相同错误时比较的stderr末尾行数
+    SIGNATURE_LINES = 3
+
+    def __init__(self, camera_id: str, window: float = 300, max_lines: int = 30):
+        """
+        Args:
+            camera_id: 摄像机ID
+            window: 相同错误只完整记录一次的时间窗口（秒），0表示每次都记录
+            max_lines: 每次记录的stderr末尾行数
+        """
+        self.camera_id = camera_id
+        self.window = window
+        self.max_lines = max_lines
+        self._signature = None
+        self._window_start = 0.0
+        self._suppressed = 0
+
+    def _signature_of(self, returncode: int, lines: List[str]) -> tuple:
+        tail = [line for line in lines if line.strip()][-self.SIGNATURE_LINES:]
+        return (returncode, tuple(re.sub(r'\d+', '#', line) for line in tail))
+
+    def failure(self, returncode: int, stderr: Optional[str], error_count: int, max_errors: int) -> bool:
+        """
+        记录一次FFmpeg失败
+
+        Returns:
+            是否完整记录（False表示与之前的错误相同，只计数）
+        """
+        lines = stderr.strip().split('\n') if stderr else []
+        signature = self._signature_of(returncode, lines)
+        now = time.monotonic()
+        if signature == self._signature and now - self._window_start < self.window:
+            self._suppressed += 1
+            logger.debug(f"FFmpeg exited with code {returncode} for camera {self.camera_id} "
+                         f"(error {error_count}/{max_errors}, same error as before)")
+            return False
+
+        self.flush()
+        self._signature = signature
+        self._window_start = now
+        logger.error(f"FFmpeg exited with code {returncode} for camera {self.camera_id} "
+                     f"(error {error_count}/{max_errors})")
+        if lines:
+            # stderr末尾若干行作为一条日志记录
+            output = "\n".join(f"FFmpeg: {line}" for line in lines[-self.max_lines:])
+            ffmpeg_logger.error(f"=== FFmpeg stderr output for camera {self.camera_id} ===\n{output}")
+        return True
+
+    def flush(self):
+        """输出被合并的重复错误的汇总"""
+        if self._suppressed:
+            elapsed = time.monotonic() - self._window_start
+            logger.warning(f"FFmpeg failed {self._suppressed} more time(s) with the same error "
+                           f"for camera {self.camera_id} in the last {elapsed:.0f}s")
+            self._suppressed = 0
+
+    def recovered(self):
+        """录像恢复正常（之后再出现相同错误时重新完整记录）"""
+        self.flush()
+        self._signature = None
+
 
 class VideoRecorder:
     """视频录像器类"""
 
+    # 停止截止时间之后等待录像线程收尾的时间（秒）
+    STOP_GRACE_SECONDS = 2
+    # 相邻分段间隔超过此时间（秒）计为录像缺口
+    SEGMENT_GAP_THRESHOLD = 2
+
     def __init__(self, camera_id: str, rtsp_url: str, output_dir: str,
                  segment_duration: int = 600, ffmpeg_path: str = "ffmpeg",
-                 reconnect_config: dict = None):
+                 reconnect_config: dict = None,
+                 on_segment_complete: Optional[Callable[[str, str, datetime, datetime], None]] = None,
+                 ffmpeg_profile: Optional[dict] = None, error_log_window: float = 300,
+                 stderr_lines: int = 30):
         """
         初始化录像器
 
@@ -31,6 +164,10 @@ class VideoRecorder:
             segment_duration: 分段时长（秒）
             ffmpeg_path: FFmpeg可执行文件路径
             reconnect_config: 重连配置
+            on_segment_complete: 分段完成回调 (camera_id, 文件路径, 开始时间, 结束时间)
+            ffmpeg_profile: FFmpeg参数模板（覆盖传输协议、超时、编码器等默认参数）
+            error_log_window: 相同FFmpeg错误只完整记录一次的时间窗口（秒）
+            stderr_lines: FFmpeg失败时记录的stderr末尾行数
         """
         self.camera_id = camera_id
         self.rtsp_url = rtsp_url
@@ -38,6 +175,9 @@ class VideoRecorder:
         self.segment_duration = segment_duration
         self.ffmpeg_path = ffmpeg_path
         self.reconnect_config = reconnect_config or {}
+        self.on_segment_complete = on_segment_complete
+        self.ffmpeg_profile = ffmpeg_profile or {}
+        self.error_log = FFmpegErrorLog(camera_id, window=error_log_window, max_lines=stderr_lines)
 
         self.process: Optional[subprocess.Popen] = None
         self.is_running = False
@@ -45,6 +185,8 @@ class VideoRecorder:
         self.segments: List[dict] = []  # 存储已录制的分段信息
         self.lock = threading.Lock()
         self._force_split = False  # 强制切分标志
+        self.current_segment: Optional[tuple] = None  # 正在录制的段: (临时文件路径, 开始时间)
+        self._stop_event = threading.Event()  # 停止时中断重试等待
 
         # 创建摄像机专属目录
         self.camera_output_dir = os.path.join(output_dir, camera_id)
@@ -74,30 +216,44 @@ class VideoRecorder:
         return os.path.join(self.camera_output_dir, f"{self.camera_id}_{start_str}_to_{end_str}.mp4")
 
     def _build_ffmpeg_command(self, output_file: str) -> List[str]:
-        """构建FFmpeg命令"""
+        """构建FFmpeg命令（ffmpeg_profile中未设置的参数使用默认值）"""
+        profile = self.ffmpeg_profile
         cmd = [
             self.ffmpeg_path,
             # RTSP传输协议设置
-            "-rtsp_transport", "tcp",  # 使用TCP传输，更稳定
+            "-rtsp_transport", profile.get('rtsp_transport', "tcp"),  # 使用TCP传输，更稳定
             # 超时设置（对于RTSP使用-timeout，单位：微秒）
-            "-timeout", "10000000",  # RTSP超时10秒（增加到10秒以容忍网络波动）
+            "-timeout", str(profile.get('timeout', 10000000)),  # RTSP超时10秒（增加到10秒以容忍网络波动）
             # 分析持续时间，设置更长以确保正确检测流格式
-            "-analyzeduration", "10000000",  # 10秒
-            "-probesize", "10000000",  # 10MB探测大小
+            "-analyzeduration", str(profile.get('analyzeduration', 10000000)),  # 10秒
+            "-probesize", str(profile.get('probesize', 10000000)),  # 10MB探测大小
+        ]
+        # 额外的输入参数
+        cmd.extend(str(arg) for arg in profile.get('input_args', []))
+
+        audio_codec = profile.get('audio_codec', "copy")
+        cmd.extend([
             # 输入源
             "-i", self.rtsp_url,
             # 编码参数
-            "-c:v", "copy",    # 视频流复制
-            "-c:a", "copy",    # 音频流复制
+            "-c:v", profile.get('video_codec', "copy"),    # 视频流复制
+        ])
+        # 音频流复制（none表示不录制音频）
+        cmd.extend(["-an"] if audio_codec == "none" else ["-c:a", audio_codec])
+        cmd.extend([
             "-t", str(self.segment_duration),  # 录制时长（秒）
             # 错误处理
             "-err_detect", "ignore_err",  # 忽略一些非致命错误
             "-max_error_rate", "0.5",  # 容忍50%的错误率
             # MP4优化
             "-movflags", "+faststart+frag_keyframe+empty_moov",  # 更好的流媒体兼容性
+        ])
+        # 额外的输出参数
+        cmd.extend(str(arg) for arg in profile.get('output_args', []))
+        cmd.extend([
             "-y",  # 覆盖已存在的文件
             output_file
-        ]
+        ])
 
         return cmd
 
@@ -108,7 +264,8 @@ class VideoRecorder:
             return
 
         self.is_running = True
-        self.thread = threading.Thread(target=self._record_loop, daemon=True)
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._record_loop, name=f"recorder-{self.camera_id}", daemon=True)
         self.thread.start()
         logger.info(f"Started recording for camera {self.camera_id}")
 
@@ -120,6 +277,8 @@ class VideoRecorder:
         error_reset_threshold = 60  # 降低到60秒，让错误计数更容易重置
         last_success_time = None  # 记录最后成功时间
         total_success_duration = 0  # 累计成功时长
+        last_segment_end = None  # 上一个完成分段的结束时间（用于统计缺口）
+        metrics.RECORDER_CONSECUTIVE_ERRORS.set(0, self.camera_id)
 
         while self.is_running:
             try:
@@ -132,6 +291,7 @@ class VideoRecorder:
 
                 logger.info(f"Starting new segment for camera {self.camera_id}: {temp_file}")
                 logger.debug(f"FFmpeg command: {' '.join(cmd)}")
+                self.current_segment = (temp_file, start_time)
 
                 self.process = subprocess.Popen(
                     cmd,
@@ -139,10 +299,15 @@ class VideoRecorder:
                     stderr=subprocess.PIPE,
                     universal_newlines=True
                 )
+                metrics.RECORDER_FFMPEG_STARTS.inc(self.camera_id)
+                # 启动进程期间收到停止信号时立即结束
+                if not self.is_running:
+                    self.process.terminate()
 
                 # 等待FFmpeg进程完成并获取输出
                 stdout, stderr = self.process.communicate()
                 returncode = self.process.returncode
+                self.current_segment = None
 
                 # 记录结束时间
                 end_time = datetime.now()
@@ -179,6 +344,8 @@ class VideoRecorder:
                             logger.info(f"Cumulative successful recording for {total_success_duration:.1f}s, resetting error count from {consecutive_errors} to 0")
                         consecutive_errors = 0
                         total_success_duration = 0  # 重置累计时长
+                        metrics.RECORDER_CONSECUTIVE_ERRORS.set(0, self.camera_id)
+                        self.error_log.recovered()
 
                     # 检查临时文件是否生成
                     if os.path.exists(temp_file):
@@ -195,6 +362,10 @@ class VideoRecorder:
                             except Exception as rename_error:
                                 logger.error(f"Failed to rename {temp_file} to {final_file}: {rename_error}")
                                 # 如果重命名失败，至少文件还在
+                            else:
+                                self._record_segment_metrics(file_size, start_time, last_segment_end)
+                                last_segment_end = end_time
+                                self._notify_segment_complete(final_file, start_time, end_time)
                         else:
                             logger.warning(f"Segment file too small ({file_size} bytes), likely incomplete: {temp_file}")
                             try:
@@ -213,17 +384,10 @@ class VideoRecorder:
                     # 注意：强制切分的情况已经在上面的if条件中处理了
 
                     consecutive_errors += 1
-                    logger.error(f"FFmpeg exited with code {returncode} for camera {self.camera_id}")
-                    logger.error(f"Error count: {consecutive_errors}/{max_errors}")
-
-                    # 记录完整的stderr输出（分行记录以便阅读）
-                    if stderr:
-                        stderr_lines = stderr.strip().split('\n')
-                        # 只记录最后30行以获取更多错误信息
-                        logger.error(f"=== FFmpeg stderr output for camera {self.camera_id} ===")
-                        for line in stderr_lines[-30:]:
-                            logger.error(f"FFmpeg: {line}")
-                        logger.error(f"=== End of FFmpeg stderr ===")
+                    metrics.RECORDER_FFMPEG_FAILURES.inc(self.camera_id)
+                    metrics.RECORDER_CONSECUTIVE_ERRORS.set(consecutive_errors, self.camera_id)
+                    # 相同的错误在时间窗口内只完整记录一次（包括stderr末尾若干行）
+                    logged = self.error_log.failure(returncode, stderr, consecutive_errors, max_errors)
 
                     if consecutive_errors >= max_errors:
                         logger.error(f"Too many consecutive errors ({consecutive_errors}) for camera {self.camera_id}, stopping recording!")
@@ -233,11 +397,13 @@ class VideoRecorder:
                     if self.is_running:
                         # 根据错误次数调整重试延迟
                         adjusted_delay = min(retry_delay * (1 + consecutive_errors // 3), 60)
-                        logger.warning(f"Retrying in {adjusted_delay}s... (error {consecutive_errors}/{max_errors})")
-                        time.sleep(adjusted_delay)
+                        logger.log(logging.WARNING if logged else logging.DEBUG,
+                                   f"Retrying in {adjusted_delay}s... (error {consecutive_errors}/{max_errors})")
+                        self._stop_event.wait(adjusted_delay)
 
             except Exception as e:
                 consecutive_errors += 1
+                metrics.RECORDER_CONSECUTIVE_ERRORS.set(consecutive_errors, self.camera_id)
                 logger.error(f"Error in recording loop for camera {self.camera_id}: {e}")
 
                 if consecutive_errors >= max_errors:
@@ -246,35 +412,94 @@ class VideoRecorder:
                     break
 
                 if self.is_running:
-                    time.sleep(retry_delay)
+                    self._stop_event.wait(retry_delay)
 
+        self.error_log.flush()
         logger.info(f"Recording stopped for camera {self.camera_id}")
 
-    def stop(self):
-        """停止录像"""
-        if not self.is_running:
+    def _record_segment_metrics(self, file_size: int, start_time: datetime,
+                                last_segment_end: Optional[datetime]):
+        """记录完成分段的指标（大小、与上一分段之间的缺口）"""
+        metrics.RECORDER_SEGMENTS.inc(self.camera_id)
+        metrics.RECORDER_BYTES.inc(self.camera_id, amount=file_size)
+        if last_segment_end is not None:
+            gap = (start_time - last_segment_end).total_seconds()
+            if gap > self.SEGMENT_GAP_THRESHOLD:
+                metrics.RECORDER_GAPS.inc(self.camera_id)
+                metrics.RECORDER_GAP_SECONDS.inc(self.camera_id, amount=round(gap, 3))
+
+    def _notify_segment_complete(self, file_path: str, start_time: datetime, end_time: datetime):
+        """通知分段完成（回调异常不影响录像循环）"""
+        if not self.on_segment_complete:
+            return
+        try:
+            self.on_segment_complete(self.camera_id, file_path, start_time, end_time)
+        except Exception as e:
+            logger.error(f"Error in segment complete callback for camera {self.camera_id}: {e}")
+
+    def stop(self, timeout: float = 10):
+        """
+        停止录像
+
+        Args:
+            timeout: 等待FFmpeg退出的时间（秒），超时后强制结束
+        """
+        if not self.signal_stop():
             logger.warning(f"Recorder for camera {self.camera_id} is not running")
             return
 
+        self.wait_stopped(time.monotonic() + timeout)
+
+    def signal_stop(self) -> bool:
+        """
+        发出停止信号（不等待）：停止录像循环并向FFmpeg发送SIGTERM
+
+        Returns:
+            录像器是否在运行
+        """
+        if not self.is_running:
+            return False
+
         logger.info(f"Stopping recording for camera {self.camera_id}")
         self.is_running = False
+        self._stop_event.set()
 
-        if self.process:
+        process = self.process
+        if process and process.poll() is None:
             try:
                 # 发送SIGTERM信号优雅地关闭FFmpeg
-                self.process.terminate()
-                # 等待最多10秒
-                self.process.wait(timeout=10)
+                process.terminate()
+            except Exception as e:
+                logger.error(f"Error stopping FFmpeg for camera {self.camera_id}: {e}")
+        return True
+
+    def wait_stopped(self, deadline: float) -> bool:
+        """
+        等待录像器停止（signal_stop之后调用）
+
+        Args:
+            deadline: 截止时间（time.monotonic()），FFmpeg届时仍未退出则强制结束
+
+        Returns:
+            录像线程是否已结束
+        """
+        process = self.process
+        if process:
+            try:
+                process.wait(timeout=max(0.0, deadline - time.monotonic()))
             except subprocess.TimeoutExpired:
                 logger.warning(f"FFmpeg for camera {self.camera_id} did not terminate, killing...")
-                self.process.kill()
+                process.kill()
             except Exception as e:
                 logger.error(f"Error stopping FFmpeg for camera {self.camera_id}: {e}")
 
         if self.thread and self.thread.is_alive():
-            self.thread.join(timeout=15)
+            # FFmpeg已退出，录像线程只需完成重命名等收尾工作（截止时间后再给少量宽限）
+            self.thread.join(timeout=max(0.0, deadline + self.STOP_GRACE_SECONDS - time.monotonic()))
 
+        stopped = not (self.thread and self.thread.is_alive())
         logger.info(f"Recorder stopped for camera {self.camera_id}")
+        return stopped
 
     def force_segment_split(self):
         """
@@ -329,37 +554,9 @@ class VideoRecorder:
                     continue
 
                 filename = file_path.stem
-                file_start_time = None
-                file_end_time = None
 
                 try:
-                    # 新格式: camera_id_YYYYMMDD_HHMMSS_to_YYYYMMDD_HHMMSS
-                    if '_to_' in filename:
-                        parts = filename.split('_to_')
-                        if len(parts) == 2:
-                            # 提取开始时间部分
-                            start_parts = parts[0].split('_')
-                            if len(start_parts) >= 3:
-                                date_str = start_parts[-2]
-                                time_str = start_parts[-1]
-                                file_start_time = datetime.strptime(f"{date_str}_{time_str}", "%Y%m%d_%H%M%S")
-
-                            # 提取结束时间部分
-                            end_parts = parts[1].split('_')
-                            if len(end_parts) >= 2:
-                                date_str = end_parts[0]
-                                time_str = end_parts[1]
-                                file_end_time = datetime.strptime(f"{date_str}_{time_str}", "%Y%m%d_%H%M%S")
-
-                    # 旧格式: camera_id_YYYYMMDD_HHMMSS（向后兼容）
-                    else:
-                        parts = filename.split('_')
-                        if len(parts) >= 3:
-                            date_str = parts[-2]
-                            time_str = parts[-1]
-                            file_start_time = datetime.strptime(f"{date_str}_{time_str}", "%Y%m%d_%H%M%S")
-                            # 旧格式没有结束时间，估算为开始时间+分段时长
-                            file_end_time = file_start_time + timedelta(seconds=self.segment_duration)
+                    file_start_time, file_end_time = parse_segment_filename(filename, self.segment_duration)
 
                     if file_start_time:
                         # 过滤时间范围
@@ -0,0 +1,157 @@
+"""
+录像覆盖率模块
+根据录像段索引合并已录制的时间区间，计算缺口和按时间分桶的覆盖率（用于时间轴），
+只使用索引中的时间信息，不读取录像文件
+"""
+
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 分桶名称对应的秒数
+BUCKET_SIZES = {
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+}
+# 单个摄像机最多的分桶数量（一个月按分钟约43200个）
+MAX_BUCKETS = 50000
+
+Interval = Tuple[datetime, datetime]
+
+
+def parse_bucket(bucket: Optional[str]) -> Optional[int]:
+    """
+    解析分桶大小（minute/hour/day或秒数）
+
+    Raises:
+        ValueError: 格式无效
+    """
+    if not bucket:
+        return None
+    if bucket in BUCKET_SIZES:
+        return BUCKET_SIZES[bucket]
+    try:
+        seconds = int(bucket)
+    except ValueError:
+        raise ValueError(f"Invalid bucket: {bucket} (use minute, hour, day or seconds)")
+    if seconds <= 0:
+        raise ValueError("Bucket size must be positive")
+    return seconds
+
+
+def merge_intervals(intervals: Iterable[Interval], start_time: datetime, end_time: datetime,
+                    tolerance: float = 0) -> List[Interval]:
+    """
+    合并时间区间并裁剪到[start_time, end_time]
+
+    Args:
+        intervals: 按开始时间排序的区间
+        start_time: 范围开始
+        end_time: 范围结束
+        tolerance: 间隔不超过此秒数的相邻区间视为连续（分段切换时的短暂间隔）
+    """
+    gap_allowed = timedelta(seconds=tolerance)
+    merged: List[List[datetime]] = []
+    for begin, end in intervals:
+        begin = max(begin, start_time)
+        end = min(end, end_time)
+        if end <= begin:
+            continue
+        if merged and begin - merged[-1][1] <= gap_allowed:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([begin, end])
+    return [(begin, end) for begin, end in merged]
+
+
+def find_gaps(merged: List[Interval], start_time: datetime, end_time: datetime) -> List[Interval]:
+    """已合并区间之间（及范围两端）的缺口"""
+    gaps = []
+    cursor = start_time
+    for begin, end in merged:
+        if begin > cursor:
+            gaps.append((cursor, begin))
+        cursor = max(cursor, end)
+    if cursor < end_time:
+        gaps.append((cursor, end_time))
+    return gaps
+
+
+def coverage_histogram(merged: List[Interval], start_time: datetime, end_time: datetime,
+                       bucket_seconds: int) -> List[float]:
+    """
+    每个分桶中已录制时间所占的比例（0~1）
+
+    区间和分桶都按时间排序，一次遍历完成，开销与分桶数量加区间数量成正比
+    """
+    total = (end_time - start_time).total_seconds()
+    count = int(-(-total // bucket_seconds))  # 向上取整
+    if count > MAX_BUCKETS:
+        raise ValueError(f"Too many buckets ({count}), use a larger bucket size (max {MAX_BUCKETS})")
+
+    recorded = [0.0] * count
+    for begin, end in merged:
+        offset = (begin - start_time).total_seconds()
+        finish = (end - start_time).total_seconds()
+        index = int(offset // bucket_seconds)
+        while offset < finish and index < count:
+            bucket_end = (index + 1) * bucket_seconds
+            recorded[index] += min(finish, bucket_end) - offset
+            offset = bucket_end
+            index += 1
+
+    histogram = []
+    for index, seconds in enumerate(recorded):
+        # 最后一个分桶可能不完整
+        size = min(bucket_seconds, total - index * bucket_seconds)
+        histogram.append(round(seconds / size, 4) if size > 0 else 0.0)
+    return histogram
+
+
+def _format(intervals: List[Interval]) -> List[List[str]]:
+    return [[begin.isoformat(), end.isoformat()] for begin, end in intervals]
+
+
+def camera_coverage(segment_index, camera_id: str, start_time: datetime, end_time: datetime,
+                    bucket_seconds: Optional[int] = None, tolerance: float = 2,
+                    current: Optional[Interval] = None) -> dict:
+    """
+    计算单个摄像机在时间段内的录像覆盖情况
+
+    Args:
+        segment_index: 录像段索引
+        camera_id: 摄像机ID
+        start_time: 开始时间
+        end_time: 结束时间
+        bucket_seconds: 覆盖率分桶大小（秒），None表示不计算
+        tolerance: 视为连续的最大间隔（秒）
+        current: 正在录制的区间（开始时间, 当前时间）
+
+    Returns:
+        {"camera_id", "recorded_seconds", "coverage", "intervals", "gaps", "histogram"}
+    """
+    intervals = [(segment.start_time, segment.end_time)
+                 for segment in segment_index.page(camera_id, start_time, end_time)]
+    if current is not None:
+        intervals.append(current)
+        intervals.sort()
+
+    merged = merge_intervals(intervals, start_time, end_time, tolerance)
+    gaps = find_gaps(merged, start_time, end_time)
+    total = (end_time - start_time).total_seconds()
+    recorded = sum((end - begin).total_seconds() for begin, end in merged)
+
+    result = {
+        "camera_id": camera_id,
+        "recorded_seconds": round(recorded, 3),
+        "coverage": round(recorded / total, 4) if total > 0 else 0.0,
+        "intervals": _format(merged),
+        "gaps": _format(gaps),
+    }
+    if bucket_seconds:
+        result["histogram"] = coverage_histogram(merged, start_time, end_time, bucket_seconds)
+    return result
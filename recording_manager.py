@@ -3,19 +3,45 @@
 负责管理所有摄像机的录像任务
 """
 
+import random
 import threading
-import shutil
-from typing import Dict, Optional
-from datetime import datetime, timedelta
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from datetime import datetime
 from pathlib import Path
 import logging
 
 from recorder import VideoRecorder
-from video_processor import RecordingSession
+from video_processor import RecordingSession, TimelapseSession
 from camera_manager import CameraManager
+from session_janitor import SessionJanitor
+from thumbnails import ThumbnailGenerator
+from segment_index import SegmentIndex
+import metrics
+from metrics import QUERY_DURATION
+from query_trace import QueryTrace
 
 logger = logging.getLogger(__name__)
 
+# 摄像机录像状态
+RECORDER_STOPPED = "stopped"
+RECORDER_STARTING = "starting"
+RECORDER_RECORDING = "recording"
+RECORDER_STOPPING = "stopping"
+
+
+class _CameraSlot:
+    """单个摄像机的录像状态机（状态转换在各自的lock下进行，读取不加锁）"""
+
+    __slots__ = ("lock", "state")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = RECORDER_STOPPED
+
 
 class RecordingManager:
     """录像管理器"""
@@ -23,8 +49,12 @@ class RecordingManager:
     def __init__(self, camera_manager: CameraManager, config: dict):
         self.camera_manager = camera_manager
         self.config = config
+        # 录像器表采用写时复制：修改时整体替换，读取（is_recording/get_all_status等）不加锁
         self.recorders: Dict[str, VideoRecorder] = {}
-        self.lock = threading.RLock()
+        # 每个摄像机独立的状态机和锁，不同摄像机的启动/停止/切分互不阻塞
+        self._slots: Dict[str, _CameraSlot] = {}
+        self._registry_lock = threading.Lock()  # 只保护recorders/_slots的替换，持有期间不做耗时操作
+        self._shutting_down = False
 
         # 录像配置
         self.output_dir = config['recording']['output_dir']
@@ -37,9 +67,100 @@ class RecordingManager:
             'reconnect_delay_max': config['ffmpeg']['reconnect_delay_max'],
         }
 
+        # session目录后台清理器（查询路径不再扫描sessions目录）
+        self.session_janitor = SessionJanitor(
+            sessions_dir=str(Path(self.output_dir) / "sessions"),
+            max_age_hours=config['recording'].get('session_retention_hours', 24),
+            max_deletions_per_second=config['recording'].get('session_cleanup_rate', 5)
+        )
+
+        # 启动时分批开始录像的后台线程（停止时取消尚未开始的摄像机）
+        self._startup_thread: Optional[threading.Thread] = None
+        self._startup_cancel = threading.Event()
+
+        # 已完成录像段的索引（由分段完成回调增量维护）
+        self.segment_index = SegmentIndex()
+
+        # 分段完成后的缩略图生成（后台线程）
+        thumbnail_config = config.get('thumbnails', {})
+        self.thumbnail_generator = None
+        if thumbnail_config.get('enabled', True):
+            self.thumbnail_generator = ThumbnailGenerator(
+                ffmpeg_path=self.ffmpeg_path,
+                interval=thumbnail_config.get('interval', 10),
+                tile_width=thumbnail_config.get('width', 160),
+                tile_height=thumbnail_config.get('height', 90),
+                columns=thumbnail_config.get('columns', 10)
+            )
+
+    def _on_segment_complete(self, camera_id: str, file_path: str,
+                             start_time: datetime, end_time: datetime):
+        """录像段完成回调（在录像线程中执行，只做登记不做耗时操作）"""
+        try:
+            self.segment_index.add(camera_id, file_path, start_time, end_time)
+        except OSError as e:
+            logger.warning(f"Failed to index segment {file_path}: {e}")
+
+        if self.thumbnail_generator:
+            self.thumbnail_generator.enqueue(file_path, start_time, end_time)
+
+    def get_camera_policy(self, camera) -> dict:
+        """
+        计算摄像机的生效录像策略（摄像机级别覆盖优先，其余使用全局配置）
+
+        Returns:
+            包含rtsp_url、segment_duration、ffmpeg_profile、retention_days的字典
+        """
+        profile = None
+        if camera.ffmpeg_profile:
+            profile = self.config['ffmpeg'].get('profiles', {}).get(camera.ffmpeg_profile)
+            if profile is None:
+                logger.warning(f"FFmpeg profile {camera.ffmpeg_profile} not found for camera {camera.id}, "
+                               f"using defaults")
+
+        return {
+            "rtsp_url": camera.get_stream_url(),
+            "segment_duration": camera.segment_duration or self.segment_duration,
+            "ffmpeg_profile": profile,
+            "retention_days": camera.retention_days or self.config['recording'].get('retention_days')
+        }
+
+    def _slot(self, camera_id: str) -> _CameraSlot:
+        """获取摄像机的状态机（不存在时创建）"""
+        slot = self._slots.get(camera_id)
+        if slot is None:
+            with self._registry_lock:
+                slot = self._slots.setdefault(camera_id, _CameraSlot())
+        return slot
+
+    def _publish_recorder(self, camera_id: str, recorder: Optional[VideoRecorder]):
+        """替换录像器表（写时复制，recorder为None时移除）"""
+        with self._registry_lock:
+            recorders = dict(self.recorders)
+            if recorder is None:
+                recorders.pop(camera_id, None)
+            else:
+                recorders[camera_id] = recorder
+            self.recorders = recorders
+
+    def get_state(self, camera_id: str) -> str:
+        """获取摄像机的录像状态（不加锁）"""
+        slot = self._slots.get(camera_id)
+        if slot is None:
+            return RECORDER_STOPPED
+        state = slot.state
+        # 录像器因连续错误自行停止时状态机不会收到通知
+        if state == RECORDER_RECORDING and not self.is_recording(camera_id):
+            return RECORDER_STOPPED
+        return state
+
     def start_recording(self, camera_id: str):
         """开始录像"""
-        with self.lock:
+        slot = self._slot(camera_id)
+        with slot.lock:
+            if self._shutting_down:
+                raise ValueError("Recording manager is shutting down")
+
             # 检查摄像机是否存在
             camera = self.camera_manager.get_camera(camera_id)
             if not camera:
@@ -49,43 +170,58 @@ class RecordingManager:
                 raise ValueError(f"Camera {camera_id} is disabled")
 
             # 检查是否已经在录像
-            if camera_id in self.recorders and self.recorders[camera_id].is_running:
+            recorder = self.recorders.get(camera_id)
+            if recorder and recorder.is_running:
                 logger.warning(f"Camera {camera_id} is already recording")
                 return
 
-            # 创建录像器
-            recorder = VideoRecorder(
-                camera_id=camera_id,
-                rtsp_url=camera.rtsp_url,
-                output_dir=self.output_dir,
-                segment_duration=self.segment_duration,
-                ffmpeg_path=self.ffmpeg_path,
-                reconnect_config=self.reconnect_config
-            )
+            slot.state = RECORDER_STARTING
+            try:
+                # 创建录像器（应用摄像机级别的码流、分段时长和FFmpeg参数模板）
+                policy = self.get_camera_policy(camera)
+                recorder = VideoRecorder(
+                    camera_id=camera_id,
+                    rtsp_url=policy['rtsp_url'],
+                    output_dir=self.output_dir,
+                    segment_duration=policy['segment_duration'],
+                    ffmpeg_path=self.ffmpeg_path,
+                    reconnect_config=self.reconnect_config,
+                    on_segment_complete=self._on_segment_complete,
+                    ffmpeg_profile=policy['ffmpeg_profile'],
+                    error_log_window=self.config['logging'].get('ffmpeg_error_window', 300),
+                    stderr_lines=self.config['logging'].get('ffmpeg_stderr_lines', 30)
+                )
 
-            # 启动录像
-            recorder.start()
-            self.recorders[camera_id] = recorder
+                # 启动录像
+                recorder.start()
+            except Exception:
+                slot.state = RECORDER_STOPPED
+                raise
+
+            self._publish_recorder(camera_id, recorder)
             camera.is_recording = True
             camera.current_recorder = recorder
+            slot.state = RECORDER_RECORDING
 
             logger.info(f"Started recording for camera {camera_id}")
 
     def stop_recording(self, camera_id: str) -> dict:
         """
-        停止录像并返回录像信息
+        停止录像并返回录像信息（只阻塞该摄像机的操作）
 
         Returns:
             包含录像文件信息的字典
         """
-        with self.lock:
+        slot = self._slot(camera_id)
+        with slot.lock:
             # 检查摄像机是否存在
             camera = self.camera_manager.get_camera(camera_id)
             if not camera:
                 raise ValueError(f"Camera {camera_id} not found")
 
             # 检查是否在录像
-            if camera_id not in self.recorders:
+            recorder = self.recorders.get(camera_id)
+            if recorder is None:
                 logger.warning(f"Camera {camera_id} is not recording")
                 return {
                     "camera_id": camera_id,
@@ -93,13 +229,15 @@ class RecordingManager:
                     "files": []
                 }
 
-            recorder = self.recorders[camera_id]
-
             # 获取录像文件列表（在停止之前）
             recorded_files = recorder.get_recorded_files() if recorder.is_running else []
 
             if recorder.is_running:
-                recorder.stop()
+                slot.state = RECORDER_STOPPING
+                try:
+                    recorder.stop()
+                finally:
+                    slot.state = RECORDER_STOPPED
 
             camera.is_recording = False
             camera.current_recorder = None
@@ -115,47 +253,67 @@ class RecordingManager:
             }
 
     def is_recording(self, camera_id: str) -> bool:
-        """检查摄像机是否正在录像"""
-        with self.lock:
-            if camera_id in self.recorders:
-                return self.recorders[camera_id].is_running
-            return False
+        """检查摄像机是否正在录像（不加锁）"""
+        recorder = self.recorders.get(camera_id)
+        return bool(recorder and recorder.is_running)
 
-    def cleanup_old_sessions(self, max_age_hours: int = 24):
+    def cleanup_old_sessions(self):
         """
-        清理旧的session目录
+        立即清理已过期的session目录
 
-        Args:
-            max_age_hours: 保留时间（小时），超过此时间的session目录会被删除
+        过期时间由session_janitor按创建顺序跟踪，不会扫描sessions目录
         """
         try:
-            sessions_dir = Path(self.output_dir) / "sessions"
-            if not sessions_dir.exists():
-                return
-
-            cutoff_time = datetime.now() - timedelta(hours=max_age_hours)
-            cleaned_count = 0
-
-            for session_dir in sessions_dir.iterdir():
-                if session_dir.is_dir():
-                    try:
-                        # 获取目录的修改时间
-                        dir_mtime = datetime.fromtimestamp(session_dir.stat().st_mtime)
-
-                        if dir_mtime < cutoff_time:
-                            # 删除旧的session目录
-                            shutil.rmtree(session_dir)
-                            cleaned_count += 1
-                            logger.info(f"Cleaned up old session directory: {session_dir.name}")
-                    except Exception as e:
-                        logger.warning(f"Failed to clean up session directory {session_dir.name}: {e}")
-
-            if cleaned_count > 0:
-                logger.info(f"Cleaned up {cleaned_count} old session directories")
+            self.session_janitor.purge_expired()
         except Exception as e:
             logger.error(f"Error cleaning up session directories: {e}")
 
-    def query_recordings(self, camera_id: str, start_time: datetime, end_time: datetime) -> dict:
+    def list_segments(self, camera_id: str, start_time: Optional[datetime] = None,
+                      end_time: Optional[datetime] = None) -> list:
+        """
+        获取摄像机在指定时间段内已完成的录像段
+
+        Args:
+            camera_id: 摄像机ID
+            start_time: 开始时间
+            end_time: 结束时间
+
+        Returns:
+            录像文件信息列表（按开始时间排序）
+        """
+        camera = self.camera_manager.get_camera(camera_id)
+        if not camera:
+            raise ValueError(f"Camera {camera_id} not found")
+
+        # 获取录像器（可能正在录像，也可能已停止）
+        recorder = self.recorders.get(camera_id)
+        if recorder is None:
+            # 创建一个临时录像器用于查询
+            recorder = VideoRecorder(
+                camera_id=camera_id,
+                rtsp_url=camera.rtsp_url,
+                output_dir=self.output_dir,
+                segment_duration=camera.segment_duration or self.segment_duration,
+                ffmpeg_path=self.ffmpeg_path
+            )
+
+        return recorder.get_recorded_files(start_time, end_time)
+
+    def get_current_segment(self, camera_id: str) -> Optional[tuple]:
+        """
+        获取正在录制的段
+
+        Returns:
+            (临时文件路径, 开始时间)，未在录像时返回None
+        """
+        recorder = self.recorders.get(camera_id)
+        if recorder and recorder.is_running:
+            return recorder.current_segment
+        return None
+
+    @QUERY_DURATION.time("query")
+    def query_recordings(self, camera_id: str, start_time: datetime, end_time: datetime,
+                         include_timing: bool = False) -> dict:
         """
         查询指定时间段的录像
 
@@ -163,12 +321,11 @@ class RecordingManager:
             camera_id: 摄像机ID
             start_time: 开始时间
             end_time: 结束时间
+            include_timing: 是否在结果中返回各阶段耗时（timing）
 
         Returns:
             录像文件信息
         """
-        import time
-
         # logger.info("=" * 80)
         # logger.info(f"[QUERY] 开始查询录像")
         # logger.info(f"[QUERY] Camera ID: {camera_id}")
@@ -177,52 +334,33 @@ class RecordingManager:
         # logger.info(f"[QUERY] Duration: {(end_time - start_time).total_seconds() / 60:.2f} minutes")
         # logger.info("=" * 80)
 
-        # 先清理旧的session目录（避免累积）
-        self.cleanup_old_sessions(max_age_hours=24)
-
         # 检查摄像机是否存在
         camera = self.camera_manager.get_camera(camera_id)
         if not camera:
             raise ValueError(f"Camera {camera_id} not found")
 
+        trace = QueryTrace("query", camera_id=camera_id,
+                           start_time=start_time.isoformat(), end_time=end_time.isoformat())
+
         # 检查是否需要强制切分当前录像段
         need_force_split = False
         current_time = datetime.now()
 
         # 如果结束时间接近当前时间（5秒内），且摄像机正在录像，则需要强制切分
-        if abs((end_time - current_time).total_seconds()) < 5:
-            with self.lock:
-                if camera_id in self.recorders and self.recorders[camera_id].is_running:
-                    need_force_split = True
-                    logger.info(f"Query end time is near current time, will force segment split for camera {camera_id}")
+        if abs((end_time - current_time).total_seconds()) < 5 and self.is_recording(camera_id):
+            need_force_split = True
+            logger.info(f"Query end time is near current time, will force segment split for camera {camera_id}")
 
         # 执行强制切分
-        if need_force_split:
-            with self.lock:
-                recorder = self.recorders[camera_id]
-                if recorder and recorder.is_running:
-                    # 强制结束当前段
-                    recorder.force_segment_split()
-                    # 等待文件重命名完成
-                    time.sleep(2)
-                    logger.info(f"Force segment split completed for camera {camera_id}")
-
-        # 获取录像器（可能正在录像，也可能已停止）
-        with self.lock:
-            if camera_id in self.recorders:
-                recorder = self.recorders[camera_id]
-            else:
-                # 创建一个临时录像器用于查询
-                recorder = VideoRecorder(
-                    camera_id=camera_id,
-                    rtsp_url=camera.rtsp_url,
-                    output_dir=self.output_dir,
-                    segment_duration=self.segment_duration,
-                    ffmpeg_path=self.ffmpeg_path
-                )
+        with trace.stage("split_wait"):
+            if need_force_split and self._force_split(camera_id):
+                # 等待文件重命名完成
+                time.sleep(2)
+                logger.info(f"Force segment split completed for camera {camera_id}")
 
         # 获取时间段内的录像文件
-        video_files = recorder.get_recorded_files(start_time, end_time)
+        with trace.stage("index"):
+            video_files = self.list_segments(camera_id, start_time, end_time)
 
         # logger.info(f"[QUERY] 找到 {len(video_files)} 个录像文件")
         # for i, vf in enumerate(video_files, 1):
@@ -232,12 +370,13 @@ class RecordingManager:
 
         if not video_files:
             logger.info(f"[QUERY] No recordings found for camera {camera_id} between {start_time} and {end_time}")
-            return {
+            result = {
                 "camera_id": camera_id,
                 "start_time": start_time.isoformat(),
                 "end_time": end_time.isoformat(),
                 "files": []
             }
+            return self._finish_trace(trace, result, include_timing, segments=0)
 
         # 创建录像会话进行处理
         session = RecordingSession(
@@ -246,8 +385,11 @@ class RecordingManager:
             end_time=end_time,
             video_files=video_files,
             output_dir=self.output_dir,
-            ffmpeg_path=self.ffmpeg_path
+            ffmpeg_path=self.ffmpeg_path,
+            trace=trace
         )
+        # 登记session目录，由后台清理器按过期时间删除
+        self.session_janitor.register(session.session_dir)
 
         # 处理并返回结果
         result = session.get_result()
@@ -264,23 +406,384 @@ class RecordingManager:
         #     logger.info(f"               大小: {f['size'] / 1024 / 1024:.2f} MB")
         # logger.info("=" * 80)
 
+        return self._finish_trace(trace, result, include_timing, segments=len(video_files))
+
+    def _finish_trace(self, trace: QueryTrace, result: dict, include_timing: bool, **params) -> dict:
+        """结束耗时记录（超过query.slow_threshold秒写入慢查询日志），按需把耗时加入结果"""
+        trace.params.update(params)
+        timing = trace.finish(self.config.get('query', {}).get('slow_threshold', 5))
+        if include_timing:
+            result["timing"] = timing
         return result
 
-    def stop_all(self):
-        """停止所有录像"""
-        with self.lock:
-            camera_ids = list(self.recorders.keys())
+    def _force_split(self, camera_id: str) -> bool:
+        """强制切分当前录像段（只持有该摄像机的锁，防止切分期间被停止）"""
+        slot = self._slot(camera_id)
+        with slot.lock:
+            recorder = self.recorders.get(camera_id)
+            return bool(recorder and recorder.is_running and recorder.force_segment_split())
+
+    @QUERY_DURATION.time("batch_query")
+    def query_batch(self, items: List[tuple], archive: bool = False, include_timing: bool = False) -> dict:
+        """
+        批量查询多个摄像机/时间段的录像
+
+        先统一规划：校验全部请求，每个摄像机最多强制切分一次并只等待一次，
+        再把所有请求需要截取的片段放入同一个线程池并发执行（并发数受batch_query.max_workers限制，
+        FFmpeg进程数同时受全局调度器限制）
 
-        for camera_id in camera_ids:
+        Args:
+            items: [(摄像机ID, 开始时间, 结束时间), ...]
+            archive: 是否把所有结果文件打包为一个ZIP文件
+            include_timing: 是否在结果中返回各阶段耗时（timing）
+
+        Returns:
+            {"items": [每个请求的结果], "total_files", "total_size", "archive"}
+
+        Raises:
+            ValueError: 摄像机不存在、时间段无效或请求数量超过限制
+        """
+        batch_config = self.config.get('batch_query', {})
+        max_items = batch_config.get('max_items', 50)
+        if not items:
+            raise ValueError("No query items")
+        if len(items) > max_items:
+            raise ValueError(f"Too many query items ({len(items)}), max {max_items}")
+        for camera_id, start_time, end_time in items:
+            if not self.camera_manager.get_camera(camera_id):
+                raise ValueError(f"Camera {camera_id} not found")
+            if end_time <= start_time:
+                raise ValueError(f"end_time must be after start_time for camera {camera_id}")
+
+        trace = QueryTrace("batch_query", items=[
+            [camera_id, start_time.isoformat(), end_time.isoformat()] for camera_id, start_time, end_time in items
+        ])
+
+        # 结束时间接近当前时间的摄像机统一切分一次，所有切分完成后只等待一次
+        with trace.stage("split_wait"):
+            now = datetime.now()
+            split_ids = {camera_id for camera_id, _, end_time in items
+                         if abs((end_time - now).total_seconds()) < 5 and self.is_recording(camera_id)}
+            split_done = [camera_id for camera_id in split_ids if self._force_split(camera_id)]
+            if split_done:
+                time.sleep(2)
+                logger.info(f"Force segment split completed for {len(split_done)} camera(s)")
+
+        # 规划每个请求需要的片段
+        sessions = []
+        tasks = []
+        segment_count = 0
+        for camera_id, start_time, end_time in items:
+            with trace.stage("index"):
+                video_files = self.list_segments(camera_id, start_time, end_time)
+            segment_count += len(video_files)
+            if not video_files:
+                sessions.append(None)
+                continue
+            with trace.stage("plan"):
+                session = RecordingSession(
+                    camera_id=camera_id,
+                    start_time=start_time,
+                    end_time=end_time,
+                    video_files=video_files,
+                    output_dir=self.output_dir,
+                    ffmpeg_path=self.ffmpeg_path,
+                    trace=trace
+                )
+                self.session_janitor.register(session.session_dir)
+                sessions.append(session)
+                tasks.extend((session, clip) for clip in session.plan())
+
+        # 所有请求的片段在同一个线程池中执行
+        outputs = {}
+        if tasks:
+            extract_started = time.perf_counter()
+            max_workers = min(batch_config.get('max_workers', 4), len(tasks))
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch-query") as executor:
+                paths = executor.map(lambda task: task[0].run_clip(task[1]), tasks)
+                for (session, _), path in zip(tasks, paths):
+                    if path:
+                        outputs.setdefault(id(session), []).append(path)
+            trace.add_stage("extract", time.perf_counter() - extract_started)
+
+        results = []
+        with trace.stage("assemble"):
+            for (camera_id, start_time, end_time), session in zip(items, sessions):
+                if session is None:
+                    results.append({
+                        "camera_id": camera_id,
+                        "start_time": start_time.isoformat(),
+                        "end_time": end_time.isoformat(),
+                        "files": []
+                    })
+                else:
+                    results.append(session.build_result(outputs.get(id(session), [])))
+
+        all_files = [(result["camera_id"], f) for result in results for f in result["files"]]
+        logger.info(f"Batch query: {len(items)} item(s), {len(tasks)} clip(s), {len(all_files)} file(s)")
+        archive_info = None
+        if archive and all_files:
+            with trace.stage("archive"):
+                archive_info = self._write_batch_archive(results)
+        result = {
+            "items": results,
+            "total_files": len(all_files),
+            "total_size": sum(f["size"] for _, f in all_files),
+            "archive": archive_info
+        }
+        return self._finish_trace(trace, result, include_timing, segments=segment_count)
+
+    def _write_batch_archive(self, results: List[dict]) -> dict:
+        """把批量查询的结果文件打包为一个ZIP文件（视频不再压缩，只存储）"""
+        batch_dir = Path(self.output_dir) / "sessions" / \
+            f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        batch_dir.mkdir(parents=True, exist_ok=True)
+        self.session_janitor.register(str(batch_dir))
+
+        archive_path = batch_dir / "recordings.zip"
+        with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for index, result in enumerate(results):
+                for file_info in result["files"]:
+                    # 同一摄像机可能有多个时间段，按请求序号区分目录
+                    archive.write(file_info["path"], f"{index:02d}_{result['camera_id']}/{file_info['filename']}")
+
+        return {
+            "path": str(archive_path.absolute()),
+            "filename": archive_path.name,
+            "size": archive_path.stat().st_size
+        }
+
+    @QUERY_DURATION.time("timelapse")
+    def export_timelapse(self, camera_id: str, start_time: datetime, end_time: datetime,
+                         fps: Optional[float] = None) -> dict:
+        """
+        生成指定时间段的关键帧延时视频
+
+        Args:
+            camera_id: 摄像机ID
+            start_time: 开始时间
+            end_time: 结束时间
+            fps: 输出帧率（默认使用配置值）
+
+        Returns:
+            延时视频文件信息
+        """
+        timelapse_config = self.config.get('timelapse', {})
+        video_files = self.list_segments(camera_id, start_time, end_time)
+
+        if not video_files:
+            logger.info(f"[TIMELAPSE] No recordings found for camera {camera_id} between {start_time} and {end_time}")
+            return {
+                "camera_id": camera_id,
+                "start_time": start_time.isoformat(),
+                "end_time": end_time.isoformat(),
+                "files": []
+            }
+
+        session = TimelapseSession(
+            camera_id=camera_id,
+            start_time=start_time,
+            end_time=end_time,
+            video_files=video_files,
+            output_dir=self.output_dir,
+            ffmpeg_path=self.ffmpeg_path,
+            fps=fps or timelapse_config.get('fps', 25),
+            max_workers=timelapse_config.get('max_workers', 4)
+        )
+        self.session_janitor.register(session.session_dir)
+
+        return session.get_result()
+
+    def apply_config(self, config: dict):
+        """
+        应用重新加载的配置（只更新参数，不重启录像器；需要重启的录像器由sync_recorders处理）
+
+        Args:
+            config: 新配置（与初始化时为同一字典对象时同样适用）
+        """
+        self.config = config
+        self.segment_duration = config['recording']['segment_duration']
+        self.ffmpeg_path = config['ffmpeg']['path']
+        self.reconnect_config = {
+            'reconnect': config['ffmpeg']['reconnect'],
+            'reconnect_at_eof': config['ffmpeg']['reconnect_at_eof'],
+            'reconnect_streamed': config['ffmpeg']['reconnect_streamed'],
+            'reconnect_delay_max': config['ffmpeg']['reconnect_delay_max'],
+        }
+
+        self.session_janitor.max_age_seconds = config['recording'].get('session_retention_hours', 24) * 3600
+        self.session_janitor.max_deletions_per_second = config['recording'].get('session_cleanup_rate', 5)
+
+        thumbnail_config = config.get('thumbnails', {})
+        if self.thumbnail_generator:
+            self.thumbnail_generator.ffmpeg_path = self.ffmpeg_path
+            self.thumbnail_generator.interval = thumbnail_config.get('interval', 10)
+            self.thumbnail_generator.tile_width = thumbnail_config.get('width', 160)
+            self.thumbnail_generator.tile_height = thumbnail_config.get('height', 90)
+            self.thumbnail_generator.columns = thumbnail_config.get('columns', 10)
+
+    def _recorder_changed(self, recorder: VideoRecorder, camera) -> bool:
+        """录像器的生效参数是否与摄像机当前策略不同（不同则需要重启录像器）"""
+        policy = self.get_camera_policy(camera)
+        return (recorder.rtsp_url != policy['rtsp_url']
+                or recorder.segment_duration != policy['segment_duration']
+                or recorder.ffmpeg_profile != (policy['ffmpeg_profile'] or {})
+                or recorder.ffmpeg_path != self.ffmpeg_path)
+
+    def sync_recorders(self, start_ids: Optional[list] = None) -> dict:
+        """
+        使正在运行的录像器与摄像机配置一致：只重启生效参数发生变化的录像器，
+        停止已删除或已禁用摄像机的录像器，其余录像器不受影响
+
+        Args:
+            start_ids: 需要开始录像的摄像机ID（新增或重新启用的摄像机）
+
+        Returns:
+            {"restarted": [...], "stopped": [...], "started": [...], "failed": {...}}
+        """
+        result = {"restarted": [], "stopped": [], "started": [], "failed": {}}
+
+        for camera_id, recorder in list(self.recorders.items()):
             try:
-                self.stop_recording(camera_id)
+                camera = self.camera_manager.get_camera(camera_id)
+                if camera is None:
+                    # 摄像机已从配置中删除
+                    slot = self._slot(camera_id)
+                    with slot.lock:
+                        if recorder.is_running:
+                            slot.state = RECORDER_STOPPING
+                            recorder.stop()
+                            result["stopped"].append(camera_id)
+                        slot.state = RECORDER_STOPPED
+                        self._publish_recorder(camera_id, None)
+                    metrics.remove_camera(camera_id)
+                elif not recorder.is_running:
+                    continue
+                elif not camera.enabled:
+                    self.stop_recording(camera_id)
+                    result["stopped"].append(camera_id)
+                elif self._recorder_changed(recorder, camera):
+                    logger.info(f"Recording parameters changed for camera {camera_id}, restarting recorder")
+                    self.stop_recording(camera_id)
+                    self.start_recording(camera_id)
+                    result["restarted"].append(camera_id)
             except Exception as e:
-                logger.error(f"Error stopping recording for camera {camera_id}: {e}")
+                logger.error(f"Error applying config to camera {camera_id}: {e}")
+                result["failed"][camera_id] = str(e)
 
-        logger.info("All recordings stopped")
+        for camera_id in start_ids or []:
+            if self.is_recording(camera_id):
+                continue
+            try:
+                self.start_recording(camera_id)
+                result["started"].append(camera_id)
+            except Exception as e:
+                logger.error(f"Failed to start recording for camera {camera_id}: {e}")
+                result["failed"][camera_id] = str(e)
+
+        return result
+
+    def start_all(self, camera_ids: List[str], stagger: float = 0.5, jitter: float = 0.5,
+                  concurrency: int = 4) -> threading.Thread:
+        """
+        在后台分批开始录像，避免所有摄像机同时连接造成网络和摄像机端的突发负载
+
+        每批concurrency个摄像机，批与批间隔stagger秒，每个摄像机再加上0~jitter秒的随机延迟
+
+        Args:
+            camera_ids: 需要开始录像的摄像机ID
+            stagger: 批间隔（秒）
+            jitter: 随机延迟上限（秒）
+            concurrency: 每批同时开始的摄像机数
+
+        Returns:
+            后台启动线程
+        """
+        concurrency = max(1, concurrency)
+        plan = sorted(
+            ((index // concurrency) * stagger + random.uniform(0, jitter), camera_id)
+            for index, camera_id in enumerate(camera_ids)
+        )
+
+        def run():
+            begin = time.monotonic()
+            started = 0
+            for delay, camera_id in plan:
+                if self._startup_cancel.wait(max(0.0, begin + delay - time.monotonic())):
+                    logger.info(f"Auto-start cancelled, {len(plan) - started} camera(s) not started")
+                    return
+                try:
+                    self.start_recording(camera_id)
+                    started += 1
+                    logger.info(f"Auto-started recording for camera: {camera_id}")
+                except Exception as e:
+                    logger.error(f"Failed to auto-start recording for camera {camera_id}: {e}")
+
+            logger.info(f"Auto-started recording for {started}/{len(plan)} camera(s) "
+                        f"in {time.monotonic() - begin:.1f}s")
+
+        self._startup_cancel.clear()
+        self._startup_thread = threading.Thread(target=run, name="recorder-startup", daemon=True)
+        self._startup_thread.start()
+        return self._startup_thread
+
+    def stop_all(self, timeout: float = 15):
+        """
+        停止所有录像：同时向所有FFmpeg发送停止信号，在同一个截止时间内统一等待
+
+        Args:
+            timeout: 等待所有FFmpeg退出的总时间（秒），超时后强制结束剩余进程
+        """
+        begin = time.monotonic()
+        deadline = begin + timeout
+
+        # 取消尚未开始的自动启动
+        self._startup_cancel.set()
+        if self._startup_thread and self._startup_thread.is_alive():
+            self._startup_thread.join(timeout=max(0.0, deadline - time.monotonic()))
+
+        # 之后的start_recording将被拒绝
+        self._shutting_down = True
+
+        # 正在停止或切分的摄像机可能长时间持有slot.lock：最多等到截止时间，
+        # 超时后不加锁直接发送停止信号，保证关闭不超过timeout
+        recorders = []
+        for camera_id, recorder in list(self.recorders.items()):
+            slot = self._slot(camera_id)
+            locked = slot.lock.acquire(timeout=max(0.0, deadline - time.monotonic()))
+            if not locked:
+                logger.warning(f"Camera {camera_id} is busy, signalling its recorder to stop without the lock")
+            try:
+                if recorder.signal_stop():
+                    slot.state = RECORDER_STOPPING
+                    recorders.append((camera_id, recorder))
+            finally:
+                if locked:
+                    slot.lock.release()
+
+        not_stopped = [camera_id for camera_id, recorder in recorders
+                       if not recorder.wait_stopped(deadline)]
+
+        for camera_id, _ in recorders:
+            slot = self._slot(camera_id)
+            locked = slot.lock.acquire(timeout=max(0.0, deadline - time.monotonic()))
+            try:
+                slot.state = RECORDER_STOPPED
+                camera = self.camera_manager.get_camera(camera_id)
+                if camera:
+                    camera.is_recording = False
+                    camera.current_recorder = None
+            finally:
+                if locked:
+                    slot.lock.release()
+
+        if not_stopped:
+            logger.warning(f"Recorder threads still running after shutdown deadline: {not_stopped}")
+        logger.info(f"All recordings stopped ({len(recorders)} recorders in "
+                    f"{time.monotonic() - begin:.1f}s)")
 
     def get_all_status(self) -> dict:
-        """获取所有摄像机的录像状态"""
+        """获取所有摄像机的录像状态（不获取任何摄像机的锁）"""
         cameras = self.camera_manager.list_cameras()
         status = {}
 
@@ -288,7 +791,8 @@ class RecordingManager:
             status[camera.id] = {
                 "name": camera.name,
                 "enabled": camera.enabled,
-                "is_recording": self.is_recording(camera.id)
+                "is_recording": self.is_recording(camera.id),
+                "state": self.get_state(camera.id)
             }
 
         return status
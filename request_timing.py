@@ -0,0 +1,82 @@
+"""
+请求计时中间件
+按路由模板记录HTTP请求耗时直方图，并统计各路由正在处理的请求数（纯ASGI中间件，不缓冲响应，
+SSE和流式下载同样适用）
+"""
+
+import time
+from typing import Dict, Iterable
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from metrics import HTTP_REQUEST_DURATION
+
+# 没有匹配任何路由（或尚未完成路由）的请求统一使用此标签
+UNMATCHED_ROUTE = "unmatched"
+
+# 正在处理的请求（路由完成后scope中才有路由对象，输出指标时再确定路由）
+_active: Dict[int, Scope] = {}
+
+
+def route_label(scope: Scope) -> str:
+    """
+    请求对应的路由模板（如/api/cameras/{camera_id}）
+
+    使用路由完成后scope中的路由对象的path_format；include_router的前缀不在路由的模板中，
+    由实际路径中位于路由匹配部分之前的部分得到
+    """
+    route = scope.get("route")
+    template = getattr(route, "path_format", None)
+    if scope.get("endpoint") is None or not template:
+        return UNMATCHED_ROUTE
+
+    path = scope.get("path", "")
+    path_regex = getattr(route, "path_regex", None)
+    if path_regex is None or path_regex.match(path):
+        return template
+    # 从左到右查找路由模板能匹配剩余部分的位置
+    index = path.find("/", 1)
+    while index > 0:
+        if path_regex.match(path[index:]):
+            return path[:index] + template
+        index = path.find("/", index + 1)
+    return template
+
+
+def collect_in_flight() -> Iterable[tuple]:
+    """指标采集函数：各路由正在处理的请求数"""
+    counts: Dict[str, int] = {}
+    for scope in list(_active.values()):
+        route = route_label(scope)
+        counts[route] = counts.get(route, 0) + 1
+    samples = [({"route": route}, count) for route, count in sorted(counts.items())]
+    return [("http_requests_in_flight", "gauge", "HTTP requests currently being processed", samples)]
+
+
+class RequestTimingMiddleware:
+    """记录请求耗时（到响应内容发送完毕为止）和正在处理的请求"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500  # 未发送响应就抛出异常时按500记录
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        key = id(scope)
+        _active[key] = scope
+        begin = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _active.pop(key, None)
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - begin, scope["method"], route_label(scope), str(status))
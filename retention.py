@@ -0,0 +1,561 @@
+"""
+录像保留策略模块
+基于录像段索引增量删除最旧的录像段（保留天数、磁盘剩余空间下限、摄像机存储配额）
+"""
+
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Set
+import logging
+
+from segment_index import OrphanFile
+from thumbnails import remove_thumbnails
+
+logger = logging.getLogger(__name__)
+
+GB = 1024 * 1024 * 1024
+
+# 连续删除失败达到此数量时结束本轮删除（磁盘只读、权限错误等，下一轮检查时重试）
+MAX_CONSECUTIVE_DELETE_FAILURES = 10
+
+
+def delete_segment(path: str) -> int:
+    """
+    删除录像段及其缩略图
+
+    Returns:
+        释放的字节数（文件不存在时为0）
+    """
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except FileNotFoundError:
+        return 0
+    remove_thumbnails(path)
+    return size
+
+
+def retention_options(recording_config: dict) -> dict:
+    """根据配置文件的recording部分生成RetentionManager的参数"""
+    return {
+        'retention_days': recording_config['retention_days'],
+        'min_free_gb': recording_config.get('min_free_gb', 0),
+        'min_free_percent': recording_config.get('min_free_percent', 0),
+        'check_interval': recording_config.get('retention_check_interval', 5),
+        'throttle_config': {
+            'max_files_per_second': recording_config.get('delete_max_files_per_second', 20),
+            'max_bytes_per_second': recording_config.get('delete_max_mb_per_second', 200) * 1024 * 1024,
+            'batch_size': recording_config.get('delete_batch_size', 50),
+            'latency_threshold': recording_config.get('delete_latency_threshold_ms', 200) / 1000
+        }
+    }
+
+
+class DeletionThrottle:
+    """
+    删除限速器
+
+    按文件数/字节数预算控制删除速度，每批删除后探测录像磁盘的写入延迟，
+    延迟升高时退避，避免大量删除引起文件系统日志和磁盘队列拥塞导致录像丢包
+    """
+
+    PROBE_FILE = ".retention_probe"
+
+    def __init__(self, output_dir: str, max_files_per_second: float = 20,
+                 max_bytes_per_second: float = 200 * 1024 * 1024, batch_size: int = 50,
+                 latency_threshold: float = 0.2, max_backoff: float = 30,
+                 stop_event: Optional[threading.Event] = None):
+        """
+        初始化限速器
+
+        Args:
+            output_dir: 录像根目录（写入延迟探测文件所在位置）
+            max_files_per_second: 每秒最多删除的文件数
+            max_bytes_per_second: 每秒最多删除的字节数
+            batch_size: 每批删除的文件数（每批之后探测一次写入延迟）
+            latency_threshold: 写入延迟阈值（秒），超过时退避
+            max_backoff: 最长退避时间（秒）
+            stop_event: 停止事件（等待期间可被中断）
+        """
+        self.probe_path = os.path.join(output_dir, self.PROBE_FILE)
+        self.max_files_per_second = max_files_per_second
+        self.max_bytes_per_second = max_bytes_per_second
+        self.batch_size = max(1, batch_size)
+        self.latency_threshold = latency_threshold
+        self.max_backoff = max_backoff
+        self.stop_event = stop_event or threading.Event()
+
+        self.backoff = 0.0
+        self.last_latency = None
+        self.backoff_count = 0
+        self.throttled_seconds = 0.0
+
+        self._window_start = time.monotonic()
+        self._window_files = 0
+        self._window_bytes = 0
+        self._batch_files = 0
+
+    def reset(self):
+        """开始新一轮删除（重置速率窗口）"""
+        self._window_start = time.monotonic()
+        self._window_files = 0
+        self._window_bytes = 0
+        self._batch_files = 0
+
+    def _wait(self, seconds: float):
+        if seconds > 0:
+            self.throttled_seconds += seconds
+            self.stop_event.wait(seconds)
+
+    def probe_write_latency(self) -> float:
+        """写入并fsync一个小文件，测量录像磁盘当前的写入延迟（秒）"""
+        begin = time.monotonic()
+        fd = os.open(self.probe_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, b"\0" * 4096)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self.last_latency = time.monotonic() - begin
+        return self.last_latency
+
+    def record(self, size: int, urgent: bool = False):
+        """
+        登记一次删除，并按预算等待
+
+        Args:
+            size: 删除的字节数
+            urgent: 紧急删除（磁盘空间不足），只限速不因写入延迟退避
+        """
+        self._window_files += 1
+        self._window_bytes += size
+
+        # 按文件数和字节数中较严格的预算计算这批删除至少应花费的时间
+        expected = 0.0
+        if self.max_files_per_second > 0:
+            expected = self._window_files / self.max_files_per_second
+        if self.max_bytes_per_second > 0:
+            expected = max(expected, self._window_bytes / self.max_bytes_per_second)
+        self._wait(expected - (time.monotonic() - self._window_start))
+
+        self._batch_files += 1
+        if self._batch_files < self.batch_size:
+            return
+        self._batch_files = 0
+
+        if urgent or self.latency_threshold <= 0:
+            return
+
+        try:
+            latency = self.probe_write_latency()
+        except OSError as e:
+            logger.warning(f"Write latency probe failed: {e}")
+            return
+
+        if latency > self.latency_threshold:
+            self.backoff = min(max(self.backoff * 2, 1.0), self.max_backoff)
+            self.backoff_count += 1
+            logger.warning(f"Recording disk write latency {latency * 1000:.0f}ms above threshold, "
+                           f"pausing deletion for {self.backoff:.1f}s")
+            self._wait(self.backoff)
+            # 退避后重新计算速率窗口
+            self.reset()
+        else:
+            self.backoff = 0.0
+
+
+class RetentionManager:
+    """录像保留管理器：按保留天数、磁盘剩余空间下限和摄像机配额删除最旧的录像段"""
+
+    def __init__(self, camera_manager, segment_index, output_dir: str,
+                 retention_days: Optional[float] = 7, min_free_gb: float = 0,
+                 min_free_percent: float = 0, check_interval: float = 5,
+                 throttle_config: Optional[dict] = None):
+        """
+        初始化保留管理器
+
+        Args:
+            camera_manager: 摄像机管理器（读取各摄像机的quota_gb和retention_days）
+            segment_index: 录像段索引（按时间排序，由录像器维护）
+            output_dir: 录像根目录
+            retention_days: 默认录像保留天数（None或0表示不按时间删除，可按摄像机覆盖）
+            min_free_gb: 录像磁盘最少剩余空间（GB），0表示不按剩余空间删除（需要明确启用，
+                避免在本来就空间较小或与其他用途共用的磁盘上删除全部录像）
+            min_free_percent: 录像磁盘最少剩余空间（百分比，与min_free_gb取较大者）
+            check_interval: 检查间隔（秒）
+            throttle_config: 删除限速参数（DeletionThrottle的关键字参数）
+        """
+        self.camera_manager = camera_manager
+        self.segment_index = segment_index
+        self.output_dir = output_dir
+        self.retention_days = retention_days
+        self.min_free_gb = min_free_gb
+        self.min_free_percent = min_free_percent
+        self.check_interval = check_interval
+
+        self.deleted_files = 0
+        self.deleted_bytes = 0
+        self.failed_deletes = 0
+        self._consecutive_failures = 0
+        self.last_disk_usage = None
+
+        # 当前一轮删除的进度
+        self.progress = {
+            "state": "idle",
+            "reason": None,
+            "pending_files": 0,
+            "deleted_files": 0,
+            "deleted_bytes": 0,
+            "started_at": None
+        }
+
+        self._stop_event = threading.Event()
+        self.throttle = DeletionThrottle(output_dir, stop_event=self._stop_event, **(throttle_config or {}))
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()  # 同一时间只执行一轮清理
+
+    def configure(self, retention_days: Optional[float] = 7, min_free_gb: float = 0,
+                  min_free_percent: float = 0, check_interval: float = 5,
+                  throttle_config: Optional[dict] = None):
+        """更新保留参数（运行时调用，下一轮检查生效）"""
+        self.retention_days = retention_days
+        self.min_free_gb = min_free_gb
+        self.min_free_percent = min_free_percent
+        self.check_interval = check_interval
+        for key, value in (throttle_config or {}).items():
+            setattr(self.throttle, key, max(1, value) if key == 'batch_size' else value)
+
+        logger.info(f"Retention manager reconfigured: retention_days={self.retention_days}, "
+                    f"min_free={self.min_free_gb}GB/{self.min_free_percent}%, "
+                    f"check_interval={self.check_interval}s")
+
+    def free_space_floor(self, total_bytes: int) -> int:
+        """计算需要保留的最少剩余字节数"""
+        return int(max(self.min_free_gb * GB, total_bytes * self.min_free_percent / 100))
+
+    def _begin(self, reason: str, pending_files: int):
+        """开始一类删除，更新进度信息"""
+        self.progress.update({
+            "state": "deleting",
+            "reason": reason,
+            "pending_files": pending_files
+        })
+
+    def _delete(self, segment, reason: str, urgent: bool = False) -> Optional[int]:
+        """
+        删除已从索引移除的录像段或无法索引的文件（经过限速）
+
+        删除失败时（文件被占用、权限错误等）把录像段放回索引，保证索引与磁盘一致
+
+        Returns:
+            实际释放的字节数（文件已不存在时为0，不使用索引中可能过期的大小），删除失败时为None
+        """
+        try:
+            freed = delete_segment(segment.path)
+        except Exception as e:
+            logger.error(f"Error deleting file {segment.path}: {e}")
+            self.failed_deletes += 1
+            self._consecutive_failures += 1
+            if isinstance(segment, OrphanFile):
+                self.segment_index.add_orphan(segment)
+            else:
+                self.segment_index.add(segment.camera_id, segment.path, segment.start_time,
+                                       segment.end_time, size=segment.size)
+            return None
+
+        self._consecutive_failures = 0
+        self.progress["pending_files"] = max(0, self.progress["pending_files"] - 1)
+        if not freed:
+            logger.debug(f"Recording already removed ({reason}): {segment.path}")
+            return 0
+
+        self.deleted_files += 1
+        self.deleted_bytes += freed
+        self.progress["deleted_files"] += 1
+        self.progress["deleted_bytes"] += freed
+        logger.debug(f"Deleted recording ({reason}): {segment.path}")
+
+        if self.progress["deleted_files"] % self.throttle.batch_size == 0:
+            logger.info(f"Retention progress ({reason}): {self.progress['deleted_files']} files, "
+                        f"{self.progress['deleted_bytes'] / 1024 / 1024:.2f} MB deleted, "
+                        f"{self.progress['pending_files']} pending")
+
+        self.throttle.record(freed, urgent=urgent)
+        return freed
+
+    def _deletes_failing(self) -> bool:
+        """连续删除失败过多时结束本轮删除"""
+        if self._consecutive_failures < MAX_CONSECUTIVE_DELETE_FAILURES:
+            return False
+        logger.error(f"{self._consecutive_failures} consecutive deletions failed, "
+                     f"stopping this retention pass")
+        return True
+
+    def get_retention_days(self, camera_id: str) -> Optional[float]:
+        """摄像机的生效保留天数（摄像机未设置时使用默认值）"""
+        camera = self.camera_manager.get_camera(camera_id)
+        if camera and camera.retention_days:
+            return camera.retention_days
+        return self.retention_days
+
+    def cleanup_old_recordings(self) -> int:
+        """
+        删除超过保留天数的录像段（按各摄像机的保留天数，只处理已过期的前缀）
+
+        Returns:
+            释放的字节数
+        """
+        now = datetime.now()
+        cutoffs = {}
+        for camera_id in self.segment_index.camera_ids():
+            days = self.get_retention_days(camera_id)
+            if days:
+                cutoffs[camera_id] = now - timedelta(days=days)
+
+        pending = sum(self.segment_index.count_before(cid, cutoff) for cid, cutoff in cutoffs.items())
+        if not pending:
+            return 0
+
+        self._begin("retention days", pending)
+        freed_total = 0
+        for camera_id, cutoff in cutoffs.items():
+            reason = f"camera {camera_id} older than {self.get_retention_days(camera_id)} days"
+            # 分批从索引取出过期段，停止时未取出的段留在索引中
+            while not self._stop_event.is_set():
+                # 限速删除可能持续很久，每批之前检查剩余空间，空间不足时优先紧急删除
+                freed_total += self.ensure_free_space()
+                batch = self.segment_index.pop_expired(camera_id, cutoff, limit=self.throttle.batch_size)
+                if not batch:
+                    break
+                failed = False
+                for segment in batch:
+                    freed = self._delete(segment, reason)
+                    if freed is None:
+                        failed = True
+                    else:
+                        freed_total += freed
+                # 删除失败的段已放回索引，继续取会再次取到，留到下一轮检查
+                if failed:
+                    break
+            if self._deletes_failing():
+                break
+
+        return freed_total
+
+    def cleanup_orphans(self) -> int:
+        """
+        删除修改时间超过保留天数的无法索引文件（崩溃遗留的*_recording.mp4等，只在启动时发现）
+
+        Returns:
+            释放的字节数
+        """
+        now = time.time()
+        freed_total = 0
+        for orphan in self.segment_index.orphans():
+            if self._stop_event.is_set():
+                break
+            days = self.get_retention_days(orphan.camera_id)
+            if not days or orphan.mtime >= now - days * 86400:
+                continue
+            if self.segment_index.remove_orphan(orphan):
+                self._begin(f"unindexed file older than {days} days", 0)
+                freed_total += self._delete(orphan, f"unindexed file older than {days} days") or 0
+                if self._deletes_failing():
+                    break
+        return freed_total
+
+    def enforce_quotas(self) -> int:
+        """
+        执行摄像机配额：超出配额的摄像机删除最旧的录像段
+
+        Returns:
+            释放的字节数
+        """
+        freed_total = 0
+        for camera in self.camera_manager.list_cameras():
+            if not camera.quota_gb:
+                continue
+
+            quota = camera.quota_gb * GB
+            if self.segment_index.usage(camera.id) <= quota:
+                continue
+
+            reason = f"camera {camera.id} over quota {camera.quota_gb}GB"
+            self._begin(reason, 0)
+            deleted = 0
+            while self.segment_index.usage(camera.id) > quota and not self._stop_event.is_set():
+                if deleted % self.throttle.batch_size == 0:
+                    freed_total += self.ensure_free_space()
+                segment = self.segment_index.pop_oldest(camera.id)
+                if segment is None:
+                    break
+                freed = self._delete(segment, reason)
+                # 最旧的段删除失败时已放回索引，本轮跳过该摄像机
+                if freed is None:
+                    break
+                freed_total += freed
+                deleted += 1
+            if self._deletes_failing():
+                break
+
+        return freed_total
+
+    def enforce_free_space(self, bytes_needed: int) -> int:
+        """
+        释放指定字节数：每次从"已用空间/预算"比例最高的摄像机删除最旧的录像段，
+        使各摄像机按预算比例分摊删除量
+
+        Args:
+            bytes_needed: 需要释放的字节数
+
+        Returns:
+            释放的字节数
+        """
+        cameras = {cam.id: cam for cam in self.camera_manager.list_cameras()}
+        quotas = [cam.quota_gb for cam in cameras.values() if cam.quota_gb]
+        # 未设置配额的摄像机使用已设置配额的平均值作为预算（都未设置时权重相同）
+        default_budget = sum(quotas) / len(quotas) if quotas else 1.0
+
+        def budget(camera_id: str) -> float:
+            camera = cameras.get(camera_id)
+            return camera.quota_gb if camera and camera.quota_gb else default_budget
+
+        self._begin("low disk space", 0)
+        freed_total = 0
+        # 最旧的段删除失败的摄像机（段已放回索引），本次不再从这些摄像机删除
+        skipped: Set[str] = set()
+        while freed_total < bytes_needed and not self._stop_event.is_set():
+            candidates = [cid for cid in self.segment_index.camera_ids() if cid not in skipped]
+            if not candidates:
+                if skipped:
+                    logger.error(f"Free space below floor but deleting the oldest recordings failed "
+                                 f"({(bytes_needed - freed_total) / GB:.2f} GB still needed)")
+                    break
+                logger.error(f"Free space below floor ({self.min_free_gb}GB/{self.min_free_percent}%) but no "
+                             f"recordings left to delete ({(bytes_needed - freed_total) / GB:.2f} GB still needed), "
+                             f"check min_free_gb/min_free_percent and what else is using the disk")
+                break
+
+            camera_id = max(candidates, key=lambda cid: self.segment_index.usage(cid) / budget(cid))
+            segment = self.segment_index.pop_oldest(camera_id)
+            if segment is None:
+                skipped.add(camera_id)
+                continue
+            freed = self._delete(segment, "low disk space", urgent=True)
+            if freed is None:
+                skipped.add(camera_id)
+                if self._deletes_failing():
+                    break
+            else:
+                freed_total += freed
+
+        return freed_total
+
+    def ensure_free_space(self) -> int:
+        """
+        检查录像磁盘剩余空间，低于下限时立即紧急删除（在限速的按天数/配额删除之前和各批之间调用）
+
+        Returns:
+            释放的字节数
+        """
+        disk = shutil.disk_usage(self.output_dir)
+        self.last_disk_usage = disk
+        bytes_needed = self.free_space_floor(disk.total) - disk.free
+        if bytes_needed <= 0:
+            return 0
+
+        logger.warning(f"Free space {disk.free / GB:.2f} GB below floor, "
+                       f"freeing {bytes_needed / GB:.2f} GB")
+        # 紧急删除结束后恢复被打断的删除的进度信息
+        reason, pending = self.progress["reason"], self.progress["pending_files"]
+        freed = self.enforce_free_space(bytes_needed)
+        self.progress.update({"reason": reason, "pending_files": pending})
+        return freed
+
+    def check(self) -> int:
+        """
+        执行一轮检查（开销与删除的录像段数量成正比，不扫描目录）
+
+        Returns:
+            释放的字节数
+        """
+        with self.lock:
+            self.throttle.reset()
+            self._consecutive_failures = 0
+            self.progress.update({
+                "reason": None,
+                "pending_files": 0,
+                "deleted_files": 0,
+                "deleted_bytes": 0,
+                "started_at": datetime.now().isoformat()
+            })
+
+            # 剩余空间不足时先紧急删除，不等待限速的按天数/配额删除完成
+            freed = self.ensure_free_space()
+            freed += self.cleanup_old_recordings()
+            freed += self.cleanup_orphans()
+            freed += self.enforce_quotas()
+            freed += self.ensure_free_space()
+
+            self.progress.update({"state": "idle", "pending_files": 0})
+            if freed > 0:
+                logger.info(f"Retention freed {freed / 1024 / 1024:.2f} MB "
+                            f"({self.progress['deleted_files']} files)")
+            return freed
+
+    def get_status(self) -> dict:
+        """获取保留管理器状态"""
+        disk = self.last_disk_usage
+        return {
+            "retention_days": self.retention_days,
+            "min_free_gb": self.min_free_gb,
+            "min_free_percent": self.min_free_percent,
+            "disk": {
+                "total": disk.total,
+                "used": disk.used,
+                "free": disk.free
+            } if disk else None,
+            "deleted_files": self.deleted_files,
+            "deleted_bytes": self.deleted_bytes,
+            "failed_deletes": self.failed_deletes,
+            "progress": dict(self.progress),
+            "throttle": {
+                "max_files_per_second": self.throttle.max_files_per_second,
+                "max_bytes_per_second": self.throttle.max_bytes_per_second,
+                "last_write_latency_ms": round(self.throttle.last_latency * 1000, 1)
+                if self.throttle.last_latency is not None else None,
+                "backoff_count": self.throttle.backoff_count,
+                "throttled_seconds": round(self.throttle.throttled_seconds, 1)
+            }
+        }
+
+    def start(self):
+        """启动后台检查线程"""
+        if self.thread and self.thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self.thread.start()
+        logger.info(f"Retention manager started: retention_days={self.retention_days}, "
+                    f"min_free={self.min_free_gb}GB/{self.min_free_percent}%, "
+                    f"check_interval={self.check_interval}s")
+
+    def stop(self):
+        """停止后台检查线程"""
+        self._stop_event.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=5)
+
+    def _run(self):
+        """后台线程：持续执行增量清理"""
+        while not self._stop_event.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Error in retention manager: {e}")
+
+            self._stop_event.wait(self.check_interval)
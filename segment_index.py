@@ -0,0 +1,307 @@
+"""
+录像段索引模块
+在内存中按摄像机维护已完成的录像段（按时间排序），由录像器在分段完成时更新，
+供保留策略等模块使用，避免反复扫描录像目录
+"""
+
+import bisect
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+import logging
+
+from recorder import parse_segment_filename
+
+logger = logging.getLogger(__name__)
+
+
+class SegmentInfo(NamedTuple):
+    """录像段信息"""
+    start_time: datetime
+    end_time: datetime
+    path: str
+    size: int
+    camera_id: str
+
+    def to_dict(self) -> dict:
+        """转换为字典格式（与VideoRecorder.get_recorded_files一致）"""
+        return {
+            "path": self.path,
+            "filename": os.path.basename(self.path),
+            "start_time": self.start_time.isoformat(),
+            "end_time": self.end_time.isoformat(),
+            "duration": (self.end_time - self.start_time).total_seconds(),
+            "size": self.size
+        }
+
+
+class OrphanFile(NamedTuple):
+    """
+    无法建立索引的录像目录文件（崩溃遗留的*_recording.mp4、无法解析文件名的mp4），
+    由保留管理器按修改时间删除
+    """
+    mtime: float
+    path: str
+    size: int
+    camera_id: str
+
+
+class SegmentIndex:
+    """录像段索引"""
+
+    def __init__(self):
+        # 每个摄像机的录像段列表，按开始时间排序（同一摄像机的录像段不重叠，因此也按结束时间有序）
+        self._segments: Dict[str, List[SegmentInfo]] = {}
+        self._starts: Dict[str, List[datetime]] = {}
+        self._usage: Dict[str, int] = {}
+        self._orphans: List[OrphanFile] = []  # 按修改时间排序
+        self.lock = threading.Lock()
+        self.loaded = False
+
+    def add(self, camera_id: str, path: str, start_time: datetime, end_time: datetime,
+            size: Optional[int] = None) -> SegmentInfo:
+        """
+        添加录像段（已存在相同路径时不重复添加）
+
+        Args:
+            camera_id: 摄像机ID
+            path: 录像文件路径
+            start_time: 开始时间
+            end_time: 结束时间
+            size: 文件大小（字节），默认读取文件
+        """
+        path = os.path.abspath(path)
+        if size is None:
+            size = os.path.getsize(path)
+        segment = SegmentInfo(start_time, end_time, path, size, camera_id)
+
+        with self.lock:
+            segments = self._segments.setdefault(camera_id, [])
+            starts = self._starts.setdefault(camera_id, [])
+
+            # 新段通常是最新的，直接追加；否则二分插入
+            if not starts or start_time >= starts[-1]:
+                pos = len(starts)
+            else:
+                pos = bisect.bisect_right(starts, start_time)
+
+            # 去重（同一开始时间的相邻段）
+            lo = bisect.bisect_left(starts, start_time)
+            for i in range(lo, pos):
+                if segments[i].path == path:
+                    return segments[i]
+
+            segments.insert(pos, segment)
+            starts.insert(pos, start_time)
+            self._usage[camera_id] = self._usage.get(camera_id, 0) + size
+
+        return segment
+
+    def remove(self, segment: SegmentInfo) -> bool:
+        """从索引中移除录像段"""
+        with self.lock:
+            segments = self._segments.get(segment.camera_id)
+            if not segments:
+                return False
+            starts = self._starts[segment.camera_id]
+
+            lo = bisect.bisect_left(starts, segment.start_time)
+            hi = bisect.bisect_right(starts, segment.start_time)
+            for i in range(lo, hi):
+                if segments[i].path == segment.path:
+                    del segments[i]
+                    del starts[i]
+                    self._usage[segment.camera_id] -= segment.size
+                    return True
+        return False
+
+    def pop_oldest(self, camera_id: str) -> Optional[SegmentInfo]:
+        """移除并返回摄像机最旧的录像段"""
+        with self.lock:
+            segments = self._segments.get(camera_id)
+            if not segments:
+                return None
+            segment = segments.pop(0)
+            self._starts[camera_id].pop(0)
+            self._usage[camera_id] -= segment.size
+            return segment
+
+    def oldest(self, camera_id: str) -> Optional[SegmentInfo]:
+        """获取摄像机最旧的录像段（不移除）"""
+        with self.lock:
+            segments = self._segments.get(camera_id)
+            return segments[0] if segments else None
+
+    def pop_expired(self, camera_id: str, cutoff: datetime, limit: Optional[int] = None) -> List[SegmentInfo]:
+        """
+        移除并返回结束时间早于cutoff的录像段（只处理已过期的前缀，开销与过期数量成正比）
+
+        Args:
+            camera_id: 摄像机ID
+            cutoff: 过期时间点
+            limit: 最多返回的数量
+        """
+        expired = []
+        with self.lock:
+            segments = self._segments.get(camera_id)
+            if not segments:
+                return expired
+
+            count = 0
+            while count < len(segments) and segments[count].end_time < cutoff:
+                if limit is not None and count >= limit:
+                    break
+                count += 1
+
+            if count:
+                expired = segments[:count]
+                del segments[:count]
+                del self._starts[camera_id][:count]
+                self._usage[camera_id] -= sum(s.size for s in expired)
+
+        return expired
+
+    def page(self, camera_id: str, start_time: Optional[datetime] = None,
+             end_time: Optional[datetime] = None, after: Optional[datetime] = None,
+             limit: Optional[int] = None) -> List[SegmentInfo]:
+        """
+        按开始时间顺序分页获取与时间段重叠的录像段（二分查找，开销与返回数量成正比）
+
+        Args:
+            camera_id: 摄像机ID
+            start_time: 时间段开始（结束时间早于此时间的录像段不返回）
+            end_time: 时间段结束（开始时间晚于此时间的录像段不返回）
+            after: 分页游标，只返回开始时间晚于此时间的录像段
+            limit: 最多返回的数量
+        """
+        with self.lock:
+            segments = self._segments.get(camera_id)
+            if not segments:
+                return []
+            starts = self._starts[camera_id]
+
+            lo = 0
+            if start_time is not None:
+                # 录像段不重叠，结束时间同样有序：只需检查前一个段是否跨过start_time
+                lo = bisect.bisect_left(starts, start_time)
+                if lo > 0 and segments[lo - 1].end_time >= start_time:
+                    lo -= 1
+            if after is not None:
+                lo = max(lo, bisect.bisect_right(starts, after))
+
+            hi = bisect.bisect_right(starts, end_time) if end_time is not None else len(segments)
+            if limit is not None:
+                hi = min(hi, lo + limit)
+            return segments[lo:hi] if lo < hi else []
+
+    def count_before(self, camera_id: str, cutoff: datetime) -> int:
+        """开始时间早于cutoff的录像段数量（用于估算待删除数量）"""
+        with self.lock:
+            return bisect.bisect_left(self._starts.get(camera_id, []), cutoff)
+
+    def usage(self, camera_id: str) -> int:
+        """摄像机录像占用的字节数"""
+        with self.lock:
+            return self._usage.get(camera_id, 0)
+
+    def camera_ids(self) -> List[str]:
+        """索引中有录像段的摄像机ID列表"""
+        with self.lock:
+            return [cid for cid, segments in self._segments.items() if segments]
+
+    def count(self, camera_id: Optional[str] = None) -> int:
+        """录像段数量"""
+        with self.lock:
+            if camera_id is not None:
+                return len(self._segments.get(camera_id, []))
+            return sum(len(segments) for segments in self._segments.values())
+
+    def orphans(self) -> List[OrphanFile]:
+        """启动时发现的无法索引的文件（按修改时间排序）"""
+        with self.lock:
+            return list(self._orphans)
+
+    def add_orphan(self, orphan: OrphanFile):
+        """重新加入无法索引的文件（删除失败时调用）"""
+        with self.lock:
+            if orphan not in self._orphans:
+                bisect.insort(self._orphans, orphan)
+
+    def remove_orphan(self, orphan: OrphanFile) -> bool:
+        """从列表中移除无法索引的文件（删除前调用，返回False表示已被移除）"""
+        with self.lock:
+            try:
+                self._orphans.remove(orphan)
+                return True
+            except ValueError:
+                return False
+
+    def load(self, output_dir: str, segment_duration: int = 600) -> int:
+        """
+        启动时扫描录像目录建立索引（只执行一次）
+
+        Args:
+            output_dir: 录像根目录
+            segment_duration: 分段时长（用于旧格式文件名）
+
+        Returns:
+            加载的录像段数量
+        """
+        begin = time.monotonic()
+        count = 0
+
+        if os.path.isdir(output_dir):
+            with os.scandir(output_dir) as dirs:
+                for camera_dir in dirs:
+                    if not camera_dir.is_dir() or camera_dir.name == "sessions":
+                        continue
+                    count += self._load_camera_dir(camera_dir.name, camera_dir.path, segment_duration)
+
+        self.loaded = True
+        with self.lock:
+            self._orphans.sort()
+            orphan_count = len(self._orphans)
+        logger.info(f"Segment index loaded: {count} segments in {time.monotonic() - begin:.2f}s"
+                    + (f", {orphan_count} unindexable file(s) left to retention" if orphan_count else ""))
+        return count
+
+    def _load_camera_dir(self, camera_id: str, camera_dir: str, segment_duration: int) -> int:
+        """加载单个摄像机目录（排序后一次性合并，避免逐个插入）"""
+        loaded = []
+        orphans = []
+        with os.scandir(camera_dir) as it:
+            for entry in it:
+                name = entry.name
+                if not name.endswith(".mp4") or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                    start_time = end_time = None
+                    # 正在录制（或崩溃遗留）的临时文件和其他mp4不进入索引，按修改时间由保留管理器删除
+                    if not name.endswith("_recording.mp4") and name.startswith(f"{camera_id}_"):
+                        try:
+                            start_time, end_time = parse_segment_filename(name[:-4], segment_duration)
+                        except ValueError as e:
+                            logger.warning(f"Skipping unindexable file {name}: {e}")
+                    if start_time and end_time:
+                        loaded.append(SegmentInfo(start_time, end_time, os.path.abspath(entry.path),
+                                                  stat.st_size, camera_id))
+                    else:
+                        orphans.append(OrphanFile(stat.st_mtime, os.path.abspath(entry.path),
+                                                  stat.st_size, camera_id))
+                except FileNotFoundError:
+                    continue
+
+        with self.lock:
+            # 与加载期间录像器新增的段合并（按路径去重）
+            merged = {seg.path: seg for seg in loaded}
+            merged.update({seg.path: seg for seg in self._segments.get(camera_id, [])})
+            segments = sorted(merged.values())
+            self._segments[camera_id] = segments
+            self._starts[camera_id] = [seg.start_time for seg in segments]
+            self._usage[camera_id] = sum(seg.size for seg in segments)
+            self._orphans.extend(orphans)
+
+        return len(loaded)
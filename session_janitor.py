@@ -0,0 +1,165 @@
+"""
+Session目录清理模块
+按过期时间有序跟踪查询生成的session目录，由后台线程限速删除
+"""
+
+import heapq
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SessionJanitor:
+    """Session目录后台清理器"""
+
+    def __init__(self, sessions_dir: str, max_age_hours: float = 24,
+                 max_deletions_per_second: float = 5.0, check_interval: float = 60):
+        """
+        初始化清理器
+
+        Args:
+            sessions_dir: session根目录（通常为 recordings/sessions）
+            max_age_hours: session目录保留时间（小时）
+            max_deletions_per_second: 每秒最多删除的目录数（限速，避免I/O突发）
+            check_interval: 无到期目录时的最长休眠时间（秒）
+        """
+        self.sessions_dir = Path(sessions_dir)
+        self.max_age_seconds = max_age_hours * 3600
+        self.max_deletions_per_second = max_deletions_per_second
+        self.check_interval = check_interval
+
+        # 过期堆: (过期时间戳, 目录路径)
+        self._heap: List[Tuple[float, str]] = []
+        self.lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def register(self, session_dir: str, created_at: Optional[float] = None):
+        """
+        登记新的session目录
+
+        Args:
+            session_dir: session目录路径
+            created_at: 创建时间戳，默认为当前时间
+        """
+        created_at = created_at if created_at is not None else time.time()
+        expire_at = created_at + self.max_age_seconds
+
+        with self.lock:
+            is_earliest = not self._heap or expire_at < self._heap[0][0]
+            heapq.heappush(self._heap, (expire_at, str(session_dir)))
+
+        # 新目录成为最早过期项时唤醒后台线程重新计算等待时间
+        if is_earliest:
+            self._wakeup.set()
+
+    def pending_count(self) -> int:
+        """待清理（已登记）的session目录数"""
+        with self.lock:
+            return len(self._heap)
+
+    def scan_existing(self) -> int:
+        """
+        启动时扫描一次已有的session目录并登记（仅执行一次，不在查询路径上）
+
+        Returns:
+            登记的目录数
+        """
+        if not self.sessions_dir.exists():
+            return 0
+
+        count = 0
+        for session_dir in self.sessions_dir.iterdir():
+            if not session_dir.is_dir():
+                continue
+            try:
+                self.register(str(session_dir), created_at=session_dir.stat().st_mtime)
+                count += 1
+            except Exception as e:
+                logger.warning(f"Failed to register session directory {session_dir.name}: {e}")
+
+        logger.info(f"Registered {count} existing session directories for cleanup")
+        return count
+
+    def purge_expired(self, now: Optional[float] = None) -> int:
+        """
+        删除所有已过期的session目录（按过期顺序，限速执行）
+
+        Args:
+            now: 当前时间戳，默认为time.time()
+
+        Returns:
+            删除的目录数
+        """
+        min_interval = 1.0 / self.max_deletions_per_second if self.max_deletions_per_second > 0 else 0
+        cleaned_count = 0
+
+        while not self._stop_event.is_set():
+            current = now if now is not None else time.time()
+            with self.lock:
+                if not self._heap or self._heap[0][0] > current:
+                    break
+                _, session_dir = heapq.heappop(self._heap)
+
+            try:
+                shutil.rmtree(session_dir)
+                cleaned_count += 1
+                logger.info(f"Cleaned up old session directory: {Path(session_dir).name}")
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Failed to clean up session directory {Path(session_dir).name}: {e}")
+
+            if min_interval:
+                self._stop_event.wait(min_interval)
+
+        if cleaned_count > 0:
+            logger.info(f"Cleaned up {cleaned_count} old session directories")
+        return cleaned_count
+
+    def start(self):
+        """启动后台清理线程"""
+        if self.thread and self.thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="session-janitor", daemon=True)
+        self.thread.start()
+        logger.info(f"Session janitor started: max_age={self.max_age_seconds / 3600:.1f}h, "
+                    f"rate={self.max_deletions_per_second}/s")
+
+    def stop(self):
+        """停止后台清理线程"""
+        self._stop_event.set()
+        self._wakeup.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=5)
+
+    def _run(self):
+        """后台线程：休眠到最早的过期时间，然后清理过期目录"""
+        try:
+            self.scan_existing()
+        except Exception as e:
+            logger.error(f"Error scanning existing session directories: {e}")
+
+        while not self._stop_event.is_set():
+            self._wakeup.clear()
+            try:
+                self.purge_expired()
+            except Exception as e:
+                logger.error(f"Error in session janitor: {e}")
+
+            with self.lock:
+                next_expire = self._heap[0][0] if self._heap else None
+
+            timeout = self.check_interval
+            if next_expire is not None:
+                timeout = min(timeout, max(0.0, next_expire - time.time()))
+
+            self._wakeup.wait(timeout)
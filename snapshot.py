@@ -0,0 +1,197 @@
+"""
+快照模块
+在指定时间点截取最近的关键帧图像，仅解码一帧，并对结果做LRU缓存
+"""
+
+import subprocess
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Tuple
+import logging
+
+from ffmpeg_scheduler import PRIORITY_INTERACTIVE, get_scheduler
+
+logger = logging.getLogger(__name__)
+
+# 支持的输出格式: 格式名 -> (编码器, MIME类型)
+SNAPSHOT_FORMATS = {
+    "jpeg": ("mjpeg", "image/jpeg"),
+    "webp": ("libwebp", "image/webp"),
+}
+
+
+class SnapshotCache:
+    """按字节数限制容量的LRU缓存"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[bytes]:
+        """获取缓存项（命中时移到最近使用位置）"""
+        with self.lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: tuple, data: bytes):
+        """写入缓存项，超出容量时淘汰最久未使用的项"""
+        if len(data) > self.max_bytes:
+            return
+
+        with self.lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old)
+
+            self._items[key] = data
+            self.current_bytes += len(data)
+
+            while self.current_bytes > self.max_bytes and self._items:
+                _, evicted = self._items.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        """缓存统计信息"""
+        with self.lock:
+            return {
+                "items": len(self._items),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+class SnapshotService:
+    """快照服务"""
+
+    def __init__(self, recording_manager, ffmpeg_path: str = "ffmpeg",
+                 cache_max_bytes: int = 64 * 1024 * 1024, quality: int = 5, timeout: float = 10):
+        """
+        初始化快照服务
+
+        Args:
+            recording_manager: 录像管理器（用于查找时间点所在的录像段）
+            ffmpeg_path: FFmpeg可执行文件路径
+            cache_max_bytes: 缓存容量（字节）
+            quality: 图像质量（mjpeg的-q:v，2-31，越小质量越高）
+            timeout: FFmpeg超时时间（秒）
+        """
+        self.recording_manager = recording_manager
+        self.ffmpeg_path = ffmpeg_path
+        self.quality = quality
+        self.timeout = timeout
+        self.cache = SnapshotCache(cache_max_bytes)
+
+    def _build_ffmpeg_command(self, video_file: str, offset: float, width: Optional[int],
+                              height: Optional[int], fmt: str) -> list:
+        """构建截图命令：输入端seek到关键帧，只解码关键帧，输出一帧"""
+        codec, _ = SNAPSHOT_FORMATS[fmt]
+        cmd = [
+            self.ffmpeg_path,
+            "-hide_banner",
+            "-loglevel", "error",
+            "-nostdin",
+            # 只解码关键帧
+            "-skip_frame", "nokey",
+            # 输入端seek（跳到offset之前最近的关键帧，不逐帧解码到精确位置）
+            "-ss", f"{offset:.3f}",
+            "-noaccurate_seek",
+            "-i", video_file,
+            "-an",
+            "-frames:v", "1",
+        ]
+
+        if width or height:
+            cmd.extend(["-vf", f"scale={width or -2}:{height or -2}"])
+
+        cmd.extend(["-c:v", codec])
+        if fmt == "jpeg":
+            cmd.extend(["-q:v", str(self.quality)])
+        cmd.extend(["-f", "image2pipe", "pipe:1"])
+
+        return cmd
+
+    def find_segment(self, camera_id: str, at: datetime) -> Optional[Tuple[str, float]]:
+        """
+        查找包含指定时间点的录像段（在录像段索引中二分查找，不扫描录像目录）
+
+        Returns:
+            (文件路径, 段内偏移秒数)，找不到时返回None
+
+        Raises:
+            ValueError: 摄像机不存在
+        """
+        if not self.recording_manager.camera_manager.get_camera(camera_id):
+            raise ValueError(f"Camera {camera_id} not found")
+
+        for segment in self.recording_manager.segment_index.page(camera_id, at, at, limit=1):
+            if segment.start_time <= at <= segment.end_time:
+                offset = min((at - segment.start_time).total_seconds(),
+                             (segment.end_time - segment.start_time).total_seconds())
+                return segment.path, max(0.0, offset)
+
+        # 时间点落在正在录制的段内
+        current = self.recording_manager.get_current_segment(camera_id)
+        if current and current[1] <= at:
+            return current[0], (at - current[1]).total_seconds()
+
+        return None
+
+    def get_snapshot(self, camera_id: str, at: datetime, width: Optional[int] = None,
+                     height: Optional[int] = None, fmt: str = "jpeg") -> Optional[bytes]:
+        """
+        获取指定时间点的快照
+
+        Args:
+            camera_id: 摄像机ID
+            at: 时间点
+            width: 输出宽度（可选，只给宽或高时保持比例）
+            height: 输出高度（可选）
+            fmt: 输出格式（jpeg/webp）
+
+        Returns:
+            图像数据，找不到录像时返回None
+        """
+        if fmt not in SNAPSHOT_FORMATS:
+            raise ValueError(f"Unsupported snapshot format: {fmt}")
+
+        segment = self.find_segment(camera_id, at)
+        if not segment:
+            return None
+
+        video_file, offset = segment
+        # 关键帧间隔通常大于1秒，按整秒缓存即可覆盖同一GOP内的请求
+        cache_key = (video_file, int(offset), width, height, fmt)
+        data = self.cache.get(cache_key)
+        if data is not None:
+            return data
+
+        cmd = self._build_ffmpeg_command(video_file, offset, width, height, fmt)
+        logger.debug(f"Snapshot command: {' '.join(cmd)}")
+
+        result = get_scheduler().run(
+            cmd,
+            priority=PRIORITY_INTERACTIVE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=self.timeout
+        )
+
+        if result.returncode != 0 or not result.stdout:
+            stderr = result.stderr.decode('utf-8', errors='replace').strip()
+            logger.error(f"FFmpeg snapshot error for {video_file} at {offset:.1f}s: {stderr}")
+            raise RuntimeError(f"Failed to create snapshot for camera {camera_id}")
+
+        self.cache.put(cache_key, result.stdout)
+        return result.stdout
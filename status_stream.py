@@ -0,0 +1,199 @@
+"""
+状态推送模块
+通过Server-Sent Events向页面推送摄像机/录像状态变化和周期性的指标增量：
+只有一个后台任务检查状态，状态变化时才生成一次数据并分发给所有连接，
+服务器开销与状态变化次数成正比，与打开的页面数量无关
+"""
+
+import asyncio
+import json
+import time
+from typing import Optional, Set
+import logging
+
+import metrics
+from ffmpeg_scheduler import get_scheduler
+
+logger = logging.getLogger(__name__)
+
+# 每个连接最多缓存的事件数（客户端处理过慢时丢弃最旧的事件）
+MAX_PENDING_EVENTS = 16
+
+# 推送增量的录像器计数器
+_DELTA_COUNTERS = {
+    "segments": metrics.RECORDER_SEGMENTS,
+    "bytes": metrics.RECORDER_BYTES,
+    "failures": metrics.RECORDER_FFMPEG_FAILURES,
+    "gaps": metrics.RECORDER_GAPS,
+}
+
+
+def build_system_status(camera_manager, recording_manager, snapshot=None) -> dict:
+    """
+    系统状态（/api/status和状态推送共用，使用同一个快照保证各项计数一致）
+
+    只包含状态字段，ETag和状态推送随状态变化；FFmpeg任务计数每个任务都会变化，
+    通过metrics事件和/metrics提供
+    """
+    snapshot = snapshot or camera_manager.snapshot()
+    recording_count = sum(1 for camera_id in snapshot.cameras if recording_manager.is_recording(camera_id))
+    return {
+        "camera_version": snapshot.version,
+        "total_cameras": len(snapshot.cameras),
+        "enabled_cameras": len(snapshot.enabled),
+        "recording_cameras": recording_count
+    }
+
+
+def format_event(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    """格式化为SSE消息"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+class StatusBroadcaster:
+    """状态推送器"""
+
+    def __init__(self, camera_manager, recording_manager, interval: float = 1,
+                 metrics_interval: float = 10, heartbeat: float = 15):
+        """
+        初始化推送器
+
+        Args:
+            camera_manager: 摄像机管理器
+            recording_manager: 录像管理器
+            interval: 状态检查间隔（秒），只比较版本号和录像状态，开销很小
+            metrics_interval: 指标增量推送间隔（秒）
+            heartbeat: 没有事件时发送心跳的间隔（秒），防止代理断开空闲连接
+        """
+        self.camera_manager = camera_manager
+        self.recording_manager = recording_manager
+        self.interval = interval
+        self.metrics_interval = metrics_interval
+        self.heartbeat = heartbeat
+
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._task: Optional[asyncio.Task] = None
+
+        self._state_key = None
+        self._status_event: Optional[str] = None  # 最新的状态事件（新连接立即收到）
+        self._event_id = 0
+        self._last_totals = {}
+        self._last_metrics_time = time.monotonic()
+
+    def start(self):
+        """在当前事件循环中启动后台任务"""
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info("Status broadcaster started")
+
+    async def stop(self):
+        """停止后台任务并结束所有连接"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for queue in list(self._subscribers):
+            self._put(queue, None)
+        logger.info("Status broadcaster stopped")
+
+    def subscribe(self) -> asyncio.Queue:
+        """登记一个连接，返回事件队列（None表示推送器已停止）"""
+        queue = asyncio.Queue(maxsize=MAX_PENDING_EVENTS)
+        self._subscribers.add(queue)
+        if self._state_changed() or self._status_event is None:
+            self._publish_status()
+        else:
+            queue.put_nowait(self._status_event)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def _put(self, queue: asyncio.Queue, message: Optional[str]):
+        """放入事件，队列已满时丢弃最旧的事件"""
+        if queue.full():
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        queue.put_nowait(message)
+
+    def _broadcast(self, message: str):
+        for queue in list(self._subscribers):
+            self._put(queue, message)
+
+    def _next_id(self) -> int:
+        self._event_id += 1
+        return self._event_id
+
+    def _state_changed(self) -> bool:
+        """比较摄像机配置版本和各摄像机录像状态（不生成完整数据）"""
+        snapshot = self.camera_manager.snapshot()
+        key = (snapshot.version, tuple(
+            (camera_id, self.recording_manager.get_state(camera_id), camera.is_recording)
+            for camera_id, camera in snapshot.cameras.items()
+        ))
+        if key == self._state_key:
+            return False
+        self._state_key = key
+        return True
+
+    def _publish_status(self):
+        """生成状态事件并推送给所有连接"""
+        snapshot = self.camera_manager.snapshot()
+        data = {
+            "version": snapshot.version,
+            "cameras": [camera.to_dict() for camera in snapshot.cameras.values()],
+            "status": build_system_status(self.camera_manager, self.recording_manager, snapshot)
+        }
+        self._status_event = format_event("status", data, self._next_id())
+        self._broadcast(self._status_event)
+
+    def _publish_metrics(self):
+        """推送上次推送以来的录像器计数增量"""
+        now = time.monotonic()
+        cameras = {}
+        for name, counter in _DELTA_COUNTERS.items():
+            for (camera_id,), total in counter.totals().items():
+                last = self._last_totals.get((name, camera_id), 0)
+                self._last_totals[(name, camera_id)] = total
+                if total != last:
+                    cameras.setdefault(camera_id, {})[name] = total - last
+
+        data = {
+            "interval": round(now - self._last_metrics_time, 1),
+            "cameras": cameras,
+            "ffmpeg_jobs": get_scheduler().stats()
+        }
+        self._last_metrics_time = now
+        self._broadcast(format_event("metrics", data, self._next_id()))
+
+    async def _run(self):
+        last_sent = time.monotonic()
+        while True:
+            await asyncio.sleep(self.interval)
+
+            # 没有连接时不做任何检查
+            if not self._subscribers:
+                continue
+
+            try:
+                now = time.monotonic()
+                if self._state_changed():
+                    self._publish_status()
+                    last_sent = now
+                if now - self._last_metrics_time >= self.metrics_interval:
+                    self._publish_metrics()
+                    last_sent = now
+                if now - last_sent >= self.heartbeat:
+                    self._broadcast(": ping\n\n")
+                    last_sent = now
+            except Exception as e:
+                logger.error(f"Status broadcast failed: {e}")
@@ -0,0 +1,156 @@
+"""
+码流探测模块
+用FFmpeg打开RTSP流读取流信息（不录制、不解码），并发探测多个地址，
+用于批量导入摄像机前检查地址是否可用
+"""
+
+import re
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import logging
+
+from ffmpeg_scheduler import PRIORITY_PROBE, get_scheduler
+
+logger = logging.getLogger(__name__)
+
+_VIDEO_RE = re.compile(r"Stream #\d+:\d+.*?: Video: (\w+)(.*)")
+_AUDIO_RE = re.compile(r"Stream #\d+:\d+.*?: Audio: (\w+)")
+_RESOLUTION_RE = re.compile(r",\s(\d{2,5})x(\d{2,5})")
+_FPS_RE = re.compile(r"([\d.]+) fps")
+
+
+def parse_stream_info(stderr: str) -> dict:
+    """
+    解析FFmpeg输出的输入流信息
+
+    Returns:
+        {"video_codec", "width", "height", "fps", "audio_codec"}，未找到的项为None
+    """
+    info = {"video_codec": None, "width": None, "height": None, "fps": None, "audio_codec": None}
+
+    video = _VIDEO_RE.search(stderr)
+    if video:
+        info["video_codec"] = video.group(1)
+        details = video.group(2)
+        resolution = _RESOLUTION_RE.search(details)
+        if resolution:
+            info["width"] = int(resolution.group(1))
+            info["height"] = int(resolution.group(2))
+        fps = _FPS_RE.search(details)
+        if fps:
+            info["fps"] = float(fps.group(1))
+
+    audio = _AUDIO_RE.search(stderr)
+    if audio:
+        info["audio_codec"] = audio.group(1)
+
+    return info
+
+
+class StreamProber:
+    """码流探测器"""
+
+    def __init__(self, ffmpeg_path: str = "ffmpeg", timeout: float = 10, max_workers: int = 16):
+        """
+        初始化探测器
+
+        Args:
+            ffmpeg_path: FFmpeg可执行文件路径
+            timeout: 单个地址的探测超时时间（秒）
+            max_workers: 最大并发探测数
+        """
+        self.ffmpeg_path = ffmpeg_path
+        self.timeout = timeout
+        self.max_workers = max(1, max_workers)
+
+    def _build_ffmpeg_command(self, url: str) -> List[str]:
+        """构建探测命令：只打开输入读取流信息，不指定输出"""
+        cmd = [
+            self.ffmpeg_path,
+            "-hide_banner",
+            "-nostdin",
+        ]
+        if url.startswith("rtsp://") or url.startswith("rtsps://"):
+            cmd.extend([
+                "-rtsp_transport", "tcp",
+                # 连接/读取超时（微秒）
+                "-timeout", str(int(self.timeout * 1000000)),
+            ])
+        cmd.extend([
+            "-analyzeduration", "2000000",
+            "-probesize", "1000000",
+            "-i", url
+        ])
+        return cmd
+
+    def probe(self, url: str) -> dict:
+        """
+        探测单个地址
+
+        Returns:
+            {"reachable", "video_codec", "width", "height", "fps", "audio_codec", "latency_ms", "error"}
+        """
+        begin = time.monotonic()
+        try:
+            # 没有输出文件时FFmpeg在打印输入流信息后以非零状态退出，只根据输出判断；
+            # 经调度器执行（探测类别有单独的并发上限，不占用查询/后台任务的名额）
+            result = get_scheduler().run(
+                self._build_ffmpeg_command(url),
+                PRIORITY_PROBE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                timeout=self.timeout + 5
+            )
+            stderr = result.stderr.decode('utf-8', errors='replace')
+            error = None
+        except subprocess.TimeoutExpired:
+            stderr = ""
+            error = f"Probe timed out after {self.timeout}s"
+        except OSError as e:
+            stderr = ""
+            error = str(e)
+
+        latency_ms = round((time.monotonic() - begin) * 1000, 1)
+        info = parse_stream_info(stderr)
+        reachable = info["video_codec"] is not None
+
+        if not reachable and error is None:
+            lines = [line.strip() for line in stderr.splitlines() if line.strip()]
+            # 只有音频流时说明连接成功但没有视频，否则最后一行是FFmpeg的错误信息
+            error = lines[-1] if lines and not info["audio_codec"] else "No video stream found"
+
+        return {
+            "reachable": reachable,
+            **info,
+            "latency_ms": latency_ms,
+            "error": error
+        }
+
+    def probe_many(self, urls: List[str]) -> Dict[str, dict]:
+        """
+        并发探测多个地址（并发数不超过max_workers）
+
+        Returns:
+            {地址: 探测结果}
+        """
+        unique_urls = list(dict.fromkeys(urls))
+        if not unique_urls:
+            return {}
+
+        begin = time.monotonic()
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(unique_urls))) as executor:
+            results = dict(zip(unique_urls, executor.map(self.probe, unique_urls)))
+
+        reachable = sum(1 for r in results.values() if r["reachable"])
+        logger.info(f"Probed {len(unique_urls)} streams in {time.monotonic() - begin:.1f}s: "
+                    f"{reachable} reachable")
+        return results
+
+
+def mask_url(url: Optional[str]) -> Optional[str]:
+    """隐藏地址中的密码（用于日志）"""
+    if not url:
+        return url
+    return re.sub(r"(://[^:/@]+:)[^@]+@", r"\1***@", url)
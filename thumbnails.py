@@ -0,0 +1,268 @@
+"""
+缩略图模块
+录像段完成后在后台生成关键帧雪碧图(sprite sheet)和WebVTT索引，供时间轴拖动预览使用
+"""
+
+import math
+import os
+import queue
+import re
+import subprocess
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+import logging
+
+from ffmpeg_scheduler import PRIORITY_BACKGROUND, get_scheduler
+
+logger = logging.getLogger(__name__)
+
+THUMBNAILS_SUBDIR = "thumbnails"
+
+_PTS_TIME_RE = re.compile(r"pts_time:\s*([0-9.]+)")
+_VTT_CUE_RE = re.compile(
+    r"(\d+):(\d{2}):(\d{2})\.(\d{3})\s+-->\s+(\d+):(\d{2}):(\d{2})\.(\d{3})"
+)
+
+
+def format_vtt_time(seconds: float) -> str:
+    """秒数转换为WebVTT时间格式 HH:MM:SS.mmm"""
+    millis = int(round(max(0.0, seconds) * 1000))
+    hours, millis = divmod(millis, 3600 * 1000)
+    minutes, millis = divmod(millis, 60 * 1000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}.{millis:03d}"
+
+
+def parse_vtt(text: str) -> List[Tuple[float, float, str]]:
+    """
+    解析WebVTT文本
+
+    Returns:
+        [(开始秒数, 结束秒数, 内容), ...]
+    """
+    cues = []
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        match = _VTT_CUE_RE.match(line.strip())
+        if not match or i + 1 >= len(lines):
+            continue
+        g = [int(x) for x in match.groups()]
+        start = g[0] * 3600 + g[1] * 60 + g[2] + g[3] / 1000
+        end = g[4] * 3600 + g[5] * 60 + g[6] + g[7] / 1000
+        cues.append((start, end, lines[i + 1].strip()))
+    return cues
+
+
+def get_thumbnail_paths(video_file: str) -> Tuple[str, str]:
+    """
+    获取录像段对应的雪碧图和VTT路径
+
+    Returns:
+        (雪碧图路径, VTT路径)，位于录像所在目录的thumbnails子目录
+    """
+    video_path = Path(video_file)
+    thumb_dir = video_path.parent / THUMBNAILS_SUBDIR
+    return str(thumb_dir / f"{video_path.stem}.jpg"), str(thumb_dir / f"{video_path.stem}.vtt")
+
+
+def remove_thumbnails(video_file: str):
+    """删除录像段对应的缩略图文件（录像被清理时调用）"""
+    for path in get_thumbnail_paths(video_file):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Failed to remove thumbnail file {path}: {e}")
+
+
+class ThumbnailGenerator:
+    """雪碧图生成器（后台线程处理队列）"""
+
+    def __init__(self, ffmpeg_path: str = "ffmpeg", interval: float = 10,
+                 tile_width: int = 160, tile_height: int = 90, columns: int = 10,
+                 max_queue_size: int = 1000, timeout: float = 120):
+        """
+        初始化生成器
+
+        Args:
+            ffmpeg_path: FFmpeg可执行文件路径
+            interval: 相邻缩略图的最小时间间隔（秒，只取关键帧）
+            tile_width: 单个缩略图宽度
+            tile_height: 单个缩略图高度
+            columns: 雪碧图每行缩略图数量
+            max_queue_size: 待处理队列上限（超出时丢弃，不阻塞录像线程）
+            timeout: 单个录像段的FFmpeg超时时间（秒）
+        """
+        self.ffmpeg_path = ffmpeg_path
+        self.interval = interval
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.columns = columns
+        self.timeout = timeout
+
+        self.queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=max_queue_size)
+        self.thread: Optional[threading.Thread] = None
+        self.is_running = False
+
+    def enqueue(self, video_file: str, start_time: datetime, end_time: datetime):
+        """登记需要生成缩略图的录像段（录像线程调用，不阻塞）"""
+        try:
+            self.queue.put_nowait((video_file, start_time, end_time))
+        except queue.Full:
+            logger.warning(f"Thumbnail queue full, skipping {os.path.basename(video_file)}")
+
+    def start(self):
+        """启动后台生成线程"""
+        if self.is_running:
+            return
+
+        self.is_running = True
+        self.thread = threading.Thread(target=self._run, name="thumbnail-generator", daemon=True)
+        self.thread.start()
+        logger.info("Thumbnail generator started")
+
+    def stop(self):
+        """停止后台生成线程（未处理的段将被放弃）"""
+        if not self.is_running:
+            return
+
+        self.is_running = False
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=5)
+
+    def _run(self):
+        """后台线程：逐个处理完成的录像段"""
+        while self.is_running:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            video_file, start_time, end_time = item
+            try:
+                self.generate(video_file, (end_time - start_time).total_seconds())
+            except Exception as e:
+                logger.error(f"Error generating thumbnails for {video_file}: {e}")
+
+    def _build_ffmpeg_command(self, video_file: str, sprite_file: str, rows: int) -> List[str]:
+        """构建雪碧图命令：只解码关键帧，按最小间隔抽取并拼接成一张图"""
+        video_filter = (
+            f"select='isnan(prev_selected_t)+gte(t-prev_selected_t,{self.interval})',"
+            f"scale={self.tile_width}:{self.tile_height}:force_original_aspect_ratio=decrease,"
+            f"pad={self.tile_width}:{self.tile_height}:(ow-iw)/2:(oh-ih)/2,"
+            f"showinfo,"
+            f"tile={self.columns}x{rows}"
+        )
+        return [
+            self.ffmpeg_path,
+            "-hide_banner",
+            "-nostdin",
+            "-skip_frame", "nokey",
+            "-i", video_file,
+            "-an",
+            "-vf", video_filter,
+            "-vsync", "vfr",
+            "-frames:v", "1",
+            "-q:v", "5",
+            "-y",
+            sprite_file
+        ]
+
+    def generate(self, video_file: str, duration: float) -> bool:
+        """
+        为单个录像段生成雪碧图和VTT
+
+        Args:
+            video_file: 录像文件路径
+            duration: 录像时长（秒）
+
+        Returns:
+            是否成功
+        """
+        sprite_file, vtt_file = get_thumbnail_paths(video_file)
+        Path(sprite_file).parent.mkdir(parents=True, exist_ok=True)
+
+        max_tiles = max(1, math.ceil(duration / self.interval) + 1)
+        rows = max(1, math.ceil(max_tiles / self.columns))
+        cmd = self._build_ffmpeg_command(video_file, sprite_file, rows)
+
+        result = get_scheduler().run(
+            cmd,
+            priority=PRIORITY_BACKGROUND,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            timeout=self.timeout
+        )
+
+        if result.returncode != 0 or not os.path.exists(sprite_file):
+            logger.error(f"FFmpeg sprite error for {video_file}: {result.stderr[-2000:]}")
+            return False
+
+        # showinfo输出每个被选中关键帧的时间戳
+        times = [float(t) for t in _PTS_TIME_RE.findall(result.stderr)][:rows * self.columns]
+        if not times:
+            logger.warning(f"No keyframes found for sprite of {video_file}")
+            return False
+
+        sprite_name = os.path.basename(sprite_file)
+        lines = ["WEBVTT", ""]
+        for i, cue_start in enumerate(times):
+            cue_end = times[i + 1] if i + 1 < len(times) else max(duration, cue_start + 1)
+            x = (i % self.columns) * self.tile_width
+            y = (i // self.columns) * self.tile_height
+            lines.append(f"{format_vtt_time(cue_start)} --> {format_vtt_time(cue_end)}")
+            lines.append(f"{sprite_name}#xywh={x},{y},{self.tile_width},{self.tile_height}")
+            lines.append("")
+
+        tmp_file = vtt_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines))
+        os.replace(tmp_file, vtt_file)
+
+        logger.debug(f"Generated sprite with {len(times)} thumbnails for {os.path.basename(video_file)}")
+        return True
+
+    @staticmethod
+    def build_track(segments: List[dict], start_time: datetime, end_time: datetime,
+                    url_prefix: str) -> str:
+        """
+        拼接多个录像段的VTT，生成覆盖整个时间段的单一轨道
+
+        Args:
+            segments: 录像段信息列表（SegmentInfo.to_dict()格式）
+            start_time: 轨道起始时间（时间0点）
+            end_time: 轨道结束时间
+            url_prefix: 雪碧图URL前缀
+
+        Returns:
+            WebVTT文本
+        """
+        range_end = (end_time - start_time).total_seconds()
+        lines = ["WEBVTT", ""]
+
+        for segment in segments:
+            _, vtt_file = get_thumbnail_paths(segment['path'])
+            try:
+                with open(vtt_file, 'r', encoding='utf-8') as f:
+                    cues = parse_vtt(f.read())
+            except FileNotFoundError:
+                continue
+
+            offset = (datetime.fromisoformat(segment['start_time']) - start_time).total_seconds()
+            for cue_start, cue_end, payload in cues:
+                cue_start += offset
+                cue_end += offset
+                if cue_end <= 0 or cue_start >= range_end:
+                    continue
+                lines.append(f"{format_vtt_time(cue_start)} --> {format_vtt_time(min(cue_end, range_end))}")
+                lines.append(f"{url_prefix}{payload}")
+                lines.append("")
+
+        return "\n".join(lines)
@@ -5,21 +5,34 @@
 
 import subprocess
 import os
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import logging
 
+from ffmpeg_scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, get_scheduler
+from metrics import VIDEO_PROCESSOR_DURATION, timed_result
+from query_trace import QueryTrace, trace_stage
+
 logger = logging.getLogger(__name__)
 
 
 class VideoProcessor:
     """视频处理器类"""
 
-    def __init__(self, ffmpeg_path: str = "ffmpeg"):
+    def __init__(self, ffmpeg_path: str = "ffmpeg", priority: str = PRIORITY_INTERACTIVE):
+        """
+        Args:
+            ffmpeg_path: FFmpeg可执行文件路径
+            priority: FFmpeg任务优先级（所有调用都经过全局调度器排队）
+        """
         self.ffmpeg_path = ffmpeg_path
+        self.priority = priority
 
+    @timed_result(VIDEO_PROCESSOR_DURATION, "extract")
     def extract_time_range(self, input_file: str, output_file: str,
                           start_offset: float = 0, duration: float = None) -> bool:
         """
@@ -53,8 +66,9 @@ class VideoProcessor:
 
             logger.info(f"Extracting video: {' '.join(cmd)}")
 
-            result = subprocess.run(
+            result = get_scheduler().run(
                 cmd,
+                priority=self.priority,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 universal_newlines=True
@@ -91,6 +105,7 @@ class VideoProcessor:
             logger.error(f"Error extracting video: {e}")
             return False
 
+    @timed_result(VIDEO_PROCESSOR_DURATION, "concat")
     def concat_videos(self, input_files: List[str], output_file: str) -> bool:
         """
         合并多个视频文件
@@ -111,8 +126,9 @@ class VideoProcessor:
             concat_list_file = output_file + ".concat.txt"
             with open(concat_list_file, 'w', encoding='utf-8') as f:
                 for file_path in input_files:
+                    # 列表中的相对路径按列表文件所在目录解析，因此写入绝对路径
                     # 需要转义文件路径
-                    escaped_path = file_path.replace("'", "'\\''")
+                    escaped_path = os.path.abspath(file_path).replace("'", "'\\''")
                     f.write(f"file '{escaped_path}'\n")
 
             cmd = [
@@ -128,8 +144,9 @@ class VideoProcessor:
 
             logger.info(f"Concatenating {len(input_files)} videos to {output_file}")
 
-            result = subprocess.run(
+            result = get_scheduler().run(
                 cmd,
+                priority=self.priority,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 universal_newlines=True
@@ -152,6 +169,80 @@ class VideoProcessor:
             logger.error(f"Error concatenating videos: {e}")
             return False
 
+    @timed_result(VIDEO_PROCESSOR_DURATION, "keyframes")
+    def extract_keyframes(self, input_file: str, output_file: str, fps: float = 25,
+                          start_offset: float = 0, duration: float = None,
+                          stream_copy: bool = True) -> bool:
+        """
+        只提取关键帧并按固定帧率重排时间戳（用于延时视频）
+
+        Args:
+            input_file: 输入文件路径
+            output_file: 输出文件路径
+            fps: 输出帧率（每个关键帧占 1/fps 秒）
+            start_offset: 开始时间偏移（秒）
+            duration: 持续时间（秒），如果为None则提取到文件末尾
+            stream_copy: True时直接复制关键帧数据包（不解码），
+                         False时只解码关键帧并重新编码
+
+        Returns:
+            是否成功
+        """
+        try:
+            cmd = [self.ffmpeg_path, "-hide_banner", "-nostdin"]
+
+            if not stream_copy:
+                # 只解码关键帧
+                cmd.extend(["-skip_frame", "nokey"])
+
+            # 输入端seek，按关键帧定位
+            cmd.extend(["-ss", str(start_offset)])
+            if duration is not None:
+                cmd.extend(["-t", str(duration)])
+            cmd.extend(["-i", input_file, "-map", "0:v:0", "-an"])
+
+            if stream_copy:
+                # 丢弃非关键帧数据包，并把剩余数据包的时间戳重排为连续帧
+                cmd.extend([
+                    "-c:v", "copy",
+                    "-bsf:v", f"noise=drop=not(key),setts=ts=N/({fps}*TB)",
+                ])
+            else:
+                cmd.extend([
+                    "-vf", f"setpts=N/({fps}*TB)",
+                    "-r", str(fps),
+                    "-c:v", "libx264",
+                    "-preset", "veryfast",
+                    "-crf", "28",
+                ])
+
+            cmd.extend(["-y", output_file])
+
+            logger.info(f"Extracting keyframes: {' '.join(cmd)}")
+
+            result = get_scheduler().run(
+                cmd,
+                priority=self.priority,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True
+            )
+
+            if result.returncode == 0 and os.path.exists(output_file) and os.path.getsize(output_file) > 0:
+                return True
+
+            logger.warning(f"FFmpeg keyframe extraction failed for {input_file}: {result.stderr[-2000:]}")
+            try:
+                os.remove(output_file)
+            except OSError:
+                pass
+            return False
+
+        except Exception as e:
+            logger.error(f"Error extracting keyframes: {e}")
+            return False
+
+    @timed_result(VIDEO_PROCESSOR_DURATION, "duration")
     def get_video_duration(self, video_file: str) -> float:
         """
         获取视频时长
@@ -170,8 +261,9 @@ class VideoProcessor:
                 "-"
             ]
 
-            result = subprocess.run(
+            result = get_scheduler().run(
                 cmd,
+                priority=self.priority,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 universal_newlines=True
@@ -198,7 +290,8 @@ class RecordingSession:
     """录像会话类，用于处理开始-结束时间段内的录像提取"""
 
     def __init__(self, camera_id: str, start_time: datetime, end_time: datetime,
-                 video_files: List[dict], output_dir: str, ffmpeg_path: str = "ffmpeg"):
+                 video_files: List[dict], output_dir: str, ffmpeg_path: str = "ffmpeg",
+                 trace: Optional[QueryTrace] = None):
         """
         初始化录像会话
 
@@ -209,6 +302,7 @@ class RecordingSession:
             video_files: 视频文件列表（从recorder获取）
             output_dir: 输出目录
             ffmpeg_path: FFmpeg路径
+            trace: 查询耗时记录（None表示不记录）
         """
         self.camera_id = camera_id
         self.start_time = start_time
@@ -216,6 +310,7 @@ class RecordingSession:
         self.video_files = video_files
         self.output_dir = output_dir
         self.processor = VideoProcessor(ffmpeg_path)
+        self.trace = trace
 
         # 创建会话输出目录（添加毫秒和唯一ID以避免冲突）
         # 格式: camera_id_YYYYMMDD_HHMMSS_mmm_uid
@@ -230,6 +325,102 @@ class RecordingSession:
         # logger.info(f"[SESSION] Created session directory: {self.session_dir}")
         # logger.info(f"[SESSION] Processing {len(video_files)} video files")
 
+    def plan(self) -> List[tuple]:
+        """
+        规划需要输出的录像片段（不执行FFmpeg）
+
+        Returns:
+            [(源文件, 输出文件（None表示直接使用源文件）, 开始偏移秒数, 时长秒数), ...]
+        """
+        clips = []
+
+        for idx, file_info in enumerate(self.video_files):
+            file_path = file_info['path']
+            file_start_time = datetime.fromisoformat(file_info['start_time'])
+
+            # logger.info(f"[PROCESS] 处理文件 {idx+1}: {file_info['filename']}")
+
+            # 使用文件自身的结束时间（从文件名中解析得到）
+            # 如果文件信息中没有end_time，则使用实际视频时长
+            if file_info.get('end_time'):
+                file_end_time = datetime.fromisoformat(file_info['end_time'])
+                # logger.info(f"[PROCESS]   文件时间: {file_start_time.strftime('%H:%M:%S')} - {file_end_time.strftime('%H:%M:%S')}")
+            else:
+                # 降级处理：获取实际视频时长
+                duration = self.processor.get_video_duration(file_path)
+                file_end_time = file_start_time + timedelta(seconds=duration)
+                # logger.info(f"[PROCESS]   文件时间(估算): {file_start_time.strftime('%H:%M:%S')} - {file_end_time.strftime('%H:%M:%S')}")
+
+            # 检查文件是否与时间段有交集
+            if file_end_time < self.start_time or file_start_time > self.end_time:
+                # logger.info(f"[PROCESS]   跳过: 文件不在查询时间段内")
+                continue
+
+            # 计算需要提取的时间段
+            extract_start = max(0, (self.start_time - file_start_time).total_seconds())
+            # extract_end 不能超过文件的实际时长
+            extract_end = min(
+                (self.end_time - file_start_time).total_seconds(),
+                (file_end_time - file_start_time).total_seconds()
+            )
+            extract_duration = extract_end - extract_start
+
+            # logger.info(f"[PROCESS]   查询时段: {self.start_time.strftime('%H:%M:%S')} - {self.end_time.strftime('%H:%M:%S')}")
+            # logger.info(f"[PROCESS]   提取参数: start={extract_start:.1f}s, end={extract_end:.1f}s, duration={extract_duration:.1f}s")
+
+            # 最小片段时长阈值（秒）
+            min_clip_duration = 5.0  # 小于5秒的片段通常质量不佳，容易出现问题
+
+            # 检查片段时长是否太短
+            if extract_duration < min_clip_duration:
+                logger.warning(f"Skipping clip from {file_path}: duration too short ({extract_duration:.1f}s < {min_clip_duration}s)")
+                continue
+
+            # 如果需要提取的是整个文件（或接近整个文件，允许1秒误差）
+            file_duration = (file_end_time - file_start_time).total_seconds()
+            if extract_start <= 1.0 and abs(extract_end - file_duration) <= 1.0:
+                # logger.info(f"[PROCESS]   决定: 使用整个文件 (文件时长={file_duration:.1f}s)")
+                # logger.info(f"[PROCESS]   添加原文件: {file_path}")
+                clips.append((file_path, None, extract_start, extract_duration))
+            else:
+                # 需要裁剪
+                output_filename = f"clip_{idx:03d}_{os.path.basename(file_path)}"
+                output_path = os.path.join(self.session_dir, output_filename)
+
+                # logger.info(f"[PROCESS]   决定: 需要截取 (start={extract_start:.1f}s, duration={extract_duration:.1f}s)")
+                # logger.info(f"[PROCESS]   输出文件: {output_filename}")
+
+                clips.append((file_path, output_path, extract_start, extract_duration))
+
+        return clips
+
+    def run_clip(self, clip: tuple) -> Optional[str]:
+        """
+        生成一个规划好的片段
+
+        Returns:
+            片段文件路径，失败时返回None
+        """
+        file_path, output_path, extract_start, extract_duration = clip
+        if output_path is None:
+            if self.trace is not None:
+                self.trace.record_clip(self.camera_id, clip, 0.0, True)
+            return file_path
+
+        started = time.perf_counter()
+        success = self.processor.extract_time_range(
+            file_path, output_path,
+            start_offset=extract_start,
+            duration=extract_duration
+        )
+        if self.trace is not None:
+            self.trace.record_clip(self.camera_id, clip, time.perf_counter() - started, success)
+        if success:
+            # logger.info(f"[PROCESS]   截取成功")
+            return output_path
+        logger.error(f"[PROCESS]   截取失败！")
+        return None
+
     def process(self) -> List[str]:
         """
         处理录像会话，提取并返回所有相关的录像片段
@@ -240,71 +431,13 @@ class RecordingSession:
         processed_files = []
 
         try:
-            for idx, file_info in enumerate(self.video_files):
-                file_path = file_info['path']
-                file_start_time = datetime.fromisoformat(file_info['start_time'])
-
-                # logger.info(f"[PROCESS] 处理文件 {idx+1}: {file_info['filename']}")
-
-                # 使用文件自身的结束时间（从文件名中解析得到）
-                # 如果文件信息中没有end_time，则使用实际视频时长
-                if file_info.get('end_time'):
-                    file_end_time = datetime.fromisoformat(file_info['end_time'])
-                    # logger.info(f"[PROCESS]   文件时间: {file_start_time.strftime('%H:%M:%S')} - {file_end_time.strftime('%H:%M:%S')}")
-                else:
-                    # 降级处理：获取实际视频时长
-                    duration = self.processor.get_video_duration(file_path)
-                    file_end_time = file_start_time + timedelta(seconds=duration)
-                    # logger.info(f"[PROCESS]   文件时间(估算): {file_start_time.strftime('%H:%M:%S')} - {file_end_time.strftime('%H:%M:%S')}")
-
-                # 检查文件是否与时间段有交集
-                if file_end_time < self.start_time or file_start_time > self.end_time:
-                    # logger.info(f"[PROCESS]   跳过: 文件不在查询时间段内")
-                    continue
-
-                # 计算需要提取的时间段
-                extract_start = max(0, (self.start_time - file_start_time).total_seconds())
-                # extract_end 不能超过文件的实际时长
-                extract_end = min(
-                    (self.end_time - file_start_time).total_seconds(),
-                    (file_end_time - file_start_time).total_seconds()
-                )
-                extract_duration = extract_end - extract_start
-
-                # logger.info(f"[PROCESS]   查询时段: {self.start_time.strftime('%H:%M:%S')} - {self.end_time.strftime('%H:%M:%S')}")
-                # logger.info(f"[PROCESS]   提取参数: start={extract_start:.1f}s, end={extract_end:.1f}s, duration={extract_duration:.1f}s")
-
-                # 最小片段时长阈值（秒）
-                min_clip_duration = 5.0  # 小于5秒的片段通常质量不佳，容易出现问题
-
-                # 检查片段时长是否太短
-                if extract_duration < min_clip_duration:
-                    logger.warning(f"Skipping clip from {file_path}: duration too short ({extract_duration:.1f}s < {min_clip_duration}s)")
-                    continue
-
-                # 如果需要提取的是整个文件（或接近整个文件，允许1秒误差）
-                file_duration = (file_end_time - file_start_time).total_seconds()
-                if extract_start <= 1.0 and abs(extract_end - file_duration) <= 1.0:
-                    # logger.info(f"[PROCESS]   决定: 使用整个文件 (文件时长={file_duration:.1f}s)")
-                    # logger.info(f"[PROCESS]   添加原文件: {file_path}")
-                    processed_files.append(file_path)
-                else:
-                    # 需要裁剪
-                    output_filename = f"clip_{idx:03d}_{os.path.basename(file_path)}"
-                    output_path = os.path.join(self.session_dir, output_filename)
-
-                    # logger.info(f"[PROCESS]   决定: 需要截取 (start={extract_start:.1f}s, duration={extract_duration:.1f}s)")
-                    # logger.info(f"[PROCESS]   输出文件: {output_filename}")
-
-                    if self.processor.extract_time_range(
-                        file_path, output_path,
-                        start_offset=extract_start,
-                        duration=extract_duration
-                    ):
+            with trace_stage(self.trace, "plan"):
+                clips = self.plan()
+            with trace_stage(self.trace, "extract"):
+                for clip in clips:
+                    output_path = self.run_clip(clip)
+                    if output_path:
                         processed_files.append(output_path)
-                        # logger.info(f"[PROCESS]   截取成功")
-                    else:
-                        logger.error(f"[PROCESS]   截取失败！")
 
             logger.info(f"Processed {len(processed_files)} video clips for session")
 
@@ -321,7 +454,16 @@ class RecordingSession:
             包含所有处理后视频文件信息的字典
         """
         processed_files = self.process()
+        with trace_stage(self.trace, "assemble"):
+            return self.build_result(processed_files)
 
+    def build_result(self, processed_files: List[str]) -> dict:
+        """
+        由处理后的文件列表生成结果
+
+        Returns:
+            包含所有处理后视频文件信息的字典
+        """
         result = {
             "camera_id": self.camera_id,
             "start_time": self.start_time.isoformat(),
@@ -339,3 +481,147 @@ class RecordingSession:
                 })
 
         return result
+
+
+class TimelapseSession(RecordingSession):
+    """延时视频会话类，只使用关键帧把时间段内的录像压缩成一个短视频"""
+
+    def __init__(self, camera_id: str, start_time: datetime, end_time: datetime,
+                 video_files: List[dict], output_dir: str, ffmpeg_path: str = "ffmpeg",
+                 fps: float = 25, max_workers: int = 4):
+        """
+        初始化延时视频会话
+
+        Args:
+            fps: 输出帧率（每个关键帧占 1/fps 秒）
+            max_workers: 并行处理的录像段数
+            其余参数同RecordingSession
+        """
+        super().__init__(camera_id, start_time, end_time, video_files, output_dir, ffmpeg_path)
+        # 延时视频耗时较长，作为后台任务执行，不与交互查询争抢资源
+        self.processor = VideoProcessor(ffmpeg_path, priority=PRIORITY_BACKGROUND)
+        self.fps = fps
+        self.max_workers = max(1, max_workers)
+        self.missing_parts: List[str] = []  # 提取失败、未包含在延时视频中的录像段
+
+    def _extract_part(self, idx: int, file_info: dict, stream_copy: Optional[bool] = None) -> Optional[tuple]:
+        """
+        提取单个录像段在查询时间段内的关键帧
+
+        Args:
+            stream_copy: None时先尝试直接复制关键帧，失败时改为只解码关键帧重新编码（按段决定）
+
+        Returns:
+            (输出文件, 是否为复制模式)；录像段不在查询时间段内时返回None
+
+        Raises:
+            RuntimeError: 两种方式都无法提取
+        """
+        file_start_time = datetime.fromisoformat(file_info['start_time'])
+        if file_info.get('end_time'):
+            file_end_time = datetime.fromisoformat(file_info['end_time'])
+        else:
+            duration = self.processor.get_video_duration(file_info['path'])
+            file_end_time = file_start_time + timedelta(seconds=duration)
+
+        if file_end_time < self.start_time or file_start_time > self.end_time:
+            return None
+
+        extract_start = max(0, (self.start_time - file_start_time).total_seconds())
+        extract_end = min(
+            (self.end_time - file_start_time).total_seconds(),
+            (file_end_time - file_start_time).total_seconds()
+        )
+        if extract_end <= extract_start:
+            return None
+
+        output_path = os.path.join(self.session_dir, f"part_{idx:05d}.mp4")
+        modes = [True, False] if stream_copy is None else [stream_copy]
+        for copy in modes:
+            if self.processor.extract_keyframes(
+                file_info['path'], output_path,
+                fps=self.fps,
+                start_offset=extract_start,
+                duration=extract_end - extract_start,
+                stream_copy=copy
+            ):
+                return output_path, copy
+        raise RuntimeError(f"Failed to extract keyframes from {file_info['path']}")
+
+    def _try_extract_part(self, idx: int, file_info: dict,
+                          stream_copy: Optional[bool] = None) -> Optional[tuple]:
+        """同_extract_part，提取失败时记入missing_parts并返回None"""
+        try:
+            return self._extract_part(idx, file_info, stream_copy)
+        except Exception as e:
+            logger.error(f"Timelapse part {idx} of camera {self.camera_id} failed: {e}")
+            self.missing_parts.append(file_info.get('filename') or os.path.basename(file_info['path']))
+            return None
+
+    def process(self) -> List[str]:
+        """
+        并行提取各录像段的关键帧并合并为一个延时视频
+
+        每个录像段先尝试直接复制关键帧，失败时只对该段改为重新编码；
+        提取失败的录像段记入missing_parts（不会被静默省略）
+
+        Returns:
+            延时视频文件路径列表（成功时只有一个文件）
+        """
+        self.missing_parts = []
+        if not self.video_files:
+            return []
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(
+                    lambda item: self._try_extract_part(item[0], item[1]),
+                    enumerate(self.video_files)
+                ))
+
+            # 复制模式和重新编码的片段编码参数不同，不能直接合并：此时复制模式的片段也重新编码
+            modes = {part[1] for part in results if part}
+            if len(modes) > 1:
+                logger.info("Keyframe stream copy failed for some segments, re-encoding the others to match")
+                copied = [idx for idx, part in enumerate(results) if part and part[1]]
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    reencoded = executor.map(
+                        lambda idx: self._try_extract_part(idx, self.video_files[idx], stream_copy=False),
+                        copied
+                    )
+                    for idx, part in zip(copied, reencoded):
+                        results[idx] = part
+                modes = {False}
+
+            if self.missing_parts:
+                logger.error(f"Timelapse of camera {self.camera_id} is missing {len(self.missing_parts)} "
+                             f"segments: {self.missing_parts}")
+
+            parts = [part[0] for part in results if part]
+            if not parts:
+                logger.warning(f"No keyframes extracted for timelapse of camera {self.camera_id}")
+                return []
+
+            output_path = os.path.join(self.session_dir, "timelapse.mp4")
+            if not self.processor.concat_videos(parts, output_path):
+                return []
+
+            for part in parts:
+                try:
+                    os.remove(part)
+                except OSError:
+                    pass
+
+            logger.info(f"Timelapse created from {len(parts)} segments "
+                        f"({'copy' if modes == {True} else 'decode'} mode)")
+            return [output_path]
+
+        except Exception as e:
+            logger.error(f"Error processing timelapse session: {e}")
+            return []
+
+    def build_result(self, processed_files: List[str]) -> dict:
+        """结果中附带提取失败、未包含在延时视频中的录像段"""
+        result = super().build_result(processed_files)
+        result["missing_segments"] = list(self.missing_parts)
+        return result